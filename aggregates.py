@@ -0,0 +1,151 @@
+"""Precomputed program statistics over all stored submissions.
+
+The submission writer updates these counters in the same transaction as the
+insert (see storage.py), so reports read them directly instead of scanning
+the submissions. From the command line:
+
+    python aggregates.py            # print the current counts
+    python aggregates.py check      # recompute from scratch and compare (exit 1 on mismatch)
+    python aggregates.py rebuild    # recompute from scratch and replace the stored counts
+
+check and rebuild need pandas.
+"""
+import argparse
+import sys
+
+# Dimension -> the answer it counts. "subtype" counts "<diagnosis>: <subtype>" and
+# "total" counts every submission; together they cover the program reports.
+FIELD_DIMENSIONS = {
+    "country": "phys_country",
+    "diagnosis": "tcell_diagnosis",
+    "num_therapies": "num_therapies",
+    "prev_transplant": "prev_transplant",
+    "therapy1_outcome": "therapy1_outcome",
+    "therapy2_outcome": "therapy2_outcome",
+    "therapy3_outcome": "therapy3_outcome",
+}
+DIMENSIONS = ("total", "subtype") + tuple(FIELD_DIMENSIONS)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS aggregates (
+    dimension TEXT NOT NULL,
+    value TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (dimension, value)
+) WITHOUT ROWID;
+"""
+_UPSERT = (
+    "INSERT INTO aggregates (dimension, value, count) VALUES (?, ?, ?) "
+    "ON CONFLICT (dimension, value) DO UPDATE SET count = count + excluded.count"
+)
+
+
+def _subtype(form_data):
+    diagnosis = form_data.get("tcell_diagnosis")
+    subtype = form_data.get("ctcl_subtype" if diagnosis == "CTCL" else "ptcl_subtype")
+    return f"{diagnosis}: {subtype}" if diagnosis and subtype else None
+
+
+def increments(form_data):
+    # (dimension, value) pairs one submission adds 1 to
+    pairs = [("total", "")]
+    subtype = _subtype(form_data)
+    if subtype:
+        pairs.append(("subtype", subtype))
+    for dimension, name in FIELD_DIMENSIONS.items():
+        value = form_data.get(name)
+        if value is not None and value != "":
+            pairs.append((dimension, str(value)))
+    return pairs
+
+
+def apply(conn, pairs):
+    # Must run inside the caller's write transaction
+    counts = {}
+    for pair in pairs:
+        counts[pair] = counts.get(pair, 0) + 1
+    conn.executemany(_UPSERT, [(dimension, value, count) for (dimension, value), count in counts.items()])
+
+
+def read(conn):
+    result = {dimension: {} for dimension in DIMENSIONS}
+    for dimension, value, count in conn.execute("SELECT dimension, value, count FROM aggregates"):
+        result.setdefault(dimension, {})[value] = count
+    return result
+
+
+# ---- Full recomputation ----
+
+def compute(conn):
+    """Recompute every aggregate from the stored payloads in one vectorized pass.
+
+    The answers are extracted by SQLite (json_extract), so Python never parses
+    the payloads one by one; pandas then counts each dimension.
+    """
+    import pandas as pd
+
+    names = sorted({"ctcl_subtype", "ptcl_subtype", *FIELD_DIMENSIONS.values()})
+    columns = ", ".join(f"json_extract(payload, '$.{name}') AS {name}" for name in names)
+    df = pd.read_sql_query(f"SELECT {columns} FROM submissions", conn)
+
+    counts = {"total": {"": len(df)} if len(df) else {}}
+    diagnosis = df["tcell_diagnosis"]
+    subtype = df["ptcl_subtype"].where(diagnosis != "CTCL", df["ctcl_subtype"])
+    counts["subtype"] = diagnosis.str.cat(subtype, sep=": ").dropna().value_counts().to_dict()
+    for dimension, name in FIELD_DIMENSIONS.items():
+        values = df[name].dropna()
+        values = values[values != ""].astype(str)
+        counts[dimension] = values.value_counts().to_dict()
+    return {dimension: {str(value): int(count) for value, count in values.items()}
+            for dimension, values in counts.items()}
+
+
+def replace(conn, counts):
+    # Must run inside the caller's write transaction
+    conn.execute("DELETE FROM aggregates")
+    conn.executemany(
+        "INSERT INTO aggregates (dimension, value, count) VALUES (?, ?, ?)",
+        [(dimension, value, count) for dimension, values in counts.items() for value, count in values.items()],
+    )
+
+
+def diff(stored, computed):
+    # [(dimension, value, stored count, recomputed count)] wherever they disagree
+    mismatches = []
+    for dimension in sorted(set(stored) | set(computed)):
+        a, b = stored.get(dimension, {}), computed.get(dimension, {})
+        for value in sorted(set(a) | set(b)):
+            if a.get(value, 0) != b.get(value, 0):
+                mismatches.append((dimension, value, a.get(value, 0), b.get(value, 0)))
+    return mismatches
+
+
+def main():
+    from storage import get_store
+
+    parser = argparse.ArgumentParser(description="Show, verify or rebuild the submission aggregates.")
+    parser.add_argument("command", nargs="?", choices=("show", "check", "rebuild"), default="show")
+    args = parser.parse_args()
+    store = get_store()
+
+    if args.command == "show":
+        for dimension, values in store.aggregates().items():
+            print(dimension)
+            for value, count in sorted(values.items(), key=lambda item: -item[1]):
+                print(f"  {value or '(all)'}: {count}")
+        return 0
+
+    if args.command == "check":
+        mismatches = store.check_aggregates()
+        for dimension, value, stored, computed in mismatches:
+            print(f"{dimension} {value!r}: stored {stored}, recomputed {computed}")
+        print("aggregates match" if not mismatches else f"{len(mismatches)} mismatch(es)")
+        return 1 if mismatches else 0
+
+    mismatches = store.rebuild_aggregates()
+    print(f"aggregates rebuilt ({len(mismatches)} value(s) corrected)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
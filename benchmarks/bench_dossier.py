@@ -0,0 +1,51 @@
+"""Dossier rendering throughput: inline vs. the background process pool.
+
+Renders the same fully filled-in submission N times on the calling thread and
+then through DossierRenderer with 1..--workers processes, reporting dossiers
+per second. The pool numbers include the pickling round trip per dossier.
+
+    python benchmarks/bench_dossier.py [--count 2000] [--workers 2]
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_session_memory import ANSWERS  # noqa: E402
+from dossier import DossierRenderer, render_dossier  # noqa: E402
+from serializers import serialize_submission  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dossier rendering.")
+    parser.add_argument("--count", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+    record = serialize_submission(ANSWERS, 1, time.time())
+
+    start = time.perf_counter()
+    for _ in range(args.count):
+        render_dossier(record)
+    elapsed = time.perf_counter() - start
+    print(f"inline      {args.count / elapsed:8.0f} dossiers/s  ({elapsed / args.count * 1000:.2f} ms each)")
+
+    for workers in range(1, args.workers + 1):
+        renderer = DossierRenderer(max_workers=workers)
+        renderer.render(record)  # start the worker processes outside the timing
+        start = time.perf_counter()
+        # As many concurrent callers as workers, like the outbox send threads
+        with ThreadPoolExecutor(max_workers=workers) as callers:
+            results = list(callers.map(lambda _: renderer.render(record), range(args.count)))
+        elapsed = time.perf_counter() - start
+        renderer.shutdown()
+        failed = sum(result is None for result in results)
+        print(f"pool x{workers}     {args.count / elapsed:8.0f} dossiers/s  ({failed} failed)")
+
+
+if __name__ == "__main__":
+    main()
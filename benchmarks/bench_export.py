@@ -0,0 +1,81 @@
+"""Bulk export throughput and peak memory at different store sizes.
+
+Fills a throwaway submission store with synthetic submissions, then exports it
+to JSONL, gzipped CSV and parquet (if pyarrow is installed), reporting rows per
+second and the traced peak allocation. Peak memory should stay roughly flat as
+--rows grows, since records are streamed in chunks.
+
+    python benchmarks/bench_export.py [--rows 10000 100000]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from export import export  # noqa: E402
+from storage import _INSERT, SubmissionStore, to_row  # noqa: E402
+
+
+def synthetic_submission(rng, i):
+    return {
+        "phys_country": rng.choice(["Switzerland", "France", "Germany"]),
+        "phys_name": f"Dr Example {i}", "phys_email": f"dr{i}@example.org", "phys_hospital": "Example Hospital",
+        "patient_sex": rng.choice(["Male", "Female"]), "birth_year": rng.randint(1940, 2000),
+        "height": rng.randint(150, 200), "weight": rng.randint(45, 120), "diag_year": rng.randint(2010, 2026),
+        "tcell_diagnosis": "PTCL", "ptcl_subtype": rng.choice(["AITL", "ALCL", "PTCL-NOS"]),
+        "time_to_diagnosis": rng.randint(0, 12), "time_to_diagnosis_unit": "months",
+        "diag_tests": ["Flow Cytometry", "Immunohistochemistry"], "specimen_type": ["Biopsy"],
+        "biomarkers": [], "cytogenetics": "No", "specimens_avail": "No", "num_therapies": "1",
+        "therapy1_type": "CHOP", "therapy1_cycles": 6, "therapy1_outcome": rng.choice(["CR", "PR", "SD", "PD"]),
+        "therapy1_duration": 5, "prev_transplant": "No", "agree_decl": True,
+        "phys_signature": f"Dr Example {i}", "sign_date": date(2026, 1 + i % 12, 1 + i % 28),
+    }
+
+
+def fill(path, rows, seed=1):
+    # Bulk-load directly; going through SubmissionStore.save() would time the writer, not the export
+    rng = random.Random(seed)
+    SubmissionStore(path)
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany(_INSERT, (to_row(synthetic_submission(rng, i)) for i in range(rows)))
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the streaming submission export.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000])
+    args = parser.parse_args()
+    try:
+        import pyarrow  # noqa: F401
+        formats = ("jsonl", "csv", "parquet")
+    except ImportError:
+        formats = ("jsonl", "csv")
+
+    for rows in args.rows:
+        directory = tempfile.mkdtemp(prefix="bench-export-")
+        path = os.path.join(directory, "submissions.sqlite3")
+        fill(path, rows)
+        store = SubmissionStore(path)
+        for fmt in formats:
+            output = os.path.join(directory, "export." + fmt + (".gz" if fmt == "csv" else ""))
+            tracemalloc.start()
+            start = time.perf_counter()
+            count = export(output, fmt, store=store)
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"{count:>7} rows  {fmt:<8} {count / elapsed:>9.0f} rows/s  peak {peak / 2**20:6.1f} MiB  "
+                  f"file {os.path.getsize(output) / 2**20:6.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
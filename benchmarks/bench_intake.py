@@ -0,0 +1,119 @@
+"""Bulk intake throughput.
+
+Writes a synthetic JSONL batch (about 1% of the lines invalid), runs it
+through bulk_intake into a throwaway store, and reports records per second for
+the whole pipeline and for parsing plus validation alone. Running the same
+batch a second time measures the duplicate path. Finally checks that lines
+with values of the wrong JSON type are rejected one by one rather than
+aborting the batch.
+
+    python benchmarks/bench_intake.py [--records 20000]
+"""
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="bench-intake-"))
+
+from bulk_intake import _check, run_intake  # noqa: E402
+from storage import SubmissionStore  # noqa: E402
+
+
+def synthetic_line(rng, i):
+    birth_year = rng.randint(1940, 2000)
+    count = rng.choice(["0", "1", "2"])
+    record = {
+        "phys_country": rng.choice(["Switzerland", "France", "Germany"]),
+        "phys_name": f"Dr Example {i % 50}", "phys_email": f"dr{i % 50}@example.org",
+        "phys_hospital": "Example Hospital",
+        "patient_sex": rng.choice(["Male", "Female"]), "birth_year": birth_year,
+        "height": rng.randint(150, 200), "weight": rng.randint(45, 120),
+        "diag_year": rng.randint(max(birth_year, 2000), 2024),
+        "tcell_diagnosis": "PTCL", "ptcl_subtype": rng.choice(["AITL", "ALCL", "PTCL-NOS"]),
+        "time_to_diagnosis": rng.randint(0, 12), "time_to_diagnosis_unit": "months",
+        "diag_tests": ["Flow Cytometry", "Immunohistochemistry"], "specimen_type": ["Biopsy"],
+        "cytogenetics": "No", "specimens_avail": "No", "num_therapies": count,
+        "prev_transplant": "No", "agree_decl": True, "phys_signature": f"Dr Example {i % 50}",
+        "sign_date": (date(2025, 1, 1) + timedelta(days=i % 365)).isoformat(),
+    }
+    for line in range(1, int(count) + 1):
+        record.update({
+            f"therapy{line}_type": rng.choice(["CHOP", "CHOEP", "GDP"]), f"therapy{line}_cycles": 6,
+            f"therapy{line}_outcome": rng.choice(["CR", "PR", "SD", "PD"]), f"therapy{line}_duration": 5,
+        })
+    if i % 100 == 99:
+        # Invalid: diagnosed before birth, and no diagnostic tests
+        record["diag_year"] = 1950
+        record["birth_year"] = 1990
+        del record["diag_tests"]
+    return json.dumps(record)
+
+
+# Valid lines but for one answer of a type no widget produces
+WRONG_TYPES = (
+    {"phys_country": ["France"]},
+    {"birth_year": {"a": 1}},
+    {"birth_year": True},
+    {"num_therapies": "1", "therapy1_type": 5},
+    {"diag_tests": [["Flow Cytometry"]]},
+    {"specimen_type": "Biopsy"},
+    {"phys_name": []},
+    {"height": "180"},
+    {"agree_decl": "yes"},
+)
+
+
+def check_wrong_types(rng, store):
+    lines = []
+    for i, change in enumerate(WRONG_TYPES):
+        record = json.loads(synthetic_line(rng, i))
+        record.update(change)
+        lines.append(json.dumps(record))
+    report = io.StringIO()
+    summary, _ = run_intake(lines, "bench", report, notify=False, store=store)
+    results = [json.loads(line) for line in report.getvalue().splitlines()]
+    accepted = [WRONG_TYPES[i] for i, result in enumerate(results) if result["status"] != "invalid"]
+    print(f"wrong types: {summary.counts['invalid']} of {len(lines)} lines rejected")
+    for change in accepted:
+        print(f"  accepted: {change}")
+    return len(results) == len(lines) and not accepted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bulk intake throughput.")
+    parser.add_argument("--records", type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    # Distinct answers per line, so nothing is a duplicate on the first run
+    lines = [synthetic_line(rng, i) for i in range(args.records)]
+    store = SubmissionStore(os.path.join(tempfile.mkdtemp(prefix="bench-intake-"), "submissions.sqlite3"))
+
+    start = time.perf_counter()
+    for i, line in enumerate(lines):
+        _check(i + 1, line)
+    validate_rate = args.records / (time.perf_counter() - start)
+    print(f"parse + validate:     {validate_rate:8.0f} records/s")
+
+    for label in ("first run", "repeat (duplicates)"):
+        summary, _ = run_intake(lines, "bench", notify=False, store=store)
+        rate = summary.lines / summary.elapsed
+        counts = summary.counts
+        print(f"intake, {label + ':':<20} {rate:8.0f} records/s  "
+              f"({counts['created']} stored, {counts['duplicate']} duplicate, {counts['invalid']} rejected)")
+
+    ok = check_wrong_types(rng, store)
+    print("ok" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Rerun wall time: whole-script reruns vs. fragment-scoped section reruns.
+
+Before sections were fragments, every widget change re-executed app.py top to
+bottom; now it re-executes only the section containing the widget. This drives
+the app headlessly with Streamlit's AppTest and, for every page, times a full
+script rerun against a rerun of just one section.
+
+    python benchmarks/bench_reruns.py [--repeat 50]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="bench-reruns-"))
+
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+
+def _section_script(section_name):
+    # Executes exactly what a fragment rerun of `section_name` executes
+    import streamlit as st
+    from form_render import render_section
+    from form_schema import SECTIONS
+
+    if "form_data" not in st.session_state:
+        st.session_state.form_data = {}
+    render_section(SECTIONS[section_name], st.session_state.form_data)
+
+
+def _time_runs(at, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        at.run()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def _summary(samples):
+    samples = sorted(samples)
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    # Sections whose widgets users change most on each page
+    targets = {1: "physician", 2: "diagnosis", 3: "diagnostics", 4: "therapy2", 5: "declaration"}
+
+    app = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=60).run()
+    app.button(key="hpc").click().run()
+
+    print(f"{'page':<6}{'section':<14}{'full p50 ms':>12}{'full p95 ms':>12}{'frag p50 ms':>12}{'frag p95 ms':>12}")
+    for page, section_name in targets.items():
+        if page == 4:
+            app.selectbox(key="num_therapies_widget").select("3").run()
+        full = _summary(_time_runs(app, args.repeat))
+
+        fragment = AppTest.from_function(_section_script, args=(section_name,), default_timeout=60)
+        fragment.session_state["form_data"] = dict(app.session_state["form_data"])
+        fragment.run()
+        frag = _summary(_time_runs(fragment, args.repeat))
+
+        print(f"{page:<6}{section_name:<14}{full[0]:>12.2f}{full[1]:>12.2f}{frag[0]:>12.2f}{frag[1]:>12.2f}")
+        if page < 5:
+            app.button(key="next").click().run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Full-text search latency over a large submission history.
+
+Fills a throwaway store with synthetic submissions through the normal writer
+(so the indexing cost is part of the reported write rate), then times the
+admin dashboard's two search queries, the first page and the match count,
+for common and rare words, prefixes, phrases, field-restricted terms, a
+search combined with a filter and a page deep into the results.
+
+    python benchmarks/bench_search.py [--records 200000] [--repeat 20]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="bench-search-"))
+
+from storage import SubmissionStore  # noqa: E402
+
+REGIMENS = (
+    "CHOP", "R-CHOP", "CHOEP", "CHP-BV", "GDP", "ICE", "DHAP", "GemOx", "brentuximab vedotin",
+    "romidepsin", "pralatrexate", "belinostat", "bendamustine", "gemcitabine", "alemtuzumab",
+    "mogamulizumab", "interferon alpha", "bexarotene", "methotrexate", "pembrolizumab",
+)
+CONDITIONING = ("BEAM", "BEAC", "fludarabine melphalan", "treosulfan fludarabine", "TBI 2 Gy")
+CYTOGENETICS = (
+    "t(14;18)", "del(17p)", "TP53 mutation", "complex karyotype", "trisomy 3",
+    "t(2;5) NPM1-ALK", "DUSP22 rearrangement", "TP63 rearrangement",
+)
+BIOMARKERS = ("CD30 positive", "PD-L1 high", "Ki-67 80%", "CD30 negative", "EBER positive")
+
+QUERIES = (
+    ("common word", "chop", {}),
+    ("rare word", "study42", {}),
+    ("prefix", "bren*", {}),
+    ("short prefix", "gd*", {}),
+    ("phrase", '"t(14;18)"', {}),
+    ("field", "transplant:melphalan", {}),
+    ("two words", "gemcitabine romidepsin", {}),
+    ("with filter", "chop", {"phys_country": "France", "tcell_diagnosis": "CTCL"}),
+    ("no match", "zzzz", {}),
+)
+
+
+def synthetic(rng, i):
+    count = rng.choice(["0", "1", "2", "3"])
+    transplant = rng.choice(["No", "No", "Autologous", "Allogenic"])
+    diagnosis = rng.choice(["PTCL", "CTCL"])
+    record = {
+        "phys_country": rng.choice(["Switzerland", "France", "Germany", "United Kingdom"]),
+        "tcell_diagnosis": diagnosis, "num_therapies": count, "prev_transplant": transplant,
+    }
+    for line in range(1, int(count) + 1):
+        regimen = " + ".join(rng.sample(REGIMENS, rng.choice([1, 1, 2])))
+        if rng.random() < 0.01:
+            regimen += f" (study{rng.randint(0, 99)})"
+        record[f"therapy{line}_type"] = regimen
+    if transplant == "Autologous":
+        record["auto_regimen"] = rng.choice(CONDITIONING)
+    elif transplant == "Allogenic":
+        record["allo_regimen"] = rng.choice(CONDITIONING)
+        record["allo_bridging"] = rng.choice(REGIMENS)
+    if rng.random() < 0.3:
+        record["cytogenetic_text"] = ", ".join(rng.sample(CYTOGENETICS, rng.choice([1, 2])))
+    if rng.random() < 0.2:
+        record["biom_other_text"] = rng.choice(BIOMARKERS)
+    if diagnosis == "CTCL" and rng.random() < 0.1:
+        record["ctcl_other"] = "primary cutaneous CD4+ small/medium"
+    return record
+
+
+def _time(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return result, statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark full-text search over submissions.")
+    parser.add_argument("--records", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--page-size", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    store = SubmissionStore(os.path.join(tempfile.mkdtemp(prefix="bench-search-"), "submissions.sqlite3"))
+    start = time.perf_counter()
+    chunk = 5000
+    for first in range(0, args.records, chunk):
+        store.save_many([(synthetic(rng, i), None) for i in range(first, min(first + chunk, args.records))])
+    elapsed = time.perf_counter() - start
+    print(f"stored {args.records} submissions at {args.records / elapsed:.0f}/s (indexing included)\n")
+
+    limit = args.page_size + 1
+    print(f"{'query':<14} {'matches':>8}   {'page p50':>9} {'p95':>7}   {'count p50':>9} {'p95':>7}")
+    slowest = 0.0
+    for label, text, filters in QUERIES:
+        _, page50, page95 = _time(lambda: store.list_page(limit, text=text, **filters), args.repeat)
+        total, count50, count95 = _time(lambda: store.count_matching(text=text, **filters), args.repeat)
+        slowest = max(slowest, page95, count95)
+        print(f"{label:<14} {total:>8}   {page50:>7.1f}ms {page95:>5.1f}ms   {count50:>7.1f}ms {count95:>5.1f}ms")
+
+    # Keyset paging: a page from the middle of the results costs what the first does
+    rows = store.list_page(limit, text="chop")
+    middle = rows[-1]["id"] // 2
+    _, deep50, deep95 = _time(lambda: store.list_page(limit, before_id=middle, text="chop"), args.repeat)
+    slowest = max(slowest, deep95)
+    print(f"{'deep page':<14} {'':>8}   {deep50:>7.1f}ms {deep95:>5.1f}ms")
+    print(f"\nslowest p95: {slowest:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Idle-session spilling: memory freed, spill size, budget, and rehydration.
+
+Simulates N filled-in form sessions (the record, validator and widget values
+of the page on screen each one keeps in st.session_state) registered with a
+SessionManager, then:
+
+- ages most of them past SESSION_IDLE_SECONDS and sweeps: reports the memory
+  freed (tracemalloc), the bytes on disk per session and the sweep time; the
+  widget values are not spilled, so they stay counted as resident
+- lowers the budget and sweeps: the resident total must end up under it, with
+  the least recently active sessions spilled first
+- brings every spilled session back: each record must equal its answers
+  before the spill, including the changes not yet autosaved
+- drops the sessions: their spills must be deleted
+
+    python benchmarks/bench_session_lifecycle.py [--sessions 2000]
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="bench-sessions-"))
+
+from bench_session_memory import ANSWERS  # noqa: E402
+from form_record import FormRecord  # noqa: E402
+from form_schema import PAGES  # noqa: E402
+from sessions import SessionManager, SpillStore  # noqa: E402
+from validation import Validator  # noqa: E402
+
+
+def new_session(manager, i):
+    # Answers arrive from the browser, so no two sessions share their strings
+    record = FormRecord({name: (value + " ")[:-1] if isinstance(value, str) else value
+                         for name, value in ANSWERS.items()})
+    record.prune()
+    record.pop_dirty()
+    # A few answers changed since the last autosave
+    record["phys_name"] = f"Dr Example {i}"
+    validator = Validator()
+    validator.problems(record)
+    # The widget values of the page on screen, as Streamlit holds them
+    widgets = [record[field.name] for section in PAGES[4] for sub in section.walk()
+               for field in sub.fields if field.name in record]
+    handle = manager.register()
+    manager.touch(handle, record, validator)
+    manager.measure(handle, record, validator, widgets)
+    return handle, record, validator
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark spilling idle form sessions to disk.")
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--abandoned", type=float, default=0.8, help="fraction of sessions left idle")
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix="bench-sessions-"), "sessions.sqlite3")
+    manager = SessionManager(SpillStore(path), idle=900, budget=1 << 40, min_idle=30, start=False)
+    failures = []
+
+    tracemalloc.start()
+    sessions = [new_session(manager, i) for i in range(args.sessions)]
+    # As JSON, so the copies hold no references to the answers themselves
+    expected = [(json.dumps(record.to_dict(), default=str), set(record._dirty)) for _, record, _ in sessions]
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    resident = manager.resident_bytes
+    print(f"{args.sessions} sessions, {resident / args.sessions:.0f} bytes of answers and widget values each (estimated)")
+
+    # Abandon most sessions: their last activity is older than the idle TTL
+    abandoned = int(args.sessions * args.abandoned)
+    for handle, _, _ in sessions[:abandoned]:
+        handle.last_active -= manager.idle + 1
+    start = time.perf_counter()
+    spilled = manager.sweep()
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    freed = before - tracemalloc.get_traced_memory()[0]
+    _, disk = manager.store.stats()
+    print(f"idle sweep:   spilled {spilled} in {elapsed * 1000:.0f} ms "
+          f"({elapsed / max(spilled, 1) * 1e6:.0f} us each), "
+          f"freed {freed / max(spilled, 1):.0f} bytes each, {disk / max(spilled, 1):.0f} compressed bytes on disk each")
+    if spilled != abandoned:
+        failures.append(f"idle sweep spilled {spilled}, expected {abandoned}")
+    # What the budget gains per spill: the widget values and the emptied record stay
+    released = (resident - manager.resident_bytes) / max(spilled, 1)
+
+    # Spike: the rest are past the minimum idle time, and the budget takes spilling half of them
+    active = sessions[abandoned:]
+    for i, (handle, _, _) in enumerate(active):
+        handle.last_active = time.monotonic() - manager.min_idle - len(active) + i
+    manager.budget = manager.resident_bytes - int(released * len(active) / 2)
+    spilled = manager.sweep()
+    kept = [handle.spilled for handle, _, _ in active]
+    print(f"budget sweep: spilled {spilled} of {len(active)}, "
+          f"{manager.resident_bytes} bytes resident for a {manager.budget} byte budget")
+    if manager.resident_bytes > manager.budget:
+        failures.append("resident bytes over budget after the sweep")
+    if kept != sorted(kept, reverse=True):
+        failures.append("the budget did not spill the least recently active sessions first")
+
+    # Everyone comes back
+    start = time.perf_counter()
+    restored = sum(manager.touch(handle, record, validator) for handle, record, validator in sessions)
+    elapsed = time.perf_counter() - start
+    print(f"rehydrate:    {restored} sessions in {elapsed * 1000:.0f} ms ({elapsed / max(restored, 1) * 1e6:.0f} us each)")
+    mismatched = sum(
+        1 for (_, record, _), (data, dirty) in zip(sessions, expected)
+        if json.dumps(record.to_dict(), default=str) != data or record._dirty != dirty
+    )
+    if mismatched:
+        failures.append(f"{mismatched} session(s) restored differently")
+    if manager.resident_bytes != resident:
+        failures.append(f"resident bytes {manager.resident_bytes} after rehydration, expected {resident}")
+
+    # Sessions end while spilled: their spills are deleted by the next sweep
+    manager.budget = 1 << 40
+    for handle, _, _ in sessions:
+        handle.last_active -= manager.idle + 1
+    manager.sweep()
+    del sessions, active, handle
+    gc.collect()
+    manager.sweep()
+    left, _ = manager.store.stats()
+    print(f"sessions ended: {manager.sessions()} tracked, {left} spill(s) left")
+    if left or manager.sessions() or manager.resident_bytes:
+        failures.append("spills or tracked sessions left after the sessions ended")
+
+    print("ok" if not failures else "FAILED: " + "; ".join(failures))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
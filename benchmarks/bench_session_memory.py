@@ -0,0 +1,89 @@
+"""Per-session memory of the form answers: plain dicts vs. FormRecord.
+
+Compares the session_state footprint of one fully filled-in form (a PTCL
+patient who was first entered as CTCL, with three therapy lines later cut
+to one) in the previous layout -- a form_data dict, a *_widget copy of every
+answer and the draft autosave snapshot, including stale branches -- with a
+FormRecord plus the *_widget keys of the page currently shown.
+
+    python benchmarks/bench_session_memory.py [--sessions 1000]
+"""
+import argparse
+import os
+import sys
+import tracemalloc
+from datetime import date
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from form_record import FormRecord  # noqa: E402
+from form_schema import FIELDS, PAGES  # noqa: E402
+from load_test import deep_sizeof  # noqa: E402
+
+ANSWERS = {
+    "phys_country": "Germany", "phys_name": "Dr Anna Example", "phys_email": "anna@example.org",
+    "phys_hospital": "Universitätsklinikum Example", "patient_sex": "Female", "birth_year": 1961,
+    "height": 168, "weight": 64, "diag_year": 2021, "tcell_diagnosis": "PTCL", "ptcl_subtype": "AITL",
+    "ctcl_subtype": "Mycosis Fungoides", "time_to_diagnosis": 3, "time_to_diagnosis_unit": "months",
+    "diag_tests": ["Flow Cytometry", "Immunohistochemistry"], "specimen_type": ["Biopsy"],
+    "biomarkers": ["TFH Markers", "EBV"], "cytogenetics": "No", "specimens_avail": "Yes",
+    "specimen_available_type": ["FFPE"], "num_therapies": "1",
+    "therapy1_type": "CHOP", "therapy1_cycles": 6, "therapy1_outcome": "PR", "therapy1_duration": 5,
+    "therapy2_type": "GDP", "therapy2_cycles": 4, "therapy2_outcome": "SD", "therapy2_duration": 3,
+    "therapy3_type": "Romidepsin", "therapy3_cycles": 2, "therapy3_outcome": "PD", "therapy3_duration": 2,
+    "prev_transplant": "No", "agree_decl": True, "phys_signature": "Dr Anna Example",
+    "sign_date": date(2026, 5, 4),
+}
+
+
+def legacy_state():
+    state = {"form_data": {k: (list(v) if isinstance(v, list) else v) for k, v in ANSWERS.items()}}
+    state.update({FIELDS[k].key: (list(v) if isinstance(v, list) else v) for k, v in ANSWERS.items()})
+    state["draft_snapshot"] = {k: (list(v) if isinstance(v, list) else v) for k, v in ANSWERS.items()}
+    return state
+
+
+def record_state(page=4):
+    record = FormRecord(ANSWERS)
+    record.prune()
+    # Autosave drains the dirty set on every run
+    record.pop_dirty()
+    state = {"form_data": record}
+    for section in PAGES[page]:
+        for sub in section.walk():
+            for field in sub.fields:
+                if field.name in record:
+                    value = record[field.name]
+                    state[field.key] = list(value) if isinstance(value, list) else value
+    return state
+
+
+def _traced(factory, sessions):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    states = [factory() for _ in range(sessions)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return allocated / len(states)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=1000)
+    args = parser.parse_args()
+
+    legacy, compact = legacy_state(), record_state()
+    print(f"{'layout':<28}{'deep size B':>12}{'traced B/session':>18}{'keys':>6}")
+    for name, state, factory in (("dict + widgets + snapshot", legacy, legacy_state),
+                                 ("FormRecord + page widgets", compact, record_state)):
+        print(f"{name:<28}{deep_sizeof(state):>12}{_traced(factory, args.sessions):>18.0f}{len(state):>6}")
+    print(f"form_data alone: dict {deep_sizeof(legacy['form_data'])} B, "
+          f"FormRecord {deep_sizeof(compact['form_data'])} B")
+    print(f"stale branch answers pruned: {len(ANSWERS) - len(compact['form_data'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Shared state across server processes: correctness under contention and scaling.
+
+For each backend (a SQLite file, and the Redis-protocol stand-in from
+redis_stub.py unless --redis-url points at a real server) N worker processes,
+standing in for N replicas, concurrently:
+
+- race to claim the same idempotency keys: every key must be won exactly once
+- increment shared counters: no increment may be lost
+- draw from one shared rate limit: no more than its burst may be granted
+- save drafts that the parent then loads through a fresh store
+
+The parent then checks that releasing a claim frees the key but never removes
+a submission stored under it meanwhile, and reports the aggregate operation
+rate per N. The stand-in serves every command under one lock in one Python
+process, so it does not scale like a real server; use --redis-url to measure
+that.
+
+    python benchmarks/bench_shared_state.py [--replicas 1 2 4] [--ops 2000] [--redis-url redis://host:6379/0]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from redis_stub import RedisStub  # noqa: E402
+
+CLAIM_KEYS = 200
+RATE_BURST = 50
+
+
+def _replica(url, index, ops, run_id):
+    # One "server process": its own connections, limiter and draft store
+    from drafts import SharedDraftStore
+    from idempotency import SharedDedupIndex
+    from rate_limit import SharedRateLimiter
+    from shared_state import open_shared_state
+
+    state = open_shared_state(url)
+    dedup = SharedDedupIndex(state)
+    limiter = SharedRateLimiter(state, {"notify": (RATE_BURST, 3600.0)})
+    drafts = SharedDraftStore(state, debounce=0)
+
+    won = [key for key in range(CLAIM_KEYS) if dedup.claim(f"{run_id}:{key}")]
+    granted = sum(limiter.acquire_up_to(("notify", run_id), 3)[0] for _ in range(RATE_BURST))
+    start = time.perf_counter()
+    for _ in range(ops):
+        state.incr(f"{run_id}:counter", 1, ttl=3600)
+    elapsed = time.perf_counter() - start
+    draft_id = f"{run_id}-{index}"
+    drafts.queue_changes(draft_id, {"phys_name": f"Dr {index}", "sign_date": date(2026, 1, 1)}, 4)
+    drafts.flush()
+    state.close()
+    return won, granted, elapsed
+
+
+def run(url, replicas, ops):
+    run_id = f"bench{time.time_ns()}"
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=replicas, mp_context=context) as pool:
+        futures = [pool.submit(_replica, url, i, ops, run_id) for i in range(replicas)]
+        results = [future.result() for future in futures]
+
+    from drafts import SharedDraftStore
+    from idempotency import SharedDedupIndex
+    from shared_state import open_shared_state
+
+    state = open_shared_state(url)
+    dedup = SharedDedupIndex(state)
+    stored, abandoned = f"{run_id}:stored", f"{run_id}:abandoned"
+    dedup.claim(stored)
+    dedup.add(stored, 7)
+    dedup.release(stored)
+    dedup.claim(abandoned)
+    dedup.release(abandoned)
+    released = dedup.get(stored) == 7 and dedup.claim(abandoned)
+    won = sorted(key for keys, _, _ in results for key in keys)
+    granted = sum(count for _, count, _ in results)
+    counter = int(state.get(f"{run_id}:counter"))
+    drafts = SharedDraftStore(state, debounce=0)
+    expected = [({"phys_name": f"Dr {i}", "sign_date": date(2026, 1, 1)}, 4) for i in range(replicas)]
+    resumed = sum(1 for i in range(replicas) if drafts.load(f"{run_id}-{i}") == expected[i])
+    state.close()
+
+    failures = []
+    if won != list(range(CLAIM_KEYS)):
+        failures.append(f"claims: {len(won)} wins for {CLAIM_KEYS} keys")
+    if granted != RATE_BURST:
+        failures.append(f"rate limit: granted {granted}, burst {RATE_BURST}")
+    if counter != replicas * ops:
+        failures.append(f"counter: {counter}, expected {replicas * ops}")
+    if resumed != replicas:
+        failures.append(f"drafts: {resumed}/{replicas} resumed")
+    if not released:
+        failures.append("release: a stored key was removed or a released claim was kept")
+    # Wall time of the slowest replica's increment loop
+    rate = replicas * ops / max(elapsed for _, _, elapsed in results)
+    return rate, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the shared state backends across processes.")
+    parser.add_argument("--replicas", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--ops", type=int, default=2000, help="counter increments per replica")
+    parser.add_argument("--redis-url", help="a real Redis-protocol server instead of the stand-in")
+    args = parser.parse_args()
+
+    stub = None
+    if args.redis_url:
+        redis_url = args.redis_url
+    else:
+        stub = RedisStub().start()
+        redis_url = f"redis://127.0.0.1:{stub.port}/0"
+    backends = {
+        "sqlite": "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="bench-shared-"), "shared_state.sqlite3"),
+        "redis-stub" if stub else "redis": redis_url,
+    }
+    ok = True
+    try:
+        for name, url in backends.items():
+            for replicas in args.replicas:
+                rate, failures = run(url, replicas, args.ops)
+                status = "ok" if not failures else "FAILED: " + "; ".join(failures)
+                ok = ok and not failures
+                print(f"{name:<11} replicas={replicas}  {rate:9.0f} increments/s  {status}")
+    finally:
+        if stub is not None:
+            stub.stop()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""SMTP delivery phases: where the time goes, and how failures are classified.
+
+Sends messages through SMTPConnectionPool from several threads to the SMTP
+stub, which answers with a slow greeting and a slow DATA (a busy relay), and
+reports per-phase percentiles from the delivery traces. Then delivers over
+STARTTLS (a self-signed certificate the pool is told to trust), as the
+Office365 setup does, and checks the handshake completes and the session is
+reused. Finally injects one failure per kind (rejected login, a relay without
+STARTTLS, an untrusted certificate, timeouts, 4xx and 5xx replies, a refused
+connection, an unknown host) and checks that each is reported with the
+expected phase and kind.
+
+    python benchmarks/bench_smtp_phases.py [--messages 200] [--senders 8] [--pool-size 4]
+"""
+import argparse
+import os
+import socket
+import ssl
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from smtp_pool import DeliveryTrace, SMTPConnectionPool  # noqa: E402
+from smtp_stub import SMTPStub, self_signed_context  # noqa: E402
+
+MESSAGE = "Subject: bench\r\n\r\n" + "x" * 2000
+TLS, CERTFILE = self_signed_context()
+
+# (scenario, stub options, pool options, expected (phase, kind))
+FAILURES = (
+    ("login rejected", {"replies": {"AUTH": "535 Authentication failed"}}, {}, ("auth", "auth")),
+    ("no STARTTLS", {}, {"starttls": True}, ("starttls", "tls")),
+    ("untrusted cert", {"tls": TLS}, {"starttls": True}, ("starttls", "tls")),
+    ("greeting timeout", {"latencies": {"CONNECT": 1.0}}, {"connect_timeout": 0.3}, ("connect", "timeout")),
+    ("DATA timeout", {"latencies": {"DATA": 1.0}}, {"timeout": 0.3}, ("data", "timeout")),
+    ("RCPT deferred", {"replies": {"RCPT": "451 Try again later"}}, {}, ("data", "4xx")),
+    ("MAIL rejected", {"replies": {"MAIL": "550 Sender rejected"}}, {}, ("data", "5xx")),
+    ("refused", None, {}, ("connect", "connection")),
+    ("unknown host", None, {"host": "relay.invalid"}, ("connect", "dns")),
+)
+
+
+def _pool(port, **options):
+    options.setdefault("starttls", False)
+    host = options.pop("host", "127.0.0.1")
+    return SMTPConnectionPool(host, port, "user", "secret", **options)
+
+
+def _closed_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def _send(pool):
+    trace = DeliveryTrace()
+    try:
+        pool.sendmail("bench@example.org", ["admin@example.org"], MESSAGE, trace=trace)
+    except Exception:
+        pass
+    return trace
+
+
+def load(args):
+    stub = SMTPStub(latencies={"CONNECT": args.greeting_delay, "DATA": args.data_delay}).start()
+    pool = _pool(stub.port, max_size=args.pool_size)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.senders) as executor:
+        traces = list(executor.map(lambda _: _send(pool), range(args.messages)))
+    elapsed = time.perf_counter() - start
+    pool.close()
+    stub.stop()
+
+    failed = sum(1 for trace in traces if trace.failure)
+    print(f"{args.messages} messages from {args.senders} senders over a pool of {args.pool_size}: "
+          f"{args.messages / elapsed:.0f}/s, {failed} failed, {stub.connections} connection(s)")
+    samples = {}
+    for trace in traces:
+        for name, seconds in trace.phases:
+            samples.setdefault(name, []).append(seconds * 1000)
+    print(f"{'phase':<10} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    for name in ("pool_wait", "connect", "ehlo", "starttls", "auth", "data"):
+        values = sorted(samples.get(name, ()))
+        if values:
+            p95 = values[max(int(len(values) * 0.95) - 1, 0)]
+            print(f"{name:<10} {len(values):>6} {statistics.median(values):>8.1f} {p95:>8.1f} {values[-1]:>8.1f}")
+    return failed == 0
+
+
+def starttls():
+    stub = SMTPStub(tls=TLS).start()
+    pool = _pool(stub.port, starttls=True, ssl_context=ssl.create_default_context(cafile=CERTFILE))
+    traces = [_send(pool) for _ in range(3)]
+    pool.close()
+    stub.stop()
+    handshakes = [seconds for trace in traces for name, seconds in trace.phases if name == "starttls"]
+    failed = [trace for trace in traces if trace.failure]
+    print(f"\nSTARTTLS: {stub.messages}/{len(traces)} delivered, {stub.tls_sessions} handshake(s), "
+          f"{handshakes[0] * 1000 if handshakes else 0:.1f} ms; first delivery: {traces[0]}")
+    for trace in failed:
+        print(f"  failed: {trace}")
+    # One session, encrypted once and reused for every message
+    return not failed and stub.messages == len(traces) and stub.tls_sessions == 1 and len(handshakes) == 1
+
+
+def failures():
+    ok = True
+    print(f"\n{'scenario':<18} {'expected':<20} {'reported':<20} trace")
+    for scenario, stub_options, pool_options, expected in FAILURES:
+        stub = SMTPStub(**stub_options).start() if stub_options is not None else None
+        pool = _pool(stub.port if stub else _closed_port(), **pool_options)
+        trace = _send(pool)
+        pool.close()
+        if stub:
+            stub.stop()
+        reported = trace.failure
+        ok = ok and reported == expected
+        mark = "" if reported == expected else "  MISMATCH"
+        print(f"{scenario:<18} {'/'.join(expected):<20} {'/'.join(reported or ('-',)):<20} {trace}{mark}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SMTP delivery phases and failure classification.")
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--senders", type=int, default=8)
+    parser.add_argument("--pool-size", type=int, default=4)
+    parser.add_argument("--greeting-delay", type=float, default=0.05, help="seconds before the relay's 220")
+    parser.add_argument("--data-delay", type=float, default=0.01, help="seconds before the relay answers DATA")
+    args = parser.parse_args()
+    ok = load(args)
+    ok = starttls() and ok
+    ok = failures() and ok
+    print("\nok" if ok else "\nFAILED")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Cold-start cost: module import times and the first render of app.py.
+
+Every measurement runs in a fresh interpreter, as on a newly started instance.
+Import times are reported net of the bare interpreter startup; the first
+render is the time from starting to import Streamlit to the end of the first
+app.py run (the disclaimer page), plus the first run on its own.
+
+    python benchmarks/bench_startup.py [--repeat 5]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = ("settings", "send_email", "outbox", "notifications", "storage", "form_render", "drafts")
+
+_IMPORT = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+_FIRST_RENDER = """
+import time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file({app!r}, default_timeout=120)
+run_start = time.perf_counter()
+at.run()
+assert not at.exception, at.exception
+end = time.perf_counter()
+print(end - start, end - run_start)
+"""
+
+
+def _run(code, env):
+    out = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return [float(value) for value in out.split()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark module import and first-render times.")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    env = dict(os.environ, DATA_DIR=tempfile.mkdtemp(prefix="bench-startup-"), PYTHONPATH=ROOT)
+
+    print("import time (median of fresh interpreters):")
+    for module in MODULES:
+        samples = [_run(_IMPORT.format(module=module), env)[0] for _ in range(args.repeat)]
+        print(f"  {module:<14} {statistics.median(samples) * 1000:7.1f} ms")
+
+    samples = [_run(_FIRST_RENDER.format(app=os.path.join(ROOT, "app.py")), env) for _ in range(args.repeat)]
+    total = statistics.median(sample[0] for sample in samples)
+    first_run = statistics.median(sample[1] for sample in samples)
+    print(f"first render of app.py: {total * 1000:.0f} ms including imports, {first_run * 1000:.0f} ms script run")
+
+
+if __name__ == "__main__":
+    main()
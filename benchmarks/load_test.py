@@ -0,0 +1,274 @@
+"""Headless load test: N concurrent sessions filling in and submitting the form.
+
+Every simulated physician is its own Streamlit AppTest session that clicks
+through the disclaimer and Sections A-F, picks random conditional branches
+(PTCL/CTCL subtypes, "Other" free text, therapy lines, transplant type) and
+submits. Notifications go to a local SMTP stub (benchmarks/smtp_stub.py).
+
+AppTest installs a process-global mock runtime for every run, so sessions
+cannot share a process; each one runs in its own worker process against the
+same data directory, outbox and SMTP stub.
+
+    python benchmarks/load_test.py --sessions 20 [--smtp-latency 0.05]
+
+Reports rerun latency percentiles, rerun throughput, approximate per-session
+memory, submit-to-enqueue latency and enqueue-to-delivery latency.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from smtp_stub import SMTPStub  # noqa: E402
+
+
+def _configure(stub_port):
+    # Must run before the app modules are imported: they read their settings at import
+    os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="load-test-")
+    os.environ.update({
+        "SMTP_SERVER": "127.0.0.1",
+        "SMTP_PORT": str(stub_port),
+        "SMTP_USERNAME": "loadtest@example.com",
+        "SMTP_PASSWORD": "loadtest",
+        "SMTP_RECEIVER": "admin@example.com",
+        "SMTP_STARTTLS": "false",
+    })
+
+
+def deep_sizeof(value, seen=None):
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(v, seen) for v in value)
+    else:
+        for name in getattr(type(value), "__slots__", ()):
+            size += deep_sizeof(getattr(value, name, None), seen)
+    return size
+
+
+def session_state_size(at):
+    # Newer AppTest versions expose a mapping; older ones the SafeSessionState itself
+    state = at.session_state
+    items = state.items() if hasattr(type(state), "items") else state.filtered_state.items()
+    return sum(deep_sizeof(key) + deep_sizeof(value) for key, value in items)
+
+
+class Session:
+    def __init__(self, index, seed):
+        from streamlit.testing.v1 import AppTest
+
+        self.index = index
+        self.rng = random.Random(seed)
+        self.at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=120)
+        self.rerun_ms = []
+        self.started_at = self.finished_at = None
+        self.submit_ms = None
+        self.submitted_at = None
+        self.peak_state_bytes = 0
+
+    def _run(self):
+        start = time.perf_counter()
+        self.at.run()
+        self.rerun_ms.append((time.perf_counter() - start) * 1000)
+        if self.at.exception:
+            raise RuntimeError(f"session {self.index}: {self.at.exception[0].message}")
+        self.peak_state_bytes = max(self.peak_state_bytes, session_state_size(self.at))
+
+    def _next(self):
+        self.at.button(key="next").click()
+        self._run()
+
+    def fill(self):
+        at, rng = self.at, self.rng
+        self.started_at = time.time()
+        self._run()
+        at.button(key="hpc").click()
+        self._run()
+
+        # Section A
+        at.selectbox(key="phys_country_widget").select(rng.choice(["Switzerland", "France", "Germany"]))
+        self._run()
+        at.text_input(key="phys_name_widget").input(f"Dr Load {self.index}")
+        self._run()
+        at.text_input(key="phys_email_widget").input(f"dr{self.index}@example.com")
+        self._run()
+        self._next()
+
+        # Section B
+        birth_year = rng.randint(1940, 2000)
+        at.selectbox(key="birth_year_widget").select(birth_year)
+        self._run()
+        at.selectbox(key="diag_year_widget").select(rng.randint(max(birth_year, 2000), date.today().year))
+        self._run()
+        diagnosis = rng.choice(["PTCL", "CTCL"])
+        at.radio(key="tcell_diagnosis_widget").set_value(diagnosis)
+        self._run()
+        if diagnosis == "PTCL":
+            at.selectbox(key="ptcl_subtype_widget").select(rng.choice(["AITL", "ALCL", "Other"]))
+            self._run()
+            if at.session_state["ptcl_subtype_widget"] == "Other":
+                at.text_input(key="ptcl_extra_other_widget").input("EATL")
+                self._run()
+        else:
+            at.selectbox(key="ctcl_subtype_widget").select(rng.choice(["Mycosis Fungoides", "Other"]))
+            self._run()
+            if at.session_state["ctcl_subtype_widget"] == "Other":
+                at.text_input(key="ctcl_other_widget").input("Primary cutaneous")
+                self._run()
+        self._next()
+
+        # Section C
+        at.multiselect(key="diag_tests_widget").select("Flow Cytometry").select("Other")
+        self._run()
+        at.text_input(key="diag_test_other_text_widget").input("PCR")
+        self._run()
+        at.radio(key="cytogenetics_widget").set_value(rng.choice(["Yes", "No"]))
+        self._run()
+        self._next()
+
+        # Section D
+        count = rng.choice(["1", "2", "3"])
+        at.selectbox(key="num_therapies_widget").select(count)
+        self._run()
+        for line in range(1, int(count) + 1):
+            at.text_input(key=f"therapy{line}_type_widget").input(rng.choice(["CHOP", "CHOEP", "GDP"]))
+            self._run()
+            at.radio(key=f"therapy{line}_outcome_widget").set_value(rng.choice(["CR", "PR", "SD", "PD"]))
+            self._run()
+        at.radio(key="prev_transplant_widget").set_value(rng.choice(["Autologous", "Allogenic", "No"]))
+        self._run()
+        self._next()
+
+        # Sections E/F
+        at.checkbox(key="agree_decl_widget").check()
+        self._run()
+        at.text_input(key="phys_signature_widget").input(f"Dr Load {self.index}")
+        self._run()
+        at.date_input(key="sign_date_widget").set_value(date.today())
+        self._run()
+
+    def submit(self):
+        self.at.button(key="submit_form").click()
+        start = time.perf_counter()
+        self._run()
+        self.submit_ms = (time.perf_counter() - start) * 1000
+        self.submitted_at = self.finished_at = time.time()
+        if not self.at.info:
+            errors = [e.value for e in self.at.error]
+            raise RuntimeError(f"session {self.index}: submission not accepted: {errors}")
+
+
+def _percentiles(samples, points=(50, 90, 95, 99)):
+    samples = sorted(samples)
+    return {p: samples[min(len(samples) - 1, int(len(samples) * p / 100))] for p in points}
+
+
+def _wait_for_outbox(timeout):
+    # Keep the process (and its outbox worker) alive until nothing is left to send
+    from outbox import get_outbox
+
+    outbox = get_outbox()
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        counts = outbox.counts()
+        if not counts.get("pending") and not counts.get("sending"):
+            return
+        time.sleep(0.05)
+
+
+def _run_session(index, seed, delivery_timeout):
+    session = Session(index, seed)
+    error = None
+    try:
+        session.fill()
+        session.submit()
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    _wait_for_outbox(delivery_timeout)
+    # This process is itself a pool worker: multiprocessing joins its child
+    # processes at exit before the dossier pool would be shut down, so stop it here
+    from dossier import get_renderer
+
+    get_renderer().shutdown()
+    return {
+        "rerun_ms": session.rerun_ms,
+        "started_at": session.started_at,
+        "finished_at": session.finished_at or time.time(),
+        "submit_ms": session.submit_ms,
+        "submitted_at": session.submitted_at,
+        "peak_state_bytes": session.peak_state_bytes,
+        "error": error,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive N concurrent headless sessions through the form.")
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--smtp-latency", type=float, default=0.0,
+                        help="artificial per-command delay of the SMTP stub, in seconds")
+    parser.add_argument("--delivery-timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    stub = SMTPStub(latency=args.smtp_latency).start()
+    _configure(stub.port)
+
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=args.sessions, mp_context=context) as pool:
+        futures = [
+            pool.submit(_run_session, i, args.seed * 1000 + i, args.delivery_timeout)
+            for i in range(args.sessions)
+        ]
+        sessions = [future.result() for future in futures]
+    errors = [s["error"] for s in sessions if s["error"]]
+    started = [s["started_at"] for s in sessions if s["started_at"]]
+    elapsed = max(s["finished_at"] for s in sessions) - min(started) if started else 0.0
+
+    submitted = [s for s in sessions if s["submitted_at"] is not None]
+    deadline = time.time() + args.delivery_timeout
+    while stub.messages < len(submitted) and time.time() < deadline:
+        time.sleep(0.05)
+    stub.stop()
+
+    reruns = [ms for s in sessions for ms in s["rerun_ms"]]
+    print(f"sessions: {args.sessions}  submitted: {len(submitted)}  errors: {len(errors)}")
+    for error in errors[:5]:
+        print(f"  error: {error}")
+    if not reruns or not elapsed:
+        return 1
+    pct = _percentiles(reruns)
+    print(f"reruns: {len(reruns)} in {elapsed:.2f}s  ->  {len(reruns) / elapsed:.1f} reruns/s, "
+          f"{len(submitted) / elapsed:.2f} submissions/s")
+    print("rerun latency ms: " + "  ".join(f"p{p}={v:.1f}" for p, v in pct.items())
+          + f"  max={max(reruns):.1f}")
+    state_sizes = [s["peak_state_bytes"] for s in sessions]
+    print(f"session_state per session (peak, deep size): mean={statistics.mean(state_sizes) / 1024:.1f} KiB "
+          f"max={max(state_sizes) / 1024:.1f} KiB")
+    if submitted:
+        submit_pct = _percentiles([s["submit_ms"] for s in submitted])
+        print("submit-to-enqueue ms: " + "  ".join(f"p{p}={v:.1f}" for p, v in submit_pct.items()))
+    print(f"delivered to SMTP stub: {stub.messages}/{len(submitted)} over {stub.connections} connection(s)")
+    if stub.received_at and submitted:
+        last_enqueue = max(s["submitted_at"] for s in submitted)
+        print(f"outbox drained {max(0.0, max(stub.received_at) - last_enqueue):.2f}s after the last enqueue")
+    print(f"finished at {datetime.now():%Y-%m-%d %H:%M:%S}")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
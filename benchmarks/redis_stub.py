@@ -0,0 +1,216 @@
+"""Minimal in-process Redis-protocol server for benchmarks and local runs.
+
+Implements only the commands shared_state.RedisState sends (PING, AUTH,
+SELECT, GET, SET with PX/NX, DEL, INCRBY, PEXPIRE, HSET, HDEL, HGETALL, and
+EVAL of its compare-and-delete script; there is no Lua), in memory, one command at a time under a lock, so every command is atomic
+as it is on a real server. Any password is accepted.
+
+    python benchmarks/redis_stub.py --port 6380
+    SHARED_STATE_URL=redis://127.0.0.1:6380/0 streamlit run app.py
+"""
+import argparse
+import os
+import socketserver
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared_state import DELETE_IF_SCRIPT  # noqa: E402
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    # Pipelined replies are written one by one; without this each would wait for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            # Inline command, e.g. typed into telnet
+            return line.decode("utf-8", "replace").split()
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2].decode("utf-8"))
+        return args
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        while True:
+            command = self._read_command()
+            if command is None:
+                return
+            if server.latency:
+                time.sleep(server.latency)
+            with server.lock:
+                server.commands += 1
+                reply = server.execute(command)
+            self.wfile.write(_encode(reply))
+
+
+class _Error(Exception):
+    pass
+
+
+def _encode(reply):
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, _Error):
+        return b"-%s\r\n" % str(reply).encode("utf-8")
+    if isinstance(reply, bool):
+        return b"+OK\r\n"
+    if isinstance(reply, int):
+        return b":%d\r\n" % reply
+    if isinstance(reply, list):
+        return b"*%d\r\n" % len(reply) + b"".join(_encode(item) for item in reply)
+    data = reply.encode("utf-8")
+    return b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+class RedisStub(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        super().__init__((host, port), _Handler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.commands = 0
+        # key -> value (str or dict for hashes); key -> expiry on time.monotonic()
+        self.data = {}
+        self.expires = {}
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def _live(self, key):
+        expires_at = self.expires.get(key)
+        if expires_at is not None and expires_at <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return self.data.get(key)
+
+    def execute(self, command):
+        # Called with the lock held
+        name, args = command[0].upper(), command[1:]
+        handler = getattr(self, f"_cmd_{name.lower()}", None)
+        if handler is None:
+            return _Error(f"ERR unknown command '{name}'")
+        try:
+            return handler(*args)
+        except (AttributeError, TypeError, ValueError):
+            return _Error(f"ERR wrong number or type of arguments for '{name}'")
+
+    def _cmd_ping(self):
+        return "PONG"
+
+    def _cmd_auth(self, *_):
+        return True
+
+    def _cmd_select(self, _):
+        return True
+
+    def _cmd_get(self, key):
+        value = self._live(key)
+        if isinstance(value, dict):
+            return _Error("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    def _cmd_set(self, key, value, *options):
+        options = [option.upper() for option in options]
+        ttl = None
+        if "PX" in options:
+            ttl = int(options[options.index("PX") + 1]) / 1000
+        if "NX" in options and self._live(key) is not None:
+            return None
+        self.data[key] = value
+        if ttl:
+            self.expires[key] = time.monotonic() + ttl
+        else:
+            self.expires.pop(key, None)
+        return True
+
+    def _cmd_del(self, *keys):
+        removed = 0
+        for key in keys:
+            if self._live(key) is not None:
+                removed += 1
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return removed
+
+    def _cmd_eval(self, script, numkeys, *args):
+        if script != DELETE_IF_SCRIPT or int(numkeys) != 1:
+            return _Error("ERR only the compare-and-delete script is supported")
+        key, value = args
+        return self._cmd_del(key) if self._cmd_get(key) == value else 0
+
+    def _cmd_incrby(self, key, amount):
+        value = int(self._live(key) or 0) + int(amount)
+        self.data[key] = str(value)
+        return value
+
+    def _cmd_pexpire(self, key, milliseconds):
+        if self._live(key) is None:
+            return 0
+        self.expires[key] = time.monotonic() + int(milliseconds) / 1000
+        return 1
+
+    def _cmd_hset(self, key, *pairs):
+        if not pairs or len(pairs) % 2:
+            raise ValueError
+        fields = self._live(key)
+        if fields is None:
+            fields = self.data[key] = {}
+        added = sum(1 for field in pairs[::2] if field not in fields)
+        fields.update(zip(pairs[::2], pairs[1::2]))
+        return added
+
+    def _cmd_hdel(self, key, *names):
+        fields = self._live(key) or {}
+        removed = sum(1 for name in names if fields.pop(name, None) is not None)
+        if not fields:
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return removed
+
+    def _cmd_hgetall(self, key):
+        fields = self._live(key) or {}
+        return [item for pair in fields.items() for item in pair]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="redis-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local Redis-protocol stand-in.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6380)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds of delay per command")
+    args = parser.parse_args()
+    stub = RedisStub(args.host, args.port, args.latency)
+    print(f"Redis stub listening on {args.host}:{stub.port}")
+    try:
+        stub.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"{stub.commands} command(s) over {stub.connections} connection(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""Minimal in-process SMTP sink for benchmarks and local runs.
+
+Speaks just enough SMTP for smtplib (EHLO, AUTH, MAIL, RCPT, DATA, NOOP,
+RSET, QUIT), accepts any credentials and counts the messages it receives.
+STARTTLS is offered only when the stub is given a TLS context (--starttls
+makes a throwaway self-signed certificate); otherwise point the app at it
+with SMTP_STARTTLS=false.
+
+Delays and failures can be injected per command: `latencies` maps a verb
+(or CONNECT, for the greeting) to seconds of delay, `replies` maps a verb to
+the reply sent instead of the normal one, e.g. {"RCPT": "451 Try again later"}.
+
+    python benchmarks/smtp_stub.py --port 8025 [--delay DATA=0.05] [--reply "AUTH=535 Bad credentials"] [--starttls]
+"""
+import argparse
+import os
+import socket
+import socketserver
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+
+def self_signed_context(directory=None):
+    # A server context with a throwaway certificate for 127.0.0.1 and localhost.
+    # Returns it with the certificate file, which clients must trust.
+    directory = directory or tempfile.mkdtemp(prefix="smtp-stub-")
+    certfile = os.path.join(directory, "cert.pem")
+    keyfile = os.path.join(directory, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost,IP:127.0.0.1",
+         "-keyout", keyfile, "-out", certfile],
+        check=True, capture_output=True,
+    )
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certfile, keyfile)
+    return context, certfile
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def _reply(self, line):
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+
+    def _start_tls(self):
+        # Anything the client sent before the handshake is discarded, as RFC 3207 requires
+        self.connection = self.server.tls.wrap_socket(self.connection, server_side=True)
+        # Replies are small single writes; without this they can wait out a delayed ACK
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.rfile = self.connection.makefile("rb")
+        self.wfile = self.connection.makefile("wb", buffering=0)
+
+    def finish(self):
+        super().finish()
+        # After STARTTLS the server only knows the plain socket the TLS one replaced
+        self.connection.close()
+
+    def handle(self):
+        server = self.server
+        tls_active = False
+        with server.lock:
+            server.connections += 1
+        if server.latencies.get("CONNECT"):
+            time.sleep(server.latencies["CONNECT"])
+        self._reply("220 smtp-stub ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("utf-8", "replace").strip()
+            verb = command.split(" ", 1)[0].upper()
+            delay = server.latencies.get(verb, server.latency)
+            if delay:
+                time.sleep(delay)
+            if verb in server.replies:
+                self._reply(server.replies[verb])
+            elif verb in ("EHLO", "HELO"):
+                starttls = b"250-STARTTLS\r\n" if server.tls is not None and not tls_active else b""
+                self.wfile.write(b"250-smtp-stub\r\n" + starttls + b"250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n")
+            elif verb == "STARTTLS" and server.tls is not None and not tls_active:
+                self._reply("220 Ready to start TLS")
+                self._start_tls()
+                tls_active = True
+                with server.lock:
+                    server.tls_sessions += 1
+            elif verb == "AUTH":
+                parts = command.split()
+                if len(parts) == 2 and parts[1].upper() == "LOGIN":
+                    # Username and password prompts; any answer is accepted
+                    self._reply("334 VXNlcm5hbWU6")
+                    self.rfile.readline()
+                    self._reply("334 UGFzc3dvcmQ6")
+                    self.rfile.readline()
+                elif len(parts) == 2:
+                    self._reply("334 ")
+                    self.rfile.readline()
+                self._reply("235 Authentication successful")
+            elif verb in ("MAIL", "RCPT", "RSET", "NOOP"):
+                self._reply("250 OK")
+            elif verb == "DATA":
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                size = 0
+                while True:
+                    data = self.rfile.readline()
+                    if not data or data == b".\r\n":
+                        break
+                    size += len(data)
+                with server.lock:
+                    server.messages += 1
+                    server.received_at.append(time.time())
+                    server.bytes_received += size
+                self._reply("250 Queued")
+            elif verb == "QUIT":
+                self._reply("221 Bye")
+                return
+            else:
+                self._reply("502 Command not implemented")
+
+
+class SMTPStub(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, latencies=None, replies=None, tls=None):
+        super().__init__((host, port), _Handler)
+        self.latency = latency
+        # Server-side ssl.SSLContext; offers STARTTLS when set
+        self.tls = tls
+        self.latencies = {verb.upper(): seconds for verb, seconds in (latencies or {}).items()}
+        self.replies = {verb.upper(): reply for verb, reply in (replies or {}).items()}
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.tls_sessions = 0
+        self.messages = 0
+        self.bytes_received = 0
+        self.received_at = []
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def handle_error(self, request, client_address):
+        # A client that gives up (e.g. on a timeout or an untrusted certificate) is part of
+        # the scenario, not an error
+        if not isinstance(sys.exc_info()[1], (ConnectionError, ssl.SSLError)):
+            super().handle_error(request, client_address)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="smtp-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local SMTP sink.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds of delay per SMTP command")
+    parser.add_argument("--delay", action="append", default=[], metavar="VERB=SECONDS",
+                        help="delay for one command (or CONNECT); repeatable")
+    parser.add_argument("--reply", action="append", default=[], metavar="VERB=REPLY",
+                        help="reply to one command with this line instead; repeatable")
+    parser.add_argument("--starttls", action="store_true", help="offer STARTTLS with a self-signed certificate")
+    args = parser.parse_args()
+    latencies = {verb: float(seconds) for verb, seconds in (item.split("=", 1) for item in args.delay)}
+    replies = dict(item.split("=", 1) for item in args.reply)
+    tls = None
+    if args.starttls:
+        tls, certfile = self_signed_context()
+        print(f"STARTTLS certificate: {certfile}")
+    stub = SMTPStub(args.host, args.port, args.latency, latencies, replies, tls)
+    print(f"SMTP stub listening on {args.host}:{stub.port}")
+    try:
+        stub.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"{stub.messages} message(s) over {stub.connections} connection(s)")
+
+
+if __name__ == "__main__":
+    main()
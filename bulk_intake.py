@@ -0,0 +1,373 @@
+"""Headless intake of patient submissions in bulk.
+
+    python bulk_intake.py batch.jsonl [--report report.jsonl]
+    python bulk_intake.py - < batch.jsonl
+    python bulk_intake.py --serve [--port 8502]     # POST JSONL to /intake
+
+Each input line is one submission as a JSON object with the form's field names
+(a serialized record with "schema_version" and "data" is accepted too; dates
+are "YYYY-MM-DD"). Lines are validated with the same rules as the form, pruned
+of answers the form would not show, and stored in chunks. Every line gets one
+result in the report, and the batch sends a single summary notification.
+Re-sending a batch stores nothing twice.
+"""
+import argparse
+import hmac
+import io
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from datetime import date
+
+import settings  # loads .env before the modules below read their configuration
+from form_schema import FIELDS, active_fields
+from idempotency import submission_key
+from metrics import BULK_INTAKE_RECORDS
+from serializers import FIELD_TYPES, SCHEMA_VERSION
+from storage import STORE_WRITE_TIMEOUT, get_store
+from validation import validate
+
+logger = logging.getLogger(__name__)
+
+# Lines validated and stored per chunk; memory use depends on this, not on the batch size
+INTAKE_CHUNK_SIZE = int(os.getenv("INTAKE_CHUNK_SIZE", 1000))
+# Rejected lines listed in the summary email (all of them are in the report)
+INTAKE_EMAIL_ERRORS = int(os.getenv("INTAKE_EMAIL_ERRORS", 100))
+# New submission ids listed in the summary email (the rest are given as a count and a range)
+INTAKE_EMAIL_IDS = int(os.getenv("INTAKE_EMAIL_IDS", 20))
+# HTTP endpoint: requests must carry "Authorization: Bearer <INTAKE_TOKEN>" when it is set
+INTAKE_TOKEN = os.getenv("INTAKE_TOKEN", "")
+INTAKE_MAX_BYTES = int(os.getenv("INTAKE_MAX_BYTES", 64 * 1024 * 1024))
+INTAKE_PORT = int(os.getenv("INTAKE_PORT", 8502))
+
+SUMMARY_SUBJECT = "MAP Bulk Intake: {created} new submission(s) from {source}"
+
+# Keeps bulk submissions' idempotency keys apart from those of drafts in the UI
+_KEY_NAMESPACE = "bulk"
+
+
+class LineError(ValueError):
+    pass
+
+
+def parse_line(text):
+    # One JSONL line -> form_data dict with dates parsed; raises LineError
+    try:
+        record = json.loads(text)
+    except ValueError as e:
+        raise LineError(f"Invalid JSON: {e}")
+    if not isinstance(record, dict):
+        raise LineError("Expected a JSON object")
+    if "data" in record and "schema_version" in record:
+        if record["schema_version"] != SCHEMA_VERSION:
+            raise LineError(f"Unsupported schema version: {record['schema_version']!r}")
+        record = record["data"]
+        if not isinstance(record, dict):
+            raise LineError("Expected \"data\" to be a JSON object")
+    unknown = sorted(set(record) - set(FIELDS))
+    if unknown:
+        raise LineError(f"Unknown field(s): {', '.join(unknown)}")
+    data = {}
+    for name, value in record.items():
+        if value is None:
+            continue
+        if FIELD_TYPES[name] == "date" and isinstance(value, str):
+            try:
+                value = date.fromisoformat(value)
+            except ValueError:
+                raise LineError(f"{name}: expected a date as YYYY-MM-DD, got {value!r}")
+        data[name] = value
+    return data
+
+
+def _check(line_number, text):
+    # (result, submission, key): the result is final for rejected lines, otherwise
+    # it is completed with the id once the submission is stored
+    result = {"line": line_number}
+    try:
+        data = parse_line(text)
+    except LineError as e:
+        result.update(status="invalid", errors=[{"field": None, "message": str(e)}])
+        return result, None, None
+    problems = validate(data)
+    if problems:
+        result.update(status="invalid", errors=[
+            {"field": p.field, "message": f"Page {p.page}, {p.label}: {p.message}"} for p in problems
+        ])
+        return result, None, None
+    submission = _as_stored(data)
+    return result, submission, submission_key(submission, _KEY_NAMESPACE)
+
+
+def _as_stored(data):
+    # What FormRecord(data).prune() and .to_dict() give the form, computed on the
+    # dict directly: answers to hidden branches dropped, fields and multiselect
+    # choices in form order
+    while True:
+        active = set(active_fields(data))
+        if active.issuperset(data):
+            break
+        data = {name: value for name, value in data.items() if name in active}
+    stored = {}
+    for name in FIELDS:
+        if name in data:
+            value = data[name]
+            if isinstance(value, list):
+                chosen = set(value)
+                value = [option for option in FIELDS[name].options.values if option in chosen]
+            stored[name] = value
+    return stored
+
+
+def _submit_chunk(chunk, store):
+    # Validates a chunk and queues its valid records for the store's writer
+    checked = [_check(line_number, text) for line_number, text in chunk]
+    futures = store.submit_many([(submission, key) for _, submission, key in checked if submission is not None])
+    return checked, futures
+
+
+def _finish_chunk(checked, futures):
+    # Waits for the chunk to be committed and returns its results in line order
+    stored = iter(futures)
+    for result, submission, _ in checked:
+        if submission is not None:
+            submission_id, created = next(stored).result(STORE_WRITE_TIMEOUT)
+            result.update(status="created" if created else "duplicate", id=submission_id)
+    return [result for result, _, _ in checked]
+
+
+def _numbered_lines(lines):
+    for line_number, text in enumerate(lines, 1):
+        if isinstance(text, bytes):
+            text = text.decode("utf-8", "replace")
+        if text.strip():
+            yield line_number, text
+
+
+def intake(lines, store=None, chunk_size=INTAKE_CHUNK_SIZE):
+    """Validate and store JSONL lines, yielding one result dict per non-blank line.
+
+    Results come in input order: {"line", "status": "created" | "duplicate", "id"}
+    or {"line", "status": "invalid", "errors": [{"field", "message"}]}.
+    """
+    store = store or get_store()
+    numbered = _numbered_lines(lines)
+    # The writer commits one chunk while the next is being validated
+    committing = None
+    while True:
+        chunk = list(itertools.islice(numbered, chunk_size))
+        if not chunk:
+            break
+        submitted = _submit_chunk(chunk, store)
+        if committing is not None:
+            yield from _finish_chunk(*committing)
+        committing = submitted
+    if committing is not None:
+        yield from _finish_chunk(*committing)
+
+
+class Summary:
+    def __init__(self, source):
+        self.source = source
+        self.started_at = time.time()
+        self.elapsed = 0.0
+        self.counts = {"created": 0, "duplicate": 0, "invalid": 0}
+        # Only the first INTAKE_EMAIL_IDS ids are listed; the email counts the rest
+        self.created_ids = []
+        self.id_range = None
+        self.errors = []
+
+    def add(self, result):
+        self.counts[result["status"]] += 1
+        if result["status"] == "created":
+            submission_id = result["id"]
+            if len(self.created_ids) < INTAKE_EMAIL_IDS:
+                self.created_ids.append(submission_id)
+            low, high = self.id_range or (submission_id, submission_id)
+            self.id_range = (min(low, submission_id), max(high, submission_id))
+        elif result["status"] == "invalid" and len(self.errors) < INTAKE_EMAIL_ERRORS:
+            self.errors.append(result)
+
+    @property
+    def lines(self):
+        return sum(self.counts.values())
+
+    def as_dict(self):
+        return {"source": self.source, "lines": self.lines, **self.counts, "seconds": round(self.elapsed, 3)}
+
+    def email_body(self):
+        counts = self.counts
+        parts = [
+            f"A bulk intake from {self.source} has been processed: {self.lines} line(s), "
+            f"{counts['created']} new submission(s), {counts['duplicate']} already submitted, "
+            f"{counts['invalid']} rejected.",
+        ]
+        if self.created_ids:
+            listed = ", ".join(f"#{i}" for i in self.created_ids)
+            if counts["created"] > len(self.created_ids):
+                listed += " ... and {} more (#{} to #{} in all)".format(
+                    counts["created"] - len(self.created_ids), *self.id_range
+                )
+            parts.append(f"New submissions: {listed}\nPlease review them in the admin dashboard.")
+        if self.errors:
+            rejected = "\n".join(
+                f"Line {result['line']}: " + "; ".join(error["message"] for error in result["errors"])
+                for result in self.errors
+            )
+            if counts["invalid"] > len(self.errors):
+                rejected += f"\n... and {counts['invalid'] - len(self.errors)} more (see the intake report)"
+            parts.append("Rejected lines:\n" + rejected)
+        return "\n\n".join(parts)
+
+
+def notify_summary(summary):
+    # One email per batch, through the outbox (and send_email) like every other notification
+    from outbox import enqueue_email
+
+    subject = SUMMARY_SUBJECT.format(created=summary.counts["created"], source=summary.source)
+    return enqueue_email(subject, summary.email_body(), settings.get_settings().smtp_receiver or "")
+
+
+def run_intake(lines, source, report=None, notify=True, store=None):
+    # Runs a whole batch: writes one JSON line per result to `report`, records
+    # metrics, sends the summary and returns (summary, outbox message id or None)
+    summary = Summary(source)
+    for result in intake(lines, store):
+        summary.add(result)
+        if report is not None:
+            report.write(json.dumps(result) + "\n")
+    summary.elapsed = time.time() - summary.started_at
+    for outcome, count in summary.counts.items():
+        if count:
+            BULK_INTAKE_RECORDS.inc(count, outcome=outcome)
+    logger.info("Bulk intake from %s: %s", source, summary.as_dict())
+    message_id = notify_summary(summary) if notify and summary.lines else None
+    return summary, message_id
+
+
+# ---- HTTP endpoint ----
+
+def _body_lines(rfile, length):
+    # Lines of a request body of `length` bytes, read as they arrive
+    remaining = length
+    while remaining > 0:
+        line = rfile.readline(remaining)
+        if not line:
+            return
+        remaining -= len(line)
+        yield line
+
+
+def serve(host="127.0.0.1", port=INTAKE_PORT):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    if not INTAKE_TOKEN and host not in ("127.0.0.1", "localhost", "::1"):
+        raise ValueError("INTAKE_TOKEN environment variable is not set; required to listen beyond localhost.")
+
+    class IntakeHandler(BaseHTTPRequestHandler):
+        def _reply(self, code, body, content_type="application/json"):
+            data = body.encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            if self.path.split("?")[0] != "/intake":
+                self.send_error(404)
+                return
+            if INTAKE_TOKEN and not hmac.compare_digest(
+                self.headers.get("Authorization", "").encode(), f"Bearer {INTAKE_TOKEN}".encode()
+            ):
+                self._reply(401, json.dumps({"error": "Unauthorized"}))
+                return
+            length = int(self.headers.get("Content-Length") or 0)
+            if length > INTAKE_MAX_BYTES:
+                self._reply(413, json.dumps({"error": f"Batches are limited to {INTAKE_MAX_BYTES} bytes"}))
+                return
+            # The report is built in memory; with thousands of lines it is small next to the batch
+            report = io.StringIO()
+            summary, _ = run_intake(_body_lines(self.rfile, length), f"HTTP client {self.client_address[0]}", report)
+            report.write(json.dumps({"summary": summary.as_dict()}) + "\n")
+            self._reply(200, report.getvalue(), "application/x-ndjson")
+
+        def log_message(self, format, *args):
+            logger.info("%s %s", self.address_string(), format % args)
+
+    server = ThreadingHTTPServer((host, port), IntakeHandler)
+    server.daemon_threads = True
+    return server
+
+
+def _wait_for_delivery(message_id, timeout):
+    # The outbox worker lives in this process; give it a moment before exiting.
+    # An undelivered summary stays in the outbox and is retried by the app.
+    # Returns "sent", "failed" (the outbox gave up on it) or "pending".
+    from outbox import get_outbox
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = get_outbox().status(message_id)
+        if status == "sent":
+            return status
+        if status == "dead":
+            return "failed"
+        time.sleep(0.1)
+    return "pending"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate and store a JSONL batch of submissions.")
+    parser.add_argument("input", nargs="?", help="JSONL file, or - for stdin")
+    parser.add_argument("--report", help="write per-line results here (JSONL) instead of stdout")
+    parser.add_argument("--no-notify", action="store_true", help="do not send the summary email")
+    parser.add_argument("--notify-wait", type=float, default=30, help="seconds to wait for the summary to be sent")
+    parser.add_argument("--serve", action="store_true", help="run the HTTP endpoint instead")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=INTAKE_PORT)
+    args = parser.parse_args()
+
+    if args.serve:
+        try:
+            server = serve(args.host, args.port)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 1
+        print(f"Bulk intake listening on http://{args.host}:{server.server_address[1]}/intake", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return 0
+    if not args.input:
+        parser.error("an input file (or - for stdin) is required unless --serve is given")
+
+    source = "stdin" if args.input == "-" else os.path.basename(args.input)
+    report = open(args.report, "w", encoding="utf-8") if args.report else sys.stdout
+    try:
+        if args.input == "-":
+            summary, message_id = run_intake(sys.stdin, source, report, not args.no_notify)
+        else:
+            with open(args.input, encoding="utf-8") as f:
+                summary, message_id = run_intake(f, source, report, not args.no_notify)
+    finally:
+        if report is not sys.stdout:
+            report.close()
+    counts = summary.counts
+    print(f"{summary.lines} line(s) in {summary.elapsed:.2f}s: {counts['created']} stored, "
+          f"{counts['duplicate']} duplicate(s), {counts['invalid']} rejected", file=sys.stderr)
+    if message_id is not None:
+        delivery = _wait_for_delivery(message_id, args.notify_wait)
+        if delivery == "failed":
+            print(f"Summary notification: failed, outbox message {message_id} was abandoned", file=sys.stderr)
+        else:
+            print(f"Summary notification: {delivery}", file=sys.stderr)
+    return 1 if counts["invalid"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,186 @@
+import html
+import logging
+import os
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from string import Template
+
+from form_schema import FIELDS, PAGES
+from metrics import DOSSIER_RENDER_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Dossiers are rendered in DOSSIER_WORKERS separate processes, so rendering never
+# competes with the sessions for the GIL; a render slower than DOSSIER_TIMEOUT
+# seconds is abandoned and the email goes out without the attachment
+DOSSIER_WORKERS = int(os.getenv("DOSSIER_WORKERS", 1))
+DOSSIER_TIMEOUT = float(os.getenv("DOSSIER_TIMEOUT", 30))
+DOSSIER_ENABLED = os.getenv("DOSSIER_ENABLED", "true").lower() not in ("0", "false", "no")
+
+PAGE_TITLES = {
+    1: "Section A: Prescribing Physician Information",
+    2: "Section B: Patient Information – Demographics & Clinical Characteristics",
+    3: "Section C: Patient Information – Diagnostic Algorithm",
+    4: "Section D: Patient Information – Treatment Algorithm",
+    5: "Sections E & F: Data Privacy Disclaimer & Physician Declaration",
+}
+
+# Templates are compiled once per process, at import
+_DOCUMENT = Template("""<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>MAP Submission #$id</title>
+<style>
+body { font-family: Arial, Helvetica, sans-serif; font-size: 13px; color: #222; margin: 2em; }
+h1 { font-size: 20px; margin-bottom: 0; }
+h2 { font-size: 15px; color: #1f4e9c; border-bottom: 1px solid #1f4e9c; margin-top: 2em; }
+h3 { font-size: 13px; margin: 1em 0 0.3em; }
+table { border-collapse: collapse; width: 100%; }
+th, td { text-align: left; vertical-align: top; padding: 4px 8px; border-bottom: 1px solid #ddd; }
+th { width: 45%; font-weight: normal; color: #555; }
+.meta { color: #777; }
+</style>
+</head>
+<body>
+<h1>Belinostat &amp; Pralatrexate MAP – Patient Access Form</h1>
+<p class="meta">Submission #$id · received $submitted_at · schema version $schema_version</p>
+$sections
+</body>
+</html>
+""")
+_PAGE = Template("<h2>$title</h2>\n$body")
+_SECTION = Template("<h3>$heading</h3>\n$table")
+_TABLE = Template("<table>\n$rows</table>\n")
+_ROW = Template("<tr><th>$label</th><td>$value</td></tr>\n")
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return "Yes" if value else "No"
+    if isinstance(value, list):
+        return ", ".join(str(v) for v in value) or "–"
+    return str(value) if value not in (None, "") else "–"
+
+
+def _render_section(section, data):
+    rows = "".join(
+        _ROW.substitute(label=html.escape(field.label), value=html.escape(_format_value(data[field.name])))
+        for field in section.fields if field.name in data
+    )
+    table = _TABLE.substitute(rows=rows) if rows else ""
+    children = "".join(_render_section(child, data) for child in section.children)
+    if not table and not children:
+        return ""
+    if section.heading:
+        return _SECTION.substitute(heading=html.escape(section.heading), table=table) + children
+    return table + children
+
+
+def render_dossier(record):
+    """HTML dossier of one serialized submission (see serializers.serialize_submission).
+
+    Only answers present in the record are listed, so branches that were not
+    shown to the physician do not appear.
+    """
+    data = record["data"]
+    pages = []
+    for page, sections in PAGES.items():
+        body = "".join(_render_section(section, data) for section in sections)
+        if body:
+            pages.append(_PAGE.substitute(title=html.escape(PAGE_TITLES[page]), body=body))
+    extra = {name: value for name, value in data.items() if name not in FIELDS}
+    if extra:
+        rows = "".join(_ROW.substitute(label=html.escape(name), value=html.escape(_format_value(value)))
+                       for name, value in extra.items())
+        pages.append(_PAGE.substitute(title="Other answers", body=_TABLE.substitute(rows=rows)))
+    return _DOCUMENT.substitute(
+        id=html.escape(str(record.get("id") or "–")),
+        submitted_at=html.escape(str(record.get("submitted_at") or "–")),
+        schema_version=html.escape(str(record.get("schema_version"))),
+        sections="".join(pages),
+    )
+
+
+class DossierRenderer:
+    """Renders dossiers in a small process pool, created on first use."""
+
+    def __init__(self, max_workers=DOSSIER_WORKERS, timeout=DOSSIER_TIMEOUT):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        # Imported here: multiprocessing is only needed once a dossier is rendered
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        with self._lock:
+            if self._executor is None:
+                # spawn, not fork: the parent runs Streamlit and other threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def _reset(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def render(self, record):
+        # Returns the HTML, or None if rendering failed or timed out; never raises
+        from concurrent.futures.process import BrokenProcessPool
+
+        start = time.perf_counter()
+        executor = self._pool()
+        try:
+            future = executor.submit(render_dossier, record)
+            result = future.result(self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            outcome, result = "timeout", None
+            logger.warning("Dossier for submission %s timed out after %ss", record.get("id"), self.timeout)
+        except BrokenProcessPool:
+            # A crashed worker breaks the whole pool; start a fresh one next time
+            outcome, result = "failed", None
+            logger.exception("Dossier worker process died")
+            self._reset(executor)
+        except Exception:
+            outcome, result = "failed", None
+            logger.exception("Failed to render the dossier for submission %s", record.get("id"))
+        else:
+            outcome = "rendered"
+        DOSSIER_RENDER_SECONDS.observe(time.perf_counter() - start, outcome=outcome)
+        return result
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+def get_renderer():
+    global _renderer
+    with _renderer_lock:
+        if _renderer is None:
+            _renderer = DossierRenderer()
+    return _renderer
+
+
+def dossier_attachment(record):
+    # (filename, content, mime type) for send_email, or None if there is no dossier
+    if not DOSSIER_ENABLED:
+        return None
+    content = get_renderer().render(record)
+    if content is None:
+        return None
+    return f"submission-{record.get('id') or 'new'}.html", content, "text/html"
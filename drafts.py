@@ -0,0 +1,270 @@
+import json
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from datetime import date
+
+import streamlit as st
+
+from form_record import FormRecord
+from form_schema import FIELDS
+from settings import DATA_DIR
+from shared_state import get_shared_state
+
+logger = logging.getLogger(__name__)
+
+DRAFTS_PATH = os.getenv("DRAFTS_PATH", os.path.join(DATA_DIR, "drafts.sqlite3"))
+# Changes are buffered this long before being written, so a burst of keystrokes is one write
+DRAFT_DEBOUNCE_SECONDS = float(os.getenv("DRAFT_DEBOUNCE_SECONDS", 1.0))
+# Drafts kept in the shared state expire this long after their last change
+DRAFT_TTL_SECONDS = float(os.getenv("DRAFT_TTL_SECONDS", 30 * 24 * 3600))
+
+# Query parameter carrying the resume token, so reloading the page resumes the draft
+DRAFT_PARAM = "draft"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS drafts (
+    draft_id TEXT PRIMARY KEY,
+    page INTEGER NOT NULL DEFAULT 1,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS draft_fields (
+    draft_id TEXT NOT NULL,
+    field TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (draft_id, field)
+) WITHOUT ROWID;
+"""
+
+
+def _encode(value):
+    if isinstance(value, date):
+        return json.dumps(value.isoformat())
+    return json.dumps(value)
+
+
+def _decode(name, raw):
+    value = json.loads(raw)
+    field = FIELDS.get(name)
+    if field is not None and field.widget == "date" and isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    return value
+
+
+class DraftStore:
+    """Persists in-progress forms field by field.
+
+    `queue_changes` never touches the disk on the caller's thread: changes are
+    merged per draft in memory and written by a background thread once no new
+    change has arrived for `debounce` seconds.
+    """
+
+    def __init__(self, path=DRAFTS_PATH, debounce=DRAFT_DEBOUNCE_SECONDS):
+        self.path = path
+        self.debounce = debounce
+        self._open(path)
+        self._db_lock = threading.Lock()
+        self._pending = {}
+        self._last_change = 0.0
+        self._cond = threading.Condition()
+        self._writer = threading.Thread(target=self._write_loop, name="draft-writer", daemon=True)
+        self._writer.start()
+
+    def _open(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def queue_changes(self, draft_id, changes, page):
+        with self._cond:
+            fields, _ = self._pending.get(draft_id, ({}, page))
+            fields.update(changes)
+            self._pending[draft_id] = (fields, page)
+            self._last_change = time.monotonic()
+            self._cond.notify()
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                # Debounce: wait until the stream of changes pauses
+                while True:
+                    quiet_for = time.monotonic() - self._last_change
+                    if quiet_for >= self.debounce:
+                        break
+                    self._cond.wait(self.debounce - quiet_for)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to save drafts")
+
+    def flush(self):
+        # Write everything queued so far. The queue is swapped out under the database
+        # lock so a concurrent delete() can never be followed by a stale write.
+        with self._db_lock:
+            with self._cond:
+                pending, self._pending = self._pending, {}
+            if pending:
+                self._write(pending)
+
+    def _write(self, pending):
+        now = time.time()
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.executemany(
+                "INSERT INTO drafts (draft_id, page, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(draft_id) DO UPDATE SET page = excluded.page, updated_at = excluded.updated_at",
+                [(draft_id, page, now) for draft_id, (_, page) in pending.items()],
+            )
+            # A None value means the field was cleared (e.g. pruned with its branch)
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO draft_fields (draft_id, field, value) VALUES (?, ?, ?)",
+                [
+                    (draft_id, name, _encode(value))
+                    for draft_id, (fields, _) in pending.items()
+                    for name, value in fields.items() if value is not None
+                ],
+            )
+            self._conn.executemany(
+                "DELETE FROM draft_fields WHERE draft_id = ? AND field = ?",
+                [
+                    (draft_id, name)
+                    for draft_id, (fields, _) in pending.items()
+                    for name, value in fields.items() if value is None
+                ],
+            )
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def _read(self, draft_id):
+        row = self._conn.execute("SELECT page FROM drafts WHERE draft_id = ?", (draft_id,)).fetchone()
+        if row is None:
+            return None
+        fields = self._conn.execute("SELECT field, value FROM draft_fields WHERE draft_id = ?", (draft_id,)).fetchall()
+        return {name: _decode(name, raw) for name, raw in fields}, row[0]
+
+    def _remove(self, draft_id):
+        self._conn.execute("DELETE FROM draft_fields WHERE draft_id = ?", (draft_id,))
+        self._conn.execute("DELETE FROM drafts WHERE draft_id = ?", (draft_id,))
+
+    def load(self, draft_id):
+        # Returns (form_data, page), or None if the draft does not exist
+        self.flush()
+        with self._db_lock:
+            return self._read(draft_id)
+
+    def delete(self, draft_id):
+        with self._db_lock:
+            with self._cond:
+                self._pending.pop(draft_id, None)
+            self._remove(draft_id)
+
+
+class SharedDraftStore(DraftStore):
+    """DraftStore whose drafts live in the shared state, so a draft saved through
+    one server process can be resumed through any other.
+
+    Each draft is one hash of encoded field values plus its page, expiring
+    `ttl` seconds after its last change.
+    """
+
+    _PAGE = "__page__"
+
+    def __init__(self, state, debounce=DRAFT_DEBOUNCE_SECONDS, ttl=DRAFT_TTL_SECONDS):
+        self.state = state
+        self.ttl = ttl
+        super().__init__(None, debounce)
+
+    def _open(self, path):
+        pass
+
+    def _write(self, pending):
+        for draft_id, (fields, page) in pending.items():
+            key = f"draft:{draft_id}"
+            values = {name: _encode(value) for name, value in fields.items() if value is not None}
+            values[self._PAGE] = page
+            self.state.hset(key, values, ttl=self.ttl)
+            cleared = [name for name, value in fields.items() if value is None]
+            if cleared:
+                self.state.hdel(key, *cleared)
+
+    def _read(self, draft_id):
+        values = self.state.hgetall(f"draft:{draft_id}")
+        if not values:
+            return None
+        page = int(values.pop(self._PAGE, 1))
+        return {name: _decode(name, raw) for name, raw in values.items()}, page
+
+    def _remove(self, draft_id):
+        self.state.delete(f"draft:{draft_id}")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_draft_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            state = get_shared_state()
+            _store = DraftStore() if state is None else SharedDraftStore(state)
+    return _store
+
+
+# ---- Session glue ----
+
+def resume_draft():
+    # Restore form_data, the page and every *_widget key from the token in the URL
+    draft_id = st.query_params.get(DRAFT_PARAM)
+    if not draft_id or st.session_state.get("draft_id") == draft_id:
+        return False
+    loaded = get_draft_store().load(draft_id)
+    if loaded is None:
+        return False
+    data, page = loaded
+    form_data = FormRecord.from_dict(data)
+    # Everything just loaded is already on disk
+    form_data.pop_dirty()
+    st.session_state.form_data = form_data
+    st.session_state.page = page
+    st.session_state.draft_page = page
+    st.session_state.draft_id = draft_id
+    for name in form_data:
+        field = FIELDS[name]
+        st.session_state[field.key] = field.initial_value(form_data)
+    return True
+
+
+def autosave_draft(form_data):
+    # Queue only the fields that changed (or were pruned) since the last autosave
+    form_data.prune()
+    changed = form_data.pop_dirty()
+    if not changed and st.session_state.get("draft_page") == st.session_state.page:
+        return
+    if "draft_id" not in st.session_state:
+        st.session_state.draft_id = secrets.token_urlsafe(16)
+        st.query_params[DRAFT_PARAM] = st.session_state.draft_id
+    changes = {name: form_data.get(name) for name in changed}
+    get_draft_store().queue_changes(st.session_state.draft_id, changes, st.session_state.page)
+    st.session_state.draft_page = st.session_state.page
+
+
+def discard_draft():
+    # The submitted draft's id is kept so a repeated submit still maps to the same
+    # idempotency key; draft_page is kept so no new draft starts until something changes
+    draft_id = st.session_state.pop("draft_id", None)
+    if draft_id:
+        st.session_state.submitted_draft_id = draft_id
+        get_draft_store().delete(draft_id)
+        if DRAFT_PARAM in st.query_params:
+            del st.query_params[DRAFT_PARAM]
@@ -0,0 +1,150 @@
+"""Bulk export of stored submissions.
+
+    python export.py submissions.jsonl.gz
+    python export.py submissions.csv
+    python export.py submissions.parquet      # needs pyarrow
+
+Records are streamed from the store in chunks and written as they arrive, so
+memory use does not grow with the number of submissions. JSONL and CSV are
+gzip-compressed when the output path ends in .gz; parquet files are always
+compressed (zstd).
+"""
+import argparse
+import csv
+import gzip
+import itertools
+import os
+import sys
+from datetime import date
+
+import settings  # noqa: F401  (loads .env before the modules below read their configuration)
+from serializers import COLUMNS, FIELD_TYPES, SCHEMA_VERSION, dumps, flatten, serialize_submission
+from storage import get_store
+
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", 5000))
+FORMATS = ("jsonl", "csv", "parquet")
+
+
+def iter_records(store=None, chunk_size=EXPORT_CHUNK_SIZE):
+    store = store or get_store()
+    for submission_id, created_at, payload in store.iter_all(chunk_size):
+        yield serialize_submission(payload, submission_id, created_at)
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _open_text(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "wt", encoding="utf-8", newline="")
+    return open(path, "w", encoding="utf-8", newline="")
+
+
+def export_jsonl(records, path, chunk_size=EXPORT_CHUNK_SIZE):
+    count = 0
+    with _open_text(path) as f:
+        for chunk in _chunks(records, chunk_size):
+            f.write("".join(dumps(record) + "\n" for record in chunk))
+            count += len(chunk)
+    return count
+
+
+def export_csv(records, path, chunk_size=EXPORT_CHUNK_SIZE):
+    count = 0
+    with _open_text(path) as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for chunk in _chunks(records, chunk_size):
+            writer.writerows(flatten(record) for record in chunk)
+            count += len(chunk)
+    return count
+
+
+def _arrow_schema(pa):
+    types = {
+        "str": pa.string(),
+        "int": pa.int64(),
+        "bool": pa.bool_(),
+        "date": pa.date32(),
+        "list": pa.list_(pa.string()),
+    }
+    fields = [
+        pa.field("schema_version", pa.int32()),
+        pa.field("id", pa.int64()),
+        pa.field("submitted_at", pa.string()),
+    ]
+    fields += [pa.field(name, types[kind]) for name, kind in FIELD_TYPES.items()]
+    return pa.schema(fields, metadata={"schema_version": str(SCHEMA_VERSION)})
+
+
+def _arrow_value(name, value):
+    if value is not None and FIELD_TYPES[name] == "date" and isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    return value
+
+
+def export_parquet(records, path, chunk_size=EXPORT_CHUNK_SIZE):
+    # pyarrow is optional and only needed here, so it is imported on demand
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)") from None
+    schema = _arrow_schema(pa)
+    count = 0
+    # One row group per chunk, built column by column
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        for chunk in _chunks(records, chunk_size):
+            columns = {
+                "schema_version": [r["schema_version"] for r in chunk],
+                "id": [r["id"] for r in chunk],
+                "submitted_at": [r["submitted_at"] for r in chunk],
+            }
+            for name in FIELD_TYPES:
+                columns[name] = [_arrow_value(name, r["data"].get(name)) for r in chunk]
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+            count += len(chunk)
+    return count
+
+
+_EXPORTERS = {"jsonl": export_jsonl, "csv": export_csv, "parquet": export_parquet}
+
+
+def export(path, fmt=None, store=None, chunk_size=EXPORT_CHUNK_SIZE):
+    fmt = fmt or guess_format(path)
+    return _EXPORTERS[fmt](iter_records(store, chunk_size), path, chunk_size)
+
+
+def guess_format(path):
+    name = path[:-3] if path.endswith(".gz") else path
+    extension = os.path.splitext(name)[1].lstrip(".").lower()
+    if extension == "json":
+        extension = "jsonl"
+    if extension not in FORMATS:
+        raise ValueError(f"Cannot tell the export format from {path!r}; use --format")
+    return extension
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export all stored submissions.")
+    parser.add_argument("output", help="output file (.jsonl, .csv, optionally .gz; or .parquet)")
+    parser.add_argument("--format", choices=FORMATS)
+    parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE)
+    args = parser.parse_args()
+    try:
+        count = export(args.output, args.format, chunk_size=args.chunk_size)
+    except (RuntimeError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(f"Exported {count} submission(s) to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
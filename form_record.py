@@ -0,0 +1,152 @@
+from collections.abc import MutableMapping
+from datetime import date
+
+from form_schema import FIELDS, active_fields
+
+# Fields whose answers are stored as an index into their option set, and
+# multiselects whose answers are stored as a bitmask over their option set
+_CODED = frozenset(name for name, f in FIELDS.items() if f.options is not None and f.widget != "multiselect")
+_MASKED = frozenset(name for name, f in FIELDS.items() if f.widget == "multiselect")
+_DATES = frozenset(name for name, f in FIELDS.items() if f.widget == "date")
+
+
+class FormRecord(MutableMapping):
+    """Compact, typed per-session answers to the form.
+
+    One slot per schema field instead of a dict entry. Choice answers are kept
+    as small option indexes and multiselects as bitmasks (small ints are shared
+    by the interpreter, so they cost no per-session memory); only free text,
+    numbers, booleans and dates are stored as given. Reads decode back to the
+    option values, so the record can be used wherever a form_data dict was.
+    """
+
+    __slots__ = tuple(FIELDS) + ("_dirty",)
+
+    def __init__(self, data=None, strict=True):
+        self._dirty = set()
+        if data:
+            self.update_from(data, strict)
+
+    @classmethod
+    def from_dict(cls, data, strict=False):
+        return cls(data, strict)
+
+    def update_from(self, data, strict=True):
+        for name, value in data.items():
+            try:
+                self[name] = value
+            except (KeyError, ValueError):
+                # Unknown fields or choices that no longer exist (e.g. from an old draft)
+                if strict:
+                    raise
+
+    # ---- Encoding ----
+
+    @staticmethod
+    def _encode(name, value):
+        if value is None:
+            return None
+        options = FIELDS[name].options
+        if name in _CODED:
+            index = options.index_of(value, None)
+            if index is None:
+                raise ValueError(f"{value!r} is not a valid choice for {name}")
+            return index
+        if name in _MASKED:
+            mask = 0
+            for item in value:
+                index = options.index_of(item, None)
+                if index is None:
+                    raise ValueError(f"{item!r} is not a valid choice for {name}")
+                mask |= 1 << index
+            return mask
+        return value
+
+    @staticmethod
+    def _decode(name, code):
+        if name in _CODED:
+            return FIELDS[name].options.values[code]
+        if name in _MASKED:
+            return [v for i, v in enumerate(FIELDS[name].options.values) if code >> i & 1]
+        return code
+
+    # ---- Mapping interface ----
+
+    def __getitem__(self, name):
+        if name not in FIELDS:
+            raise KeyError(name)
+        code = getattr(self, name, None)
+        if code is None:
+            raise KeyError(name)
+        return self._decode(name, code)
+
+    def __setitem__(self, name, value):
+        if name not in FIELDS:
+            raise KeyError(name)
+        code = self._encode(name, value)
+        if getattr(self, name, None) != code:
+            setattr(self, name, code)
+            self._dirty.add(name)
+
+    def __delitem__(self, name):
+        if getattr(self, name, None) is None:
+            raise KeyError(name)
+        setattr(self, name, None)
+        self._dirty.add(name)
+
+    def __iter__(self):
+        return (name for name in FIELDS if getattr(self, name, None) is not None)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+    def to_dict(self):
+        return {name: self._decode(name, getattr(self, name)) for name in self}
+
+    # ---- Lifecycle ----
+
+    def prune(self):
+        # Drop answers of branches that are no longer shown, e.g. ptcl_* after
+        # switching to CTCL or therapy3_* after lowering num_therapies
+        pruned = []
+        while True:
+            active = set(active_fields(self))
+            stale = [name for name in self if name not in active]
+            if not stale:
+                return pruned
+            for name in stale:
+                del self[name]
+            pruned.extend(stale)
+
+    def pop_dirty(self):
+        # Names of fields set or cleared since the last call
+        dirty, self._dirty = self._dirty, set()
+        return dirty
+
+    # ---- Spilling ----
+
+    def spill(self):
+        """Empty the record in place and return what it held as JSON-ready data.
+
+        The stored codes are kept as they are (option indexes and bitmasks), in
+        schema order, together with the fields not yet autosaved; `unspill` puts
+        both back. The object itself stays, so references to it (e.g. held by
+        a section fragment) see the answers again once it is refilled.
+        """
+        codes = []
+        for name in FIELDS:
+            code = getattr(self, name, None)
+            codes.append(code.isoformat() if isinstance(code, date) else code)
+            setattr(self, name, None)
+        dirty, self._dirty = sorted(self._dirty), set()
+        return {"codes": codes, "dirty": dirty}
+
+    def unspill(self, spilled):
+        for name, code in zip(FIELDS, spilled["codes"]):
+            if code is not None and name in _DATES:
+                code = date.fromisoformat(code[:10])
+            setattr(self, name, code)
+        self._dirty = set(spilled["dirty"])
@@ -0,0 +1,100 @@
+import threading
+
+import streamlit as st
+
+from form_schema import PAGES
+from metrics import SECTION_RENDER_SECONDS
+from sessions import track_session
+from validation import session_validator
+
+# Each Streamlit session runs its script on its own thread, so the widget count is per run
+_run_stats = threading.local()
+
+
+def reset_widget_count():
+    _run_stats.widgets = 0
+
+
+def widget_count():
+    return getattr(_run_stats, "widgets", 0)
+
+
+def _selectbox(field):
+    return st.selectbox(field.display_label, field.options.values, key=field.key)
+
+
+def _radio(field):
+    return st.radio(field.display_label, field.options.values, key=field.key)
+
+
+def _multiselect(field):
+    return st.multiselect(field.display_label, field.options.values, key=field.key)
+
+
+def _text(field):
+    return st.text_input(field.display_label, key=field.key)
+
+
+def _number(field):
+    return st.number_input(field.display_label, min_value=field.min_value, key=field.key)
+
+
+def _checkbox(field):
+    return st.checkbox(field.display_label, key=field.key)
+
+
+def _date(field):
+    return st.date_input(field.display_label, key=field.key)
+
+
+_WIDGETS = {
+    "selectbox": _selectbox,
+    "radio": _radio,
+    "multiselect": _multiselect,
+    "text": _text,
+    "number": _number,
+    "checkbox": _checkbox,
+    "date": _date,
+}
+
+
+def render_field(field, form_data):
+    # Seed the widget from the stored answer the first time it is shown on this visit to the page
+    if field.key not in st.session_state:
+        st.session_state[field.key] = field.initial_value(form_data)
+    value = _WIDGETS[field.widget](field)
+    _run_stats.widgets = widget_count() + 1
+    form_data[field.name] = value
+    # Only re-checked when this answer (or one a cross-field rule compares it with) changed
+    for problem in session_validator().field_problems(field.name, form_data):
+        st.error(problem.message)
+    return value
+
+
+@st.fragment
+def render_section(section, form_data, after_render=None):
+    # Each section is a fragment: changing one of its widgets reruns only this
+    # function (and its child sections), not the whole app script.
+    # Visibility is evaluated against form_data as it is updated, so a field can
+    # depend on any field rendered before it in the same section or its parents.
+    # A fragment rerun doesn't run the app script, so it marks the session active
+    # (and restores answers spilled while it was idle) itself.
+    track_session()
+    if not section.is_visible(form_data):
+        return
+    with SECTION_RENDER_SECONDS.time(section=section.name):
+        if section.heading:
+            st.subheader(section.heading)
+        for field in section.fields:
+            if field.is_visible(form_data):
+                render_field(field, form_data)
+    for child in section.children:
+        render_section(child, form_data, after_render)
+    # Called on full and fragment reruns alike, e.g. to autosave what just changed
+    if after_render is not None:
+        after_render(form_data)
+
+
+def render_page(page, form_data, after_render=None):
+    for section in PAGES.get(page, ()):
+        render_section(section, form_data, after_render)
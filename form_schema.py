@@ -0,0 +1,290 @@
+import re
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Any, Callable, Optional, Tuple
+
+# Declarative description of the MAP form. Everything in this module is built once
+# at import time and shared (read-only) by every session; the Streamlit rendering
+# lives in form_render.py.
+
+
+class OptionSet:
+    """Immutable option list with an O(1) value -> index lookup.
+
+    With `placeholder=True` the first value is a prompt such as "Select Country"
+    rather than an answer, so it does not satisfy a required field.
+    """
+
+    __slots__ = ("values", "placeholder", "_index")
+
+    def __init__(self, values, placeholder=False):
+        self.values = tuple(values)
+        self.placeholder = self.values[0] if placeholder else None
+        self._index = {value: i for i, value in enumerate(self.values)}
+
+    def __contains__(self, value):
+        return value in self._index
+
+    def __len__(self):
+        return len(self.values)
+
+    def index_of(self, value, default=0):
+        return self._index.get(value, default)
+
+
+@dataclass(frozen=True)
+class Field:
+    name: str
+    label: str
+    # One of: selectbox, radio, multiselect, text, number, checkbox, date
+    widget: str
+    options: Optional[OptionSet] = None
+    # A value, or a zero-argument callable for defaults that depend on the current date
+    default: Any = None
+    required: bool = False
+    visible: Optional[Callable[[dict], bool]] = None
+    # Matched against the whole answer; checked (like everything else) in validation.py
+    pattern: Optional["re.Pattern"] = None
+    pattern_error: str = ""
+    min_value: Optional[int] = None
+
+    @property
+    def key(self):
+        return f"{self.name}_widget"
+
+    @property
+    def display_label(self):
+        return f"{self.label} *" if self.required else self.label
+
+    def default_value(self):
+        if callable(self.default):
+            return self.default()
+        if self.default is None:
+            if self.widget == "multiselect":
+                return []
+            if self.options is not None:
+                return self.options.values[0]
+        return self.default
+
+    def initial_value(self, form_data):
+        # The stored answer if it is still a valid choice, otherwise the default
+        value = form_data.get(self.name, None)
+        if value is None:
+            return self.default_value()
+        if self.widget == "multiselect":
+            return [v for v in value if v in self.options]
+        if self.options is not None and value not in self.options:
+            return self.default_value()
+        return value
+
+    def is_visible(self, form_data):
+        return self.visible is None or self.visible(form_data)
+
+
+@dataclass(frozen=True)
+class Section:
+    name: str
+    fields: Tuple[Field, ...]
+    heading: Optional[str] = None
+    visible: Optional[Callable[[dict], bool]] = None
+    # Nested sections that may depend on this section's fields (e.g. therapy lines on num_therapies)
+    children: Tuple["Section", ...] = ()
+
+    def walk(self):
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+    def is_visible(self, form_data):
+        return self.visible is None or self.visible(form_data)
+
+
+def _equals(name, *values):
+    return lambda form_data: form_data.get(name) in values
+
+
+def _contains(name, value):
+    return lambda form_data: value in (form_data.get(name) or ())
+
+
+# ---- Option tables ----
+
+_THIS_YEAR = datetime.now().year
+
+COUNTRIES = OptionSet(["Select Country", "Switzerland", "France", "Germany", "United Kingdom"], placeholder=True)
+SEXES = OptionSet(["Male", "Female"])
+BIRTH_YEARS = OptionSet(range(1920, _THIS_YEAR + 1))
+HEIGHTS = OptionSet(range(100, 221))
+WEIGHTS = OptionSet(range(20, 201))
+DIAGNOSIS_YEARS = OptionSet(range(1950, _THIS_YEAR + 1))
+TCELL_DIAGNOSES = OptionSet(["PTCL", "CTCL"])
+PTCL_SUBTYPES = OptionSet(["Select Subtype", "PTCL-NOS", "AITL", "ALCL", "Extra-nodal", "Other"], placeholder=True)
+CTCL_SUBTYPES = OptionSet(["Select Subtype", "Mycosis Fungoides", "Sezary Syndrome", "Other"], placeholder=True)
+TIME_UNITS = OptionSet(["weeks", "months"])
+DIAGNOSTIC_TESTS = OptionSet(["Flow Cytometry", "Genetic Testing", "Immunohistochemistry", "Other"])
+SPECIMEN_TYPES = OptionSet(["Bone Marrow", "Whole Blood", "Biopsy", "Other"])
+BIOMARKERS = OptionSet([
+    "Immunophenotypic Markers", "Genetic Markers", "Transcription Factors", "Serum Markers",
+    "Metabolic Markers", "Cell Proliferation Markers", "EBV", "HIV", "HTLV-1", "TFH Markers", "Other",
+])
+YES_NO = OptionSet(["Yes", "No"])
+AVAILABLE_SPECIMENS = OptionSet(["FFPE", "Frozen Tissue", "Other"])
+THERAPY_COUNTS = OptionSet(["Select Number", "0", "1", "2", "3"], placeholder=True)
+THERAPY_CYCLES = OptionSet(range(1, 21))
+THERAPY_OUTCOMES = OptionSet(["CR", "PR", "SD", "PD"])
+THERAPY_DURATIONS = OptionSet(range(1, 61))
+TRANSPLANTS = OptionSet(["Autologous", "Allogenic", "No"])
+
+EMAIL_PATTERN = re.compile(r"[^@]+@[^@]+\.[^@]+")
+
+# ---- Sections ----
+
+PHYSICIAN = Section("physician", (
+    Field("phys_country", "Country", "selectbox", COUNTRIES),
+    Field("phys_name", "Physician Name", "text", default=""),
+    Field("phys_email", "Email Address", "text", default="",
+          pattern=EMAIL_PATTERN, pattern_error="Please enter a valid email address."),
+    Field("phys_hospital", "Hospital/Treatment Center", "text", default=""),
+))
+
+DEMOGRAPHICS = Section("demographics", (
+    Field("patient_sex", "Sex", "radio", SEXES, required=True),
+    Field("birth_year", "Birth Year", "selectbox", BIRTH_YEARS, required=True),
+    Field("height", "Height (cm)", "selectbox", HEIGHTS, required=True),
+    Field("weight", "Weight (kg)", "selectbox", WEIGHTS, required=True),
+    Field("diag_year", "Initial Diagnosis Year", "selectbox", DIAGNOSIS_YEARS, required=True),
+))
+
+DIAGNOSIS = Section("diagnosis", (
+    Field("tcell_diagnosis", "Diagnosis of T-Cell Lymphoma", "radio", TCELL_DIAGNOSES, required=True),
+    Field("ptcl_subtype", "Subtype (PTCL)", "selectbox", PTCL_SUBTYPES, required=True,
+          visible=_equals("tcell_diagnosis", "PTCL")),
+    Field("ptcl_extra_other", "Specify subtype...", "text", default="",
+          visible=lambda d: d.get("tcell_diagnosis") == "PTCL"
+          and d.get("ptcl_subtype") in ("Extra-nodal", "Other")),
+    Field("ctcl_subtype", "Subtype (CTCL)", "selectbox", CTCL_SUBTYPES, required=True,
+          visible=_equals("tcell_diagnosis", "CTCL")),
+    Field("ctcl_other", "Specify subtype...", "text", default="",
+          visible=lambda d: d.get("tcell_diagnosis") == "CTCL" and d.get("ctcl_subtype") == "Other"),
+))
+
+DIAGNOSTICS = Section("diagnostics", (
+    Field("time_to_diagnosis", "Time to Diagnosis", "number", default=0, min_value=0),
+    Field("time_to_diagnosis_unit", "Unit", "selectbox", TIME_UNITS),
+    Field("diag_tests", "Diagnostic Tests Used", "multiselect", DIAGNOSTIC_TESTS, required=True),
+    Field("diag_test_other_text", "Other test...", "text", default="",
+          visible=_contains("diag_tests", "Other")),
+    Field("specimen_type", "Types of Specimens Used", "multiselect", SPECIMEN_TYPES),
+    Field("specimen_other_text", "Other specimen...", "text", default="",
+          visible=_contains("specimen_type", "Other")),
+    Field("biomarkers", "Biomarkers Considered", "multiselect", BIOMARKERS),
+    Field("biom_other_text", "Other biomarkers...", "text", default="",
+          visible=_contains("biomarkers", "Other")),
+    Field("cytogenetics", "Cytogenetic Abnormalities?", "radio", YES_NO),
+    Field("cytogenetic_text", "If yes, specify:", "text", default="",
+          visible=_equals("cytogenetics", "Yes")),
+    Field("specimens_avail", "Biological Specimens Available for research?", "radio", YES_NO),
+    Field("specimen_available_type", "Available Specimens:", "multiselect", AVAILABLE_SPECIMENS,
+          visible=_equals("specimens_avail", "Yes")),
+    Field("spec_avail_other_text", "Other specimen type...", "text", default="",
+          visible=lambda d: d.get("specimens_avail") == "Yes"
+          and "Other" in (d.get("specimen_available_type") or ())),
+))
+
+
+
+def _therapy_line(line, heading, type_label, visible_counts):
+    prefix = f"therapy{line}"
+    return Section(prefix, (
+        Field(f"{prefix}_type", type_label, "text", default=""),
+        Field(f"{prefix}_cycles", "Number of cycles", "selectbox", THERAPY_CYCLES),
+        Field(f"{prefix}_outcome", "Outcome", "radio", THERAPY_OUTCOMES),
+        Field(f"{prefix}_duration", "Duration of therapy (months)", "selectbox", THERAPY_DURATIONS),
+    ), heading=heading, visible=visible_counts)
+
+
+# The first line is shown until "0" is picked, matching the placeholder behaviour of the form
+THERAPY_LINES = (
+    _therapy_line(1, "1st Line Therapy", "Type of therapy (regimen)", lambda d: d.get("num_therapies") != "0"),
+    _therapy_line(2, "2nd Line Therapy", "Type of therapy", _equals("num_therapies", "2", "3")),
+    _therapy_line(3, "3rd Line Therapy", "Type of therapy", _equals("num_therapies", "3")),
+)
+
+THERAPIES = Section("therapies", (
+    Field("num_therapies", "Number of Prior Systemic Therapies", "selectbox", THERAPY_COUNTS, required=True),
+), children=THERAPY_LINES)
+
+TRANSPLANT = Section("transplant", (
+    Field("prev_transplant", "Previous Stem Cell Transplantation?", "radio", TRANSPLANTS, required=True),
+    Field("auto_regimen", "Autologous Transplant – Conditioning Regimen:", "text", default="",
+          visible=_equals("prev_transplant", "Autologous")),
+    Field("allo_regimen", "Allogenic Transplant – Conditioning Regimen:", "text", default="",
+          visible=_equals("prev_transplant", "Allogenic")),
+    Field("allo_bridging", "Allogenic Transplant – Bridging Therapy:", "text", default="",
+          visible=_equals("prev_transplant", "Allogenic")),
+))
+
+DECLARATION = Section("declaration", (
+    Field("agree_decl", "I, the prescribing physician, have read and agree to the above declarations and terms.",
+          "checkbox", default=False, required=True),
+    Field("phys_signature", "Physician Signature (Full Name)", "text", default="", required=True),
+    Field("sign_date", "Date", "date", default=date.today, required=True),
+))
+
+PAGES = {
+    1: (PHYSICIAN,),
+    2: (DEMOGRAPHICS, DIAGNOSIS),
+    3: (DIAGNOSTICS,),
+    4: (THERAPIES, TRANSPLANT),
+    5: (DECLARATION,),
+}
+
+SECTIONS = {
+    section.name: section
+    for sections in PAGES.values() for top in sections for section in top.walk()
+}
+FIELDS = {field.name: field for section in SECTIONS.values() for field in section.fields}
+SECTION_OF = {field.name: section for section in SECTIONS.values() for field in section.fields}
+
+
+def _section_paths():
+    # Section name -> the section and all of its ancestors, outermost first
+    paths = {}
+
+    def visit(section, parents):
+        paths[section.name] = parents + (section,)
+        for child in section.children:
+            visit(child, paths[section.name])
+
+    for sections in PAGES.values():
+        for section in sections:
+            visit(section, ())
+    return paths
+
+
+SECTION_PATHS = _section_paths()
+
+
+def is_field_active(name, form_data):
+    # A field is active when it and every enclosing section are visible for these answers
+    field = FIELDS[name]
+    return all(s.is_visible(form_data) for s in SECTION_PATHS[SECTION_OF[name].name]) \
+        and field.is_visible(form_data)
+
+
+def active_fields(form_data):
+    # Names of every active field, in form order; one visibility check per section
+    # and field instead of re-checking the enclosing sections for each field
+    active = []
+
+    def visit(section):
+        if not section.is_visible(form_data):
+            return
+        active.extend(field.name for field in section.fields if field.is_visible(form_data))
+        for child in section.children:
+            visit(child)
+
+    for sections in PAGES.values():
+        for section in sections:
+            visit(section)
+    return active
@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from serializers import json_default
+from shared_state import get_shared_state
+
+# Recently accepted submissions are remembered in memory for DEDUP_TTL_SECONDS, up
+# to DEDUP_MAX_KEYS of them; older repeats are still caught by the store's unique key
+DEDUP_TTL_SECONDS = float(os.getenv("DEDUP_TTL_SECONDS", 24 * 3600))
+DEDUP_MAX_KEYS = int(os.getenv("DEDUP_MAX_KEYS", 10000))
+# A claim on a key that is being stored expires after this long, in case its owner died
+DEDUP_CLAIM_SECONDS = float(os.getenv("DEDUP_CLAIM_SECONDS", 60))
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, (list, tuple, set)):
+        return sorted((_normalize(v) for v in value), key=str)
+    return value
+
+
+def submission_key(form_data, draft_id=None):
+    # SHA-256 of the canonical JSON of the answers, scoped to the draft they were
+    # entered in, so the same form submitted twice always yields the same key
+    normalized = {
+        name: _normalize(value) for name, value in form_data.items()
+        if value is not None and value != ""
+    }
+    if isinstance(normalized.get("phys_email"), str):
+        normalized["phys_email"] = normalized["phys_email"].lower()
+    canonical = json.dumps(
+        [draft_id or "", normalized], default=json_default, sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class DedupIndex:
+    """Bounded map of idempotency key -> submission id whose entries expire after `ttl`.
+
+    Entries are kept in insertion order, so both expiry and eviction only ever
+    look at the oldest entry and every operation is O(1) amortized.
+    """
+
+    def __init__(self, ttl=DEDUP_TTL_SECONDS, max_keys=DEDUP_MAX_KEYS):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        while self._entries:
+            expires_at, _ = next(iter(self._entries.values()))
+            if expires_at > now and len(self._entries) <= self.max_keys:
+                return
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        # The submission id, or None if unknown or only claimed so far
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(key)
+        return entry[1] if entry else None
+
+    def claim(self, key):
+        # True if the caller may store this submission: nobody has stored or claimed it
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                return False
+            self._entries.pop(key, None)
+            self._entries[key] = (now + DEDUP_CLAIM_SECONDS, None)
+        return True
+
+    def release(self, key):
+        # Give up a claim whose submission could not be stored
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] is None:
+                del self._entries[key]
+
+    def add(self, key, submission_id):
+        now = time.monotonic()
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (now + self.ttl, submission_id)
+            self._expire(now)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SharedDedupIndex:
+    """DedupIndex counterpart kept in the shared state, so every server process
+    sees the others' claims and submissions; claims are a set-if-absent."""
+
+    def __init__(self, state, ttl=DEDUP_TTL_SECONDS):
+        self.state = state
+        self.ttl = ttl
+
+    def get(self, key):
+        value = self.state.get(f"dedup:{key}")
+        return int(value) if value else None
+
+    def claim(self, key):
+        return self.state.add(f"dedup:{key}", "", ttl=DEDUP_CLAIM_SECONDS)
+
+    def release(self, key):
+        # Only while it is still a claim: the key may have been stored meanwhile
+        self.state.delete_if(f"dedup:{key}", "")
+
+    def add(self, key, submission_id):
+        self.state.set(f"dedup:{key}", submission_id, ttl=self.ttl)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_dedup_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            state = get_shared_state()
+            _index = DedupIndex() if state is None else SharedDedupIndex(state)
+    return _index
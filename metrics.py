@@ -0,0 +1,246 @@
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Aggregated metrics are exported in the Prometheus text format, either written to
+# METRICS_FILE every METRICS_EXPORT_INTERVAL seconds or served on 127.0.0.1:METRICS_PORT
+METRICS_FILE = os.getenv("METRICS_FILE", "")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+METRICS_EXPORT_INTERVAL = float(os.getenv("METRICS_EXPORT_INTERVAL", 15))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            series = sorted(self._series.items())
+            lines.extend(line for key, value in series for line in self._render_series(key, value))
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._series.get(self._key(labels), 0)
+
+    def _render_series(self, key, value):
+        yield f"{self.name}_total{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket (non-cumulative) counts, then count and sum
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0, 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += 1
+            series[2] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self, **labels):
+        # (count, sum) for one label set
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            return (series[1], series[2]) if series else (0, 0.0)
+
+    def _render_series(self, key, value):
+        counts, count, total = value
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = "+Inf" if bound == float("inf") else _format_value(bound)
+            yield f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', le)])} {cumulative}"
+        yield f"{self.name}_count{_format_labels(self.labelnames, key)} {count}"
+        yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
+
+# ---- Form metrics ----
+
+RERUN_SECONDS = REGISTRY.histogram(
+    "form_rerun_seconds", "Wall time of a full app script run", ("page",))
+SECTION_RENDER_SECONDS = REGISTRY.histogram(
+    "form_section_render_seconds", "Wall time of rendering one form section (full or fragment rerun)",
+    ("section",))
+WIDGETS_RENDERED = REGISTRY.histogram(
+    "form_widgets_rendered", "Form widgets rendered in a full app script run", ("page",),
+    buckets=COUNT_BUCKETS)
+FORM_DATA_BYTES = REGISTRY.histogram(
+    "form_data_bytes", "Serialized size of form_data at the end of a script run", ("page",),
+    buckets=SIZE_BUCKETS)
+SUBMIT_SECONDS = REGISTRY.histogram(
+    "form_submit_seconds", "Time spent in the submit handler", ("outcome",))
+SEND_EMAIL_SECONDS = REGISTRY.histogram(
+    "smtp_send_email_seconds", "Time spent inside send_email", ("outcome",))
+SMTP_PHASE_SECONDS = REGISTRY.histogram(
+    "smtp_phase_seconds",
+    "Time spent in one phase of SMTP delivery: pool_wait, connect (through the greeting), ehlo, "
+    "starttls, auth, noop (pool health check), data (MAIL, RCPT and DATA) or quit",
+    ("phase", "outcome"))
+SMTP_FAILURES = REGISTRY.counter(
+    "smtp_failures",
+    "Failed SMTP phases by kind: auth, tls, timeout, dns, connection, 4xx, 5xx or other",
+    ("phase", "kind"))
+DOSSIER_RENDER_SECONDS = REGISTRY.histogram(
+    "dossier_render_seconds", "Time to render a submission dossier in the process pool", ("outcome",))
+ADMIN_QUERY_SECONDS = REGISTRY.histogram(
+    "admin_query_seconds", "Store queries run by the admin dashboard (cache misses only)", ("query",))
+RATE_LIMITED = REGISTRY.counter(
+    "rate_limited", "Submissions shed by the rate limiter, by the limit that refused", ("scope",))
+BULK_INTAKE_RECORDS = REGISTRY.counter(
+    "bulk_intake_records", "Records received through bulk intake", ("outcome",))
+SESSIONS_SPILLED = REGISTRY.counter(
+    "sessions_spilled", "Idle form sessions whose answers were moved from memory to disk", ("reason",))
+SESSIONS_REHYDRATED = REGISTRY.counter(
+    "sessions_rehydrated", "Spilled form sessions restored when their user returned", ("outcome",))
+
+# ---- Export ----
+
+
+def write_metrics_file(path=None):
+    # Write atomically so a scraper never reads a half-written file
+    path = path or METRICS_FILE
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(REGISTRY.render())
+    os.replace(tmp_path, path)
+
+
+def _serve_metrics(port):
+    # http.server is only imported when the HTTP exporter is enabled
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = REGISTRY.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+
+
+def _export_loop(path, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            write_metrics_file(path)
+        except OSError:
+            logger.exception("Failed to write metrics to %s", path)
+
+
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+
+def start_exporters():
+    # Start the configured exporters once per process
+    global _exporters_started
+    with _exporters_lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+    if METRICS_FILE:
+        threading.Thread(
+            target=_export_loop, args=(METRICS_FILE, METRICS_EXPORT_INTERVAL), name="metrics-file", daemon=True
+        ).start()
+    if METRICS_PORT:
+        _serve_metrics(METRICS_PORT)
+        logger.info("Serving metrics on http://127.0.0.1:%s/metrics", METRICS_PORT)
@@ -0,0 +1,40 @@
+import os
+from datetime import datetime
+
+from outbox import enqueue_digest_item, enqueue_email
+from serializers import dumps, serialize_submission
+
+# "immediate" sends one email per submission; "digest" coalesces submissions
+# (see DIGEST_WINDOW_SECONDS / DIGEST_MAX_SUBMISSIONS in outbox.py)
+NOTIFY_MODE = os.getenv("NOTIFY_MODE", "immediate").lower()
+
+SUBMISSION_SUBJECT = "MAP Form Submission Notification"
+
+
+def format_submission_section(form_data, received_at=None, submission_id=None):
+    # One "field: value" line per answer so digests stay readable with many submissions
+    received_at = received_at or datetime.now()
+    record = serialize_submission(form_data, submission_id, received_at)
+    lines = [f"Received: {received_at:%Y-%m-%d %H:%M:%S}"]
+    if submission_id is not None:
+        lines.append(f"Submission: #{submission_id}")
+    for key, value in record["data"].items():
+        if isinstance(value, list):
+            value = ", ".join(str(v) for v in value)
+        lines.append(f"{key}: {value}")
+    return "\n".join(lines)
+
+
+def notify_submission(form_data, to_email, submission_id=None):
+    # Returns False if the notification about this stored submission was already queued
+    if NOTIFY_MODE == "digest":
+        return enqueue_digest_item(
+            format_submission_section(form_data, submission_id=submission_id), to_email, submission_id
+        )
+    # The submission itself is attached as versioned JSON (see serializers.py) so it can be parsed
+    record = serialize_submission(form_data, submission_id, datetime.now())
+    body = "A new form submission has been received and processed successfully.\n\n" + \
+        "Please review the submission in the admin dashboard.\n\n" + \
+        dumps(record, indent=2)
+    # A formatted dossier of the submission is rendered and attached in the background
+    return enqueue_email(SUBMISSION_SUBJECT, body, to_email, dossier=record, submission_id=submission_id) is not None
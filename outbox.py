@@ -0,0 +1,364 @@
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dossier import dossier_attachment
+from rate_limit import get_rate_limiter
+from send_email import send_email
+from settings import DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_PATH = os.getenv("OUTBOX_PATH", os.path.join(DATA_DIR, "outbox.sqlite3"))
+OUTBOX_MAX_WORKERS = int(os.getenv("OUTBOX_MAX_WORKERS", 2))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 8))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", 5))
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", 900))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", 2))
+# Seconds to wait for another process's write lock on the outbox file before giving up
+OUTBOX_BUSY_TIMEOUT = float(os.getenv("OUTBOX_BUSY_TIMEOUT", 30))
+
+# Digest batching: pending sections are coalesced into one message once the oldest
+# is DIGEST_WINDOW_SECONDS old or DIGEST_MAX_SUBMISSIONS have accumulated
+DIGEST_WINDOW_SECONDS = float(os.getenv("DIGEST_WINDOW_SECONDS", 300))
+DIGEST_MAX_SUBMISSIONS = int(os.getenv("DIGEST_MAX_SUBMISSIONS", 50))
+DIGEST_SUBJECT = "MAP Form Submission Digest ({count} submission(s))"
+DIGEST_INTRO = "{count} new form submission(s) have been received and processed successfully.\n\n" + \
+    "Please review the submissions in the admin dashboard.\n\n"
+
+# A message claimed by a worker that has not been resolved after this many
+# seconds is assumed to belong to a crashed process and is retried.
+OUTBOX_LEASE_SECONDS = 300
+
+# Rate limiter bucket for outbound notifications (NOTIFY_MAX_PER_MINUTE in rate_limit.py)
+_NOTIFY_KEY = ("notify", "")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    subject TEXT NOT NULL,
+    body TEXT NOT NULL,
+    to_email TEXT NOT NULL DEFAULT '',
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    claimed_at REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    dossier TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at);
+CREATE TABLE IF NOT EXISTS digest_items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    to_email TEXT NOT NULL DEFAULT '',
+    section TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_digest_items_to ON digest_items (to_email, id);
+CREATE TABLE IF NOT EXISTS notified_submissions (
+    submission_id INTEGER PRIMARY KEY,
+    queued_at REAL NOT NULL
+);
+"""
+
+# Columns added after the first release, created on existing outboxes at startup
+_ADDED_COLUMNS = {"dossier": "TEXT"}
+
+
+def backoff_delay(attempts, base=OUTBOX_BACKOFF_BASE, maximum=OUTBOX_BACKOFF_MAX):
+    # Exponential backoff with jitter: half to all of min(max, base * 2^(attempts-1))
+    ceiling = min(maximum, base * (2 ** max(attempts - 1, 0)))
+    return random.uniform(ceiling / 2, ceiling)
+
+
+class Outbox:
+    """Durable queue of notification emails backed by a local SQLite file."""
+
+    def __init__(self, path=OUTBOX_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=OUTBOX_BUSY_TIMEOUT)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # FULL makes every committed enqueue survive power loss, not just a crash
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.executescript(_SCHEMA)
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(outbox)")}
+        for column, kind in _ADDED_COLUMNS.items():
+            if column not in existing:
+                self._conn.execute(f"ALTER TABLE outbox ADD COLUMN {column} {kind}")
+
+    def _mark_notified_locked(self, submission_id, now):
+        # Records that a submission's notification is queued; False if it already was.
+        # Written in the transaction that queues it, so the two never disagree.
+        if submission_id is None:
+            return True
+        cur = self._conn.execute(
+            "INSERT OR IGNORE INTO notified_submissions (submission_id, queued_at) VALUES (?, ?)",
+            (submission_id, now),
+        )
+        return cur.rowcount == 1
+
+    def enqueue(self, subject, body, to_email="", dossier=None, submission_id=None):
+        # Returns only once the row is committed to disk. `dossier` is a serialized
+        # submission record, rendered and attached at delivery time. A notification
+        # about a stored submission is queued once: repeats return None.
+        now = time.time()
+        message_id = None
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self._mark_notified_locked(submission_id, now):
+                    message_id = self._conn.execute(
+                        "INSERT INTO outbox (subject, body, to_email, next_attempt_at, created_at, dossier) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (str(subject), body, to_email or "", now, now, json.dumps(dossier) if dossier else None),
+                    ).lastrowid
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return message_id
+
+    def add_digest_item(self, section, to_email="", max_items=DIGEST_MAX_SUBMISSIONS, submission_id=None):
+        # Park a submission section; the digest is enqueued in the same transaction once full.
+        # Returns (queued, flushed); a submission's section is only ever parked once.
+        now = time.time()
+        to_email = to_email or ""
+        queued = flushed = False
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self._mark_notified_locked(submission_id, now):
+                    queued = True
+                    self._conn.execute(
+                        "INSERT INTO digest_items (to_email, section, created_at) VALUES (?, ?, ?)",
+                        (to_email, section, now),
+                    )
+                    (count,) = self._conn.execute(
+                        "SELECT COUNT(*) FROM digest_items WHERE to_email = ?", (to_email,)
+                    ).fetchone()
+                    flushed = count >= max_items and self._flush_digest_locked(to_email, now)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return queued, flushed
+
+    def flush_due_digests(self, window=DIGEST_WINDOW_SECONDS):
+        # Enqueue a digest for every recipient whose oldest parked section is older than `window`
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                recipients = [row[0] for row in self._conn.execute(
+                    "SELECT to_email FROM digest_items GROUP BY to_email HAVING MIN(created_at) <= ?",
+                    (now - window,),
+                )]
+                for to_email in recipients:
+                    self._flush_digest_locked(to_email, now)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return len(recipients)
+
+    def _flush_digest_locked(self, to_email, now):
+        rows = self._conn.execute(
+            "SELECT id, section FROM digest_items WHERE to_email = ? ORDER BY id", (to_email,)
+        ).fetchall()
+        if not rows:
+            return False
+        count = len(rows)
+        sections = [
+            f"=== Submission {i} of {count} ===\n{section}" for i, (_, section) in enumerate(rows, 1)
+        ]
+        self._conn.execute(
+            "INSERT INTO outbox (subject, body, to_email, next_attempt_at, created_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (
+                DIGEST_SUBJECT.format(count=count),
+                DIGEST_INTRO.format(count=count) + "\n\n".join(sections),
+                to_email,
+                now,
+                now,
+            ),
+        )
+        self._conn.execute("DELETE FROM digest_items WHERE to_email = ? AND id <= ?", (to_email, rows[-1][0]))
+        return True
+
+    def claim(self, limit):
+        # Atomically move up to `limit` due messages into the 'sending' state
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "UPDATE outbox SET status = 'pending' "
+                    "WHERE status = 'sending' AND claimed_at < ?",
+                    (now - OUTBOX_LEASE_SECONDS,),
+                )
+                rows = self._conn.execute(
+                    "SELECT id, subject, body, to_email, attempts, dossier FROM outbox "
+                    "WHERE status = 'pending' AND next_attempt_at <= ? "
+                    "ORDER BY next_attempt_at LIMIT ?",
+                    (now, limit),
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE outbox SET status = 'sending', claimed_at = ? WHERE id = ?",
+                    [(now, row[0]) for row in rows],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return rows
+
+    def mark_sent(self, message_id):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE outbox SET status = 'sent', claimed_at = NULL WHERE id = ?",
+                (message_id,),
+            )
+
+    def mark_failed(self, message_id, attempts, error):
+        # Reschedule with backoff, or give up after OUTBOX_MAX_ATTEMPTS tries
+        if attempts >= OUTBOX_MAX_ATTEMPTS:
+            status, next_attempt_at = "dead", time.time()
+            logger.error("Outbox message %s abandoned after %s attempts: %s", message_id, attempts, error)
+        else:
+            status, next_attempt_at = "pending", time.time() + backoff_delay(attempts)
+        with self._lock:
+            self._conn.execute(
+                "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, "
+                "claimed_at = NULL, last_error = ? WHERE id = ?",
+                (status, attempts, next_attempt_at, str(error), message_id),
+            )
+
+    def status(self, message_id):
+        with self._lock:
+            row = self._conn.execute("SELECT status FROM outbox WHERE id = ?", (message_id,)).fetchone()
+        return row[0] if row else None
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall()
+        return dict(rows)
+
+
+class OutboxWorker(threading.Thread):
+    """Background thread draining the outbox with at most `max_workers` concurrent sends."""
+
+    def __init__(self, outbox, max_workers=OUTBOX_MAX_WORKERS, poll_interval=OUTBOX_POLL_INTERVAL, limiter=None):
+        super().__init__(name="outbox-worker", daemon=True)
+        self.outbox = outbox
+        self.limiter = limiter or get_rate_limiter()
+        self.max_workers = max_workers
+        self.poll_interval = poll_interval
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="outbox-send")
+        self._slots = threading.BoundedSemaphore(max_workers)
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+
+    def wake(self):
+        self._wakeup.set()
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        self._wakeup.set()
+        self.join(timeout)
+        self._executor.shutdown(wait=True)
+
+    def run(self):
+        while not self._stopped.is_set():
+            self._wakeup.clear()
+            try:
+                self.outbox.flush_due_digests()
+                self._dispatch_due()
+            except Exception:
+                logger.exception("Outbox worker iteration failed")
+            self._wakeup.wait(self.poll_interval)
+
+    def _dispatch_due(self):
+        while not self._stopped.is_set():
+            # Only claim as many messages as there are free send slots
+            free = 0
+            while free < self.max_workers and self._slots.acquire(blocking=False):
+                free += 1
+            if not free:
+                return
+            # Over the global notification cap, messages stay pending and are picked
+            # up on a later poll once the bucket has refilled
+            allowed, acquired_at = self.limiter.acquire_up_to(_NOTIFY_KEY, free)
+            submitted = 0
+            try:
+                rows = self.outbox.claim(allowed) if allowed else []
+                for row in rows:
+                    self._executor.submit(self._deliver, *row)
+                    submitted += 1
+            finally:
+                # Slots and tokens not handed to a delivery go back, also when claiming
+                # fails (e.g. another process holds the outbox lock past the busy timeout)
+                if submitted < allowed:
+                    self.limiter.refund(_NOTIFY_KEY, allowed - submitted, acquired_at)
+                for _ in range(free - submitted):
+                    self._slots.release()
+            if not submitted:
+                return
+
+    def _deliver(self, message_id, subject, body, to_email, attempts, dossier):
+        try:
+            try:
+                # The dossier is best effort: if rendering fails the email is sent without it
+                attachment = dossier_attachment(json.loads(dossier)) if dossier else None
+                sent = send_email(subject, body, to_email, [attachment] if attachment else ())
+                error = None if sent else "send_email returned False"
+            except Exception as e:
+                error = e
+            if error is None:
+                self.outbox.mark_sent(message_id)
+            else:
+                self.outbox.mark_failed(message_id, attempts + 1, error)
+        finally:
+            self._slots.release()
+            # A slot just freed up; look for more due work without waiting for the poll
+            self._wakeup.set()
+
+
+_outbox = None
+_worker = None
+_singleton_lock = threading.Lock()
+
+
+def get_outbox():
+    # One outbox and one worker per process, shared by every Streamlit session
+    global _outbox, _worker
+    with _singleton_lock:
+        if _outbox is None:
+            _outbox = Outbox()
+            _worker = OutboxWorker(_outbox)
+            _worker.start()
+    return _outbox
+
+
+def enqueue_email(subject, body, to_email="", dossier=None, submission_id=None):
+    outbox = get_outbox()
+    message_id = outbox.enqueue(subject, body, to_email, dossier, submission_id)
+    if message_id is not None:
+        _worker.wake()
+    return message_id
+
+
+def enqueue_digest_item(section, to_email="", submission_id=None):
+    outbox = get_outbox()
+    queued, flushed = outbox.add_digest_item(section, to_email, submission_id=submission_id)
+    if flushed:
+        _worker.wake()
+    return queued
@@ -0,0 +1,218 @@
+import hmac
+import json
+import os
+import time
+from datetime import datetime, time as dt_time, timedelta
+
+import streamlit as st
+
+import settings  # noqa: F401  (loads .env)
+from form_schema import COUNTRIES, CTCL_SUBTYPES, PTCL_SUBTYPES, TCELL_DIAGNOSES, THERAPY_COUNTS, TRANSPLANTS
+from metrics import ADMIN_QUERY_SECONDS
+from serializers import serialize_submission
+from storage import get_store
+
+# Query results are cached for ADMIN_CACHE_TTL seconds and keyed on the store's last
+# submission id, so a new submission invalidates them on the next refresh
+ADMIN_CACHE_TTL = int(os.getenv("ADMIN_CACHE_TTL", 60))
+ADMIN_PAGE_SIZE = int(os.getenv("ADMIN_PAGE_SIZE", 50))
+
+ALL = "All"
+
+
+# ---- Cached queries ----
+
+@st.cache_data(ttl=ADMIN_CACHE_TTL, max_entries=256, show_spinner=False)
+def load_page(generation, filters, before_id, limit):
+    with ADMIN_QUERY_SECONDS.time(query="page"):
+        return get_store().list_page(limit, before_id, **dict(filters))
+
+
+@st.cache_data(ttl=ADMIN_CACHE_TTL, max_entries=256, show_spinner=False)
+def count_matching(generation, filters):
+    with ADMIN_QUERY_SECONDS.time(query="count"):
+        return get_store().count_matching(**dict(filters))
+
+
+@st.cache_data(ttl=ADMIN_CACHE_TTL, max_entries=16, show_spinner=False)
+def load_statistics(generation):
+    with ADMIN_QUERY_SECONDS.time(query="statistics"):
+        return get_store().aggregates()
+
+
+@st.cache_data(ttl=ADMIN_CACHE_TTL, max_entries=64, show_spinner=False)
+def load_submission(submission_id):
+    # Stored submissions never change, so the detail view needs no generation
+    with ADMIN_QUERY_SECONDS.time(query="detail"):
+        row = get_store().get(submission_id)
+    if row is None:
+        return None
+    return serialize_submission(json.loads(row["payload"]), row["id"], row["created_at"])
+
+
+# ---- Authentication ----
+
+def authenticated():
+    password = os.getenv("ADMIN_PASSWORD", "")
+    if not password:
+        st.warning("The admin dashboard is disabled. Set ADMIN_PASSWORD to enable it.")
+        return False
+    if st.session_state.get("admin_authenticated"):
+        return True
+    with st.form("admin_login"):
+        attempt = st.text_input("Password", type="password")
+        if st.form_submit_button("Log in"):
+            # Constant-time comparison, so response times don't leak the password
+            if hmac.compare_digest(attempt.encode("utf-8"), password.encode("utf-8")):
+                st.session_state.admin_authenticated = True
+                st.rerun()
+            st.error("Incorrect password.")
+    return False
+
+
+# ---- Filters and paging ----
+
+def _day_start(day):
+    return datetime.combine(day, dt_time.min).timestamp()
+
+
+def sidebar_filters():
+    # Returns a hashable tuple of (column, value) filters for the store
+    filters = []
+    with st.sidebar:
+        st.header("Filters")
+        if get_store().searchable:
+            text = st.text_input(
+                "Search free text", key="admin_text",
+                help='Therapies, regimens, subtypes, cytogenetics and other free-text answers. '
+                     'All words must match; use cho* for a prefix, "t(14;18)" for a phrase and '
+                     'therapy:, transplant:, subtype:, cytogenetics: or biomarker: to search one field.',
+            ).strip()
+            if text:
+                filters.append(("text", text))
+        country = st.selectbox("Country", (ALL,) + COUNTRIES.values[1:], key="admin_country")
+        if country != ALL:
+            filters.append(("phys_country", country))
+        diagnosis = st.selectbox("Diagnosis", (ALL,) + TCELL_DIAGNOSES.values, key="admin_diagnosis")
+        if diagnosis != ALL:
+            filters.append(("tcell_diagnosis", diagnosis))
+            subtypes = PTCL_SUBTYPES if diagnosis == "PTCL" else CTCL_SUBTYPES
+            subtype = st.selectbox("Subtype", (ALL,) + subtypes.values[1:], key=f"admin_subtype_{diagnosis}")
+            if subtype != ALL:
+                filters.append(("subtype", subtype))
+        therapies = st.selectbox("Prior therapies", (ALL,) + THERAPY_COUNTS.values[1:], key="admin_therapies")
+        if therapies != ALL:
+            filters.append(("num_therapies", therapies))
+        transplant = st.selectbox("Previous transplant", (ALL,) + TRANSPLANTS.values, key="admin_transplant")
+        if transplant != ALL:
+            filters.append(("prev_transplant", transplant))
+        # An incomplete range (only the first day picked so far) is ignored
+        days = st.date_input("Submitted between", value=(), key="admin_dates")
+        if len(days) == 2:
+            filters.append(("created_from", _day_start(days[0])))
+            filters.append(("created_to", _day_start(days[1] + timedelta(days=1))))
+    return tuple(filters)
+
+
+def _reset_paging(filters):
+    if st.session_state.get("admin_filters") != filters:
+        st.session_state.admin_filters = filters
+        # Stack of before_id cursors; None is the first page
+        st.session_state.admin_cursors = [None]
+
+
+def _next_page(last_id):
+    st.session_state.admin_cursors.append(last_id)
+
+
+def _previous_page():
+    st.session_state.admin_cursors.pop()
+
+
+def _format_row(row):
+    row = dict(row)
+    row["created_at"] = datetime.fromtimestamp(row["created_at"]).strftime("%Y-%m-%d %H:%M")
+    return row
+
+
+STATISTICS = (
+    ("country", "By country"),
+    ("subtype", "By diagnosis and subtype"),
+    ("num_therapies", "Prior systemic therapies"),
+    ("prev_transplant", "Previous transplant"),
+    ("therapy1_outcome", "1st line outcome"),
+    ("therapy2_outcome", "2nd line outcome"),
+    ("therapy3_outcome", "3rd line outcome"),
+)
+
+
+def show_statistics(generation):
+    # Precomputed counts over all submissions (see aggregates.py); filters don't apply
+    statistics = load_statistics(generation)
+    with st.expander(f"Program statistics ({statistics['total'].get('', 0)} submissions)"):
+        columns = st.columns(2)
+        for i, (dimension, title) in enumerate(STATISTICS):
+            with columns[i % 2]:
+                st.markdown(f"**{title}**")
+                counts = statistics.get(dimension) or {}
+                if counts:
+                    st.dataframe(
+                        [{"value": value, "count": count} for value, count in
+                         sorted(counts.items(), key=lambda item: -item[1])],
+                        hide_index=True,
+                    )
+                else:
+                    st.caption("No data yet.")
+
+
+# ---- Page ----
+
+st.title("MAP Submissions – Admin Dashboard")
+
+if authenticated():
+    filters = sidebar_filters()
+    _reset_paging(filters)
+    generation = get_store().last_id()
+    cursors = st.session_state.admin_cursors
+    show_statistics(generation)
+
+    started = time.perf_counter()
+    # One extra row tells whether there is a next page without a second query
+    rows = load_page(generation, filters, cursors[-1], ADMIN_PAGE_SIZE + 1)
+    has_next, rows = len(rows) > ADMIN_PAGE_SIZE, rows[:ADMIN_PAGE_SIZE]
+    total = count_matching(generation, filters)
+
+    first = (len(cursors) - 1) * ADMIN_PAGE_SIZE + 1
+    st.caption(
+        f"{total} matching submission(s)"
+        + (f" – showing {first}–{first + len(rows) - 1}" if rows else "")
+        + f" – {(time.perf_counter() - started) * 1000:.0f} ms"
+    )
+    if rows:
+        st.dataframe([_format_row(row) for row in rows], hide_index=True)
+    else:
+        st.info("No submissions match these filters.")
+
+    col1, col2 = st.columns([1, 1])
+    with col1:
+        if len(cursors) > 1:
+            st.button("Previous page", key="admin_prev", on_click=_previous_page)
+    with col2:
+        if has_next:
+            st.button("Next page", key="admin_next", on_click=_next_page, args=(rows[-1]["id"],))
+
+    if rows:
+        st.subheader("Submission details")
+        submission_id = st.selectbox(
+            "Submission", [row["id"] for row in rows], key="admin_detail",
+            format_func=lambda i: f"#{i}",
+        )
+        record = load_submission(submission_id)
+        if record is None:
+            st.error(f"Submission #{submission_id} no longer exists.")
+        else:
+            st.json(record)
+
+    if st.sidebar.button("Log out", key="admin_logout"):
+        st.session_state.pop("admin_authenticated", None)
+        st.rerun()
@@ -0,0 +1,208 @@
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import RATE_LIMITED
+from settings import get_settings
+from shared_state import get_shared_state
+
+logger = logging.getLogger(__name__)
+
+
+def _rate(name, default):
+    # "<burst>/<seconds>": up to <burst> events at once, refilled evenly over <seconds>
+    burst, seconds = os.getenv(name, default).split("/")
+    return int(burst), float(seconds)
+
+
+# Submissions are limited per browser session, per client address and per
+# physician email; outbound notifications have one process-wide cap
+RATE_LIMITS = {
+    "session": _rate("RATE_LIMIT_SESSION", "1/10"),
+    "client": _rate("RATE_LIMIT_CLIENT", "10/60"),
+    "email": _rate("RATE_LIMIT_EMAIL", "5/600"),
+    "notify": (int(os.getenv("NOTIFY_MAX_PER_MINUTE", 30)), 60.0),
+}
+# Least recently used buckets beyond this are dropped (a dropped bucket is simply full again)
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", 10000))
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens, updated):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class RateLimiter:
+    """Token buckets keyed by (scope, value), shared by every session in the process.
+
+    Buckets are refilled lazily when touched, so every check is O(1) and idle
+    keys cost nothing until they are evicted.
+    """
+
+    def __init__(self, rates=RATE_LIMITS, max_keys=RATE_LIMIT_MAX_KEYS):
+        # scope -> (capacity, tokens per second)
+        self.rates = {scope: (burst, burst / seconds) for scope, (burst, seconds) in rates.items()}
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _bucket(self, key, now):
+        capacity, rate = self.rates[key[0]]
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(capacity, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            bucket.tokens = min(capacity, bucket.tokens + (now - bucket.updated) * rate)
+            bucket.updated = now
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def acquire(self, keys, cost=1):
+        # Take `cost` tokens from every key, or from none of them. Returns (0.0, None)
+        # on success, otherwise the seconds until all keys would have enough tokens
+        # and the scope of the key that has to wait longest.
+        now = time.monotonic()
+        with self._lock:
+            buckets = [(key, self._bucket(key, now)) for key in keys]
+            wait, refused = 0.0, None
+            for key, bucket in buckets:
+                if bucket.tokens < cost:
+                    key_wait = (cost - bucket.tokens) / self.rates[key[0]][1]
+                    if key_wait > wait:
+                        wait, refused = key_wait, key[0]
+            if wait:
+                return wait, refused
+            for _, bucket in buckets:
+                bucket.tokens -= cost
+        return 0.0, None
+
+    def acquire_up_to(self, key, count):
+        # Take as many whole tokens as are available, up to `count`. Returns them with
+        # the time they were taken, which `refund` needs.
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._bucket(key, now)
+            granted = min(count, int(bucket.tokens))
+            bucket.tokens -= granted
+        return granted, now
+
+    def refund(self, key, count, acquired_at):
+        # A bucket has no windows, so tokens can go back whenever they were taken
+        with self._lock:
+            bucket = self._bucket(key, time.monotonic())
+            bucket.tokens = min(self.rates[key[0]][0], bucket.tokens + count)
+
+
+class SharedRateLimiter:
+    """RateLimiter counterpart whose limits hold across server processes.
+
+    Token buckets would need a read-modify-write on the shared store, so each
+    key is instead a counter per fixed window of the scope's period, updated
+    with one atomic increment: at most `burst` events per window and key.
+    Several keys are charged one after the other and refunded if any of them
+    is over its limit; a concurrent check may briefly see the extra charge,
+    which can only make it stricter.
+    """
+
+    def __init__(self, state, rates=RATE_LIMITS):
+        self.state = state
+        self.rates = dict(rates)
+
+    def _window(self, key, now):
+        # (counter key, seconds until the window ends)
+        scope, value = key
+        _, seconds = self.rates[scope]
+        window = int(now // seconds)
+        return f"rate:{scope}:{value}:{window}", (window + 1) * seconds - now
+
+    def _incr(self, key, amount, now):
+        counter, remaining = self._window(key, now)
+        return self.state.incr(counter, amount, ttl=remaining + 1), remaining
+
+    def acquire(self, keys, cost=1):
+        now = time.time()
+        charged = []
+        wait, refused = 0.0, None
+        for key in keys:
+            count, remaining = self._incr(key, cost, now)
+            charged.append(key)
+            if count > self.rates[key[0]][0]:
+                wait, refused = remaining, key[0]
+                break
+        if wait:
+            for key in charged:
+                self._incr(key, -cost, now)
+        return wait, refused
+
+    def acquire_up_to(self, key, count):
+        now = time.time()
+        total, _ = self._incr(key, count, now)
+        granted = max(0, min(count, self.rates[key[0]][0] - (total - count)))
+        if granted < count:
+            self._incr(key, granted - count, now)
+        return granted, now
+
+    def refund(self, key, count, acquired_at):
+        # Back to the window the tokens were taken from, not the current one (which
+        # would go below zero and grant extra events); once it is over, nothing to return
+        counter, remaining = self._window(key, acquired_at)
+        left = remaining - (time.time() - acquired_at)
+        if left > 0:
+            self.state.incr(counter, -count, ttl=left + 1)
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            state = get_shared_state()
+            _limiter = RateLimiter() if state is None else SharedRateLimiter(state)
+    return _limiter
+
+
+# ---- Session glue ----
+
+def _client_address():
+    import streamlit as st
+
+    if get_settings().trust_forwarded_for:
+        # Behind the proxy every peer is the proxy itself. Clients can send their own
+        # X-Forwarded-For, and the proxy appends the address it saw, so only the last
+        # entry is trusted; without one there is no client bucket rather than a shared one.
+        forwarded = st.context.headers.get("X-Forwarded-For", "")
+        return forwarded.split(",")[-1].strip() or None
+    # The peer address; None on Streamlit versions without st.context.ip_address
+    return getattr(st.context, "ip_address", None)
+
+
+def check_submission_rate(form_data):
+    # Returns 0.0 if this submission may proceed, otherwise the seconds to wait.
+    # The session, client and email buckets are charged together or not at all.
+    import streamlit as st
+
+    if "rate_limit_key" not in st.session_state:
+        st.session_state.rate_limit_key = secrets.token_hex(8)
+    keys = [("session", st.session_state.rate_limit_key)]
+    client = _client_address()
+    if client:
+        keys.append(("client", client))
+    email = (form_data.get("phys_email") or "").strip().lower()
+    if email:
+        keys.append(("email", email))
+    wait, refused = get_rate_limiter().acquire(keys)
+    if wait:
+        RATE_LIMITED.inc(scope=refused)
+        logger.info("Submission throttled by the %s limit for %.1fs", refused, wait)
+    return wait
@@ -0,0 +1,138 @@
+"""Full-text index over the free-text answers of stored submissions.
+
+An SQLite FTS5 table in the submissions database, one row per submission
+(rowid = submission id). The submission writer adds rows in the same
+transaction as the insert (see storage.py), so the index never lags the
+store. Queries are a list of terms, all of which must match:
+
+    chop                 a word, anywhere (also matches "R-CHOP")
+    cho*                 a word prefix
+    "t(14;18)"           a phrase: these words, in this order
+    therapy:gdp          only in one group of fields (see FIELD_GROUPS)
+
+From the command line:
+
+    python search.py 'therapy:chop "bone marrow"'    # print matching submissions
+    python search.py --rebuild                        # reindex every submission
+"""
+import argparse
+import re
+import sys
+
+# The free-text answers, one FTS5 column each
+FIELDS = (
+    "therapy1_type", "therapy2_type", "therapy3_type",
+    "auto_regimen", "allo_regimen", "allo_bridging",
+    "ptcl_extra_other", "ctcl_other",
+    "cytogenetic_text", "biom_other_text",
+    "diag_test_other_text", "specimen_other_text", "spec_avail_other_text",
+)
+# Prefix for restricting a term to some fields; every column name works as well
+FIELD_GROUPS = {
+    "therapy": ("therapy1_type", "therapy2_type", "therapy3_type"),
+    "transplant": ("auto_regimen", "allo_regimen", "allo_bridging"),
+    "subtype": ("ptcl_extra_other", "ctcl_other"),
+    "cytogenetics": ("cytogenetic_text",),
+    "biomarker": ("biom_other_text",),
+    "test": ("diag_test_other_text",),
+    "specimen": ("specimen_other_text", "spec_avail_other_text"),
+    **{name: (name,) for name in FIELDS},
+}
+
+# unicode61 splits on punctuation, so "R-CHOP" is indexed as "r chop"; accents are
+# folded and the 2- and 3-character prefix indexes keep short prefix queries fast
+SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS submission_text USING fts5(
+    {},
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+""".format(",\n    ".join(FIELDS))
+_INSERT = "INSERT INTO submission_text (rowid, {}) VALUES (?, {})".format(
+    ", ".join(FIELDS), ", ".join("?" for _ in FIELDS)
+)
+
+# [group:]("phrase"|word), either optionally followed by * for a prefix
+_TERM = re.compile(r'(?:(\w+):)?(?:"([^"]*)"?|([^\s"]+))')
+_WORD = re.compile(r"\w")
+
+
+def document(form_data):
+    # One submission's row; submissions without free text get an empty one, so
+    # the highest indexed rowid tells how far the index has got
+    return tuple(str(form_data.get(name) or "") for name in FIELDS)
+
+
+def apply(conn, documents):
+    # Must run inside the caller's write transaction. documents: (submission id, document) pairs
+    conn.executemany(_INSERT, [(submission_id, *doc) for submission_id, doc in documents])
+
+
+def last_indexed(conn):
+    row = conn.execute("SELECT rowid FROM submission_text ORDER BY rowid DESC LIMIT 1").fetchone()
+    return row[0] if row else 0
+
+
+def replace(conn, documents):
+    # Must run inside the caller's write transaction
+    conn.execute("DELETE FROM submission_text")
+    apply(conn, documents)
+    conn.execute("INSERT INTO submission_text (submission_text) VALUES ('optimize')")
+
+
+def _quote(text):
+    return '"' + text.replace('"', '""') + '"'
+
+
+def compile_query(query):
+    """Translate a search box query into an FTS5 MATCH expression.
+
+    Every term is quoted, so FTS5 operators and punctuation in the input are
+    searched for rather than interpreted. Returns None when nothing in the
+    query can match, e.g. only punctuation.
+    """
+    terms = []
+    for match in _TERM.finditer(query):
+        group, phrase, word = match.groups()
+        text = phrase if phrase is not None else word
+        prefix = False
+        if phrase is None and word.endswith("*"):
+            text, prefix = word.rstrip("*"), True
+        elif phrase is not None and query[match.end():match.end() + 1] == "*":
+            prefix = True
+        if group is not None and group.lower() not in FIELD_GROUPS:
+            # Not a field group, e.g. "ratio:2"; search for it as written
+            text, group = f"{group}:{text}", None
+        if not _WORD.search(text):
+            continue
+        term = _quote(text) + (" *" if prefix else "")
+        if group is not None:
+            term = "{%s} : %s" % (" ".join(FIELD_GROUPS[group.lower()]), term)
+        terms.append(term)
+    return " AND ".join(terms) or None
+
+
+def main():
+    from storage import get_store
+
+    parser = argparse.ArgumentParser(description="Search or rebuild the free-text index.")
+    parser.add_argument("query", nargs="?", help="search terms, quoted for the shell")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--rebuild", action="store_true", help="reindex every submission")
+    args = parser.parse_args()
+    store = get_store()
+
+    if args.rebuild:
+        print(f"{store.rebuild_search()} submission(s) reindexed")
+        return 0
+    if not args.query:
+        parser.error("give a query or --rebuild")
+    rows = store.list_page(args.limit, text=args.query)
+    for row in rows:
+        print(f"#{row['id']}  {row['tcell_diagnosis'] or ''} {row['subtype'] or ''}  {row['excerpt']}")
+    print(f"{store.count_matching(text=args.query)} matching submission(s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,60 +1,87 @@
-import os
-import smtplib
-import ssl
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from dotenv import load_dotenv
-
-load_dotenv()  # Load environment variables from a .env file if available
-
-import json
-
-def send_email(subject, body, to_email=''):
-    # Retrieve SMTP configuration from environment variables
-    smtp_server = os.getenv("SMTP_SERVER", "smtp.office365.com")
-    smtp_port = int(os.getenv("SMTP_PORT", 587))
-    smtp_username = os.getenv("SMTP_USERNAME")
-    smtp_password = os.getenv("SMTP_PASSWORD")
-    smtp_receiver = os.getenv("SMTP_RECEIVER")
-
-    # Debug output to check values and their types
-    print("SMTP_SERVER:", smtp_server, type(smtp_server))
-    print("SMTP_PORT:", smtp_port, type(smtp_port))
-    print("SMTP_USERNAME:", smtp_username, type(smtp_username))
-    print("SMTP_RECEIVER:", smtp_receiver, type(smtp_receiver))
-    
-    # Validate that required values are provided
-    if not smtp_server:
-        raise ValueError("SMTP_SERVER environment variable is not set.")
-    if not smtp_username:
-        raise ValueError("SMTP_USERNAME environment variable is not set.")
-    if not smtp_password:
-        raise ValueError("SMTP_PASSWORD environment variable is not set.")
-    if not smtp_receiver:
-        raise ValueError("SMTP_RECEIVER environment variable is not provided.")
-    
-    # Create the email message
+import logging
+import threading
+import time
+
+from metrics import SEND_EMAIL_SECONDS
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+# smtplib, ssl and the email.mime modules are imported on the first send rather
+# than at startup, so instances that never send (or not yet) don't pay for them
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_smtp_pool(settings=None):
+    # Sessions are shared per server/account so concurrent senders reuse logged-in connections
+    from smtp_pool import SMTPConnectionPool
+
+    settings = settings or get_settings()
+    key = (settings.smtp_server, settings.smtp_port, settings.smtp_username, settings.smtp_password)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = SMTPConnectionPool(
+                *key,
+                max_size=settings.smtp_pool_size,
+                max_idle=settings.smtp_pool_max_idle,
+                starttls=settings.smtp_starttls,
+                timeout=settings.smtp_timeout,
+                connect_timeout=settings.smtp_connect_timeout,
+            )
+            _pools[key] = pool
+    return pool
+
+
+def _attachment_part(filename, content, mime_type):
+    from email.mime.application import MIMEApplication
+    from email.mime.text import MIMEText
+
+    maintype, subtype = mime_type.split("/", 1)
+    if maintype == "text":
+        part = MIMEText(content, subtype, "utf-8")
+    else:
+        part = MIMEApplication(content, subtype)
+    part.add_header("Content-Disposition", "attachment", filename=filename)
+    return part
+
+
+def build_message(subject, body, settings, attachments=()):
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+
     msg = MIMEMultipart()
-    msg["From"] = smtp_username  # Sender address
-    msg["To"] = smtp_receiver    # Recipient address from environment
+    msg["From"] = settings.smtp_username  # Sender address
+    msg["To"] = settings.smtp_receiver    # Recipient address from environment
     msg["Subject"] = str(subject)
     msg.attach(MIMEText(body, "plain"))
+    for attachment in attachments:
+        msg.attach(_attachment_part(*attachment))
+    return msg
+
+
+def send_email(subject, body, to_email='', attachments=()):
+    # attachments: (filename, content, mime type) tuples
+    from smtp_pool import DeliveryTrace
+
+    settings = get_settings()
+    # Raises ValueError naming the first required SMTP variable that is missing
+    settings.check_smtp()
+    msg = build_message(subject, body, settings, attachments)
 
+    start = time.perf_counter()
+    # Per-phase timings of this delivery, so a failure (or a slow send) shows where the time went
+    trace = DeliveryTrace()
     try:
-        # Instantiate the SMTP object with the server and port
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        server.ehlo()
-        
-        # Create a default SSL context and start TLS
-        context = ssl.create_default_context()
-        server.starttls(context=context)
-        server.ehlo()
-        
-        # Log in and send the email
-        server.login(smtp_username, smtp_password)
-        server.sendmail(smtp_username, smtp_receiver, msg.as_string())
-        server.quit()
+        # Reuse a pooled, already authenticated TLS session where possible
+        pool = get_smtp_pool(settings)
+        pool.sendmail(settings.smtp_username, settings.smtp_receiver, msg.as_string(), trace=trace)
+        SEND_EMAIL_SECONDS.observe(time.perf_counter() - start, outcome="sent")
+        logger.debug("Sent email: %s", trace)
         return True
     except Exception as e:
-        print(f"Failed to send email: {e}")
-        return False
\ No newline at end of file
+        SEND_EMAIL_SECONDS.observe(time.perf_counter() - start, outcome="failed")
+        logger.warning("Failed to send email (%s): %s", trace, e)
+        return False
@@ -0,0 +1,105 @@
+import json
+from datetime import date, datetime
+
+from form_schema import FIELDS
+
+# Version of the serialized submission layout. Bump it whenever a field is renamed,
+# removed or changes type, so consumers of exports and emails can tell them apart.
+SCHEMA_VERSION = 1
+
+# Flat column order shared by CSV and columnar exports
+METADATA_COLUMNS = ("schema_version", "id", "submitted_at")
+COLUMNS = METADATA_COLUMNS + tuple(FIELDS)
+
+# Multiselect answers are joined with this in flat (CSV) output
+LIST_SEPARATOR = "; "
+
+
+def field_type(field):
+    # One of: str, int, bool, date, list
+    if field.widget == "checkbox":
+        return "bool"
+    if field.widget == "date":
+        return "date"
+    if field.widget == "multiselect":
+        return "list"
+    if field.widget == "number":
+        return "int"
+    if field.options is not None and isinstance(field.options.values[0], int):
+        return "int"
+    return "str"
+
+
+FIELD_TYPES = {name: field_type(field) for name, field in FIELDS.items()}
+
+
+def json_default(value):
+    # json.dumps(default=...) for raw answers, e.g. stored payloads and idempotency keys
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _json_value(value):
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, tuple):
+        return list(value)
+    return value
+
+
+def _timestamp(value):
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        value = datetime.fromtimestamp(value)
+    return value.isoformat(timespec="seconds")
+
+
+def serialize_submission(form_data, submission_id=None, submitted_at=None):
+    """Versioned, JSON-safe record of one submission.
+
+    Answers are listed in form order; answers to fields that are no longer in the
+    schema are kept after them rather than dropped.
+    """
+    data = {name: _json_value(form_data[name]) for name in FIELDS if form_data.get(name) is not None}
+    for name in sorted(set(form_data) - set(FIELDS)):
+        data[name] = _json_value(form_data[name])
+    return {
+        "schema_version": SCHEMA_VERSION,
+        "id": submission_id,
+        "submitted_at": _timestamp(submitted_at),
+        "data": data,
+    }
+
+
+def dumps(record, indent=None):
+    separators = None if indent else (",", ":")
+    return json.dumps(record, ensure_ascii=False, indent=indent, separators=separators)
+
+
+def loads(text):
+    # Parse a serialized submission back into a record whose dates are date objects
+    record = json.loads(text)
+    version = record.get("schema_version")
+    if version != SCHEMA_VERSION:
+        raise ValueError(f"Unsupported submission schema version: {version!r}")
+    data = record.get("data") or {}
+    for name, value in data.items():
+        if FIELD_TYPES.get(name) == "date" and isinstance(value, str):
+            data[name] = date.fromisoformat(value[:10])
+    return record
+
+
+def flatten(record):
+    # One scalar per COLUMNS entry, for CSV output
+    data = record["data"]
+    row = [record["schema_version"], record["id"], record["submitted_at"]]
+    for name in FIELDS:
+        value = data.get(name)
+        if isinstance(value, list):
+            value = LIST_SEPARATOR.join(str(v) for v in value)
+        row.append(value)
+    return row
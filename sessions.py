@@ -0,0 +1,347 @@
+"""Lifecycle of form sessions: idle answers are spilled to disk and restored on return.
+
+Streamlit keeps a session's state in memory until its websocket closes, and
+physicians often leave the form half filled in. Every form session registers
+a small handle; a background thread moves the answers of sessions idle for
+SESSION_IDLE_SECONDS into a compressed row on disk, and spills earlier (least
+recently active first) whenever the answers held in memory exceed
+SESSION_MEMORY_BUDGET. The next run of the session, full or fragment, puts
+them back before anything reads them.
+
+Answers are spilled in place: the session keeps its (emptied) FormRecord, so
+section fragments holding a reference to it see the answers again once they
+are restored. Sessions live and die with their server process; so do spills.
+
+The *_widget copies of the answers on the page on screen are counted against
+the budget but are not spilled: they belong to Streamlit's session state,
+which the sweeper thread cannot change, and re-seeding them on return would
+overwrite the edit that brought the session back. A spilled session still
+holds that one page of widget values.
+"""
+import json
+import logging
+import os
+import secrets
+import sqlite3
+import sys
+import threading
+import time
+import weakref
+import zlib
+
+from metrics import SESSIONS_REHYDRATED, SESSIONS_SPILLED
+from settings import DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+SESSION_SPILL_PATH = os.getenv("SESSION_SPILL_PATH", os.path.join(DATA_DIR, "sessions.sqlite3"))
+SESSION_IDLE_SECONDS = float(os.getenv("SESSION_IDLE_SECONDS", 900))
+SESSION_MEMORY_BUDGET = int(os.getenv("SESSION_MEMORY_BUDGET", 64 * 1024 * 1024))
+# The budget never spills a session sooner than this after its last run (far longer than
+# any run takes), so answers are never taken away while a run is using them
+SESSION_MIN_IDLE_SECONDS = float(os.getenv("SESSION_MIN_IDLE_SECONDS", 30))
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", 15))
+# Spills left behind by a process that died are deleted after this long
+SESSION_SPILL_TTL = float(os.getenv("SESSION_SPILL_TTL", 7 * 24 * 3600))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS spilled_sessions (
+    spill_id TEXT PRIMARY KEY,
+    spilled_at REAL NOT NULL,
+    data BLOB NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+def _deep_size(value, seen=None):
+    # Estimated bytes held by a value, following containers and __slots__. None, booleans
+    # and small ints (option indexes, most bitmasks) are shared by the interpreter.
+    seen = set() if seen is None else seen
+    if value is None or isinstance(value, bool) or (type(value) is int and -5 <= value <= 256) or id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_deep_size(k, seen) + _deep_size(v, seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(_deep_size(v, seen) for v in value)
+    else:
+        for name in getattr(type(value), "__slots__", ()):
+            size += _deep_size(getattr(value, name, None), seen)
+    return size
+
+
+class SpillStore:
+    """Answers of idle sessions on disk, one zlib-compressed JSON row per session."""
+
+    def __init__(self, path=SESSION_SPILL_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # A spill is useless once its process is gone, so it is not worth an fsync
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    def put(self, spill_id, spilled):
+        # Returns the number of bytes written
+        data = zlib.compress(json.dumps(spilled, separators=(",", ":")).encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO spilled_sessions (spill_id, spilled_at, data) VALUES (?, ?, ?)",
+                (spill_id, time.time(), data),
+            )
+        return len(data)
+
+    def take(self, spill_id):
+        # Reads and deletes a spill; None if there is none
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM spilled_sessions WHERE spill_id = ?", (spill_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("DELETE FROM spilled_sessions WHERE spill_id = ?", (spill_id,))
+        return json.loads(zlib.decompress(row[0]))
+
+    def delete(self, spill_ids):
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM spilled_sessions WHERE spill_id = ?", [(spill_id,) for spill_id in spill_ids]
+            )
+
+    def purge(self, older_than):
+        with self._lock:
+            self._conn.execute("DELETE FROM spilled_sessions WHERE spilled_at < ?", (older_than,))
+
+    def stats(self):
+        # (number of spills, their total compressed bytes)
+        with self._lock:
+            count, size = self._conn.execute("SELECT COUNT(*), SUM(LENGTH(data)) FROM spilled_sessions").fetchone()
+        return count, size or 0
+
+
+class SessionHandle:
+    """One form session's entry, kept in its st.session_state.
+
+    The manager only holds a weak reference, so the handle (and the spill it
+    may own) goes away with the session.
+    """
+
+    __slots__ = (
+        "spill_id", "record", "validator", "last_active", "size", "widget_size", "spilled", "lock", "__weakref__",
+    )
+
+    def __init__(self, spill_id):
+        self.spill_id = spill_id
+        self.record = None
+        self.validator = None
+        self.last_active = time.monotonic()
+        # Last measured bytes of record, validator and widget copies, and of the widget copies alone
+        self.size = 0
+        self.widget_size = 0
+        self.spilled = False
+        self.lock = threading.Lock()
+
+
+class SessionManager:
+    """Tracks the form sessions of this process and spills idle ones to disk.
+
+    Lock order: a handle's lock, then the manager's.
+    """
+
+    def __init__(self, store=None, idle=SESSION_IDLE_SECONDS, budget=SESSION_MEMORY_BUDGET,
+                 min_idle=SESSION_MIN_IDLE_SECONDS, interval=SESSION_SWEEP_INTERVAL,
+                 spill_ttl=SESSION_SPILL_TTL, start=True):
+        self.store = store if store is not None else SpillStore()
+        self.idle = idle
+        self.budget = budget
+        self.min_idle = min_idle
+        self.interval = interval
+        self.spill_ttl = spill_ttl
+        self._lock = threading.Lock()
+        self._handles = {}
+        # Estimated bytes in memory per session and their total
+        self._sizes = {}
+        self.resident_bytes = 0
+        # Spill ids of sessions that ended; appended from weakref callbacks
+        self._ended = []
+        self._wake = threading.Event()
+        if start:
+            threading.Thread(target=self._sweep_loop, name="session-sweeper", daemon=True).start()
+
+    def register(self):
+        handle = SessionHandle(secrets.token_hex(8))
+        ref = weakref.ref(handle, lambda _, spill_id=handle.spill_id: self._ended.append(spill_id))
+        with self._lock:
+            self._handles[handle.spill_id] = ref
+            self._sizes[handle.spill_id] = 0
+        return handle
+
+    def _set_resident(self, spill_id, size):
+        with self._lock:
+            if spill_id in self._sizes:
+                self.resident_bytes += size - self._sizes[spill_id]
+                self._sizes[spill_id] = size
+            over = self.resident_bytes > self.budget
+        if over:
+            self._wake.set()
+
+    def sessions(self):
+        with self._lock:
+            return len(self._handles)
+
+    # ---- Called from the session's runs ----
+
+    def touch(self, handle, record, validator=None):
+        # Marks the session active; returns True if its answers were just restored
+        with handle.lock:
+            handle.last_active = time.monotonic()
+            restored = handle.spilled and self._rehydrate(handle)
+            handle.record = record
+            if validator is not None:
+                handle.validator = validator
+        if restored:
+            self._set_resident(handle.spill_id, handle.size)
+        return restored
+
+    def _rehydrate(self, handle):
+        handle.spilled = False
+        try:
+            spilled = self.store.take(handle.spill_id)
+        except Exception:
+            logger.exception("Failed to read the spilled answers of session %s", handle.spill_id)
+            spilled = None
+        if spilled is None:
+            # The form starts over; an autosaved draft can still be resumed from its link
+            logger.warning("The spilled answers of session %s are gone", handle.spill_id)
+            SESSIONS_REHYDRATED.inc(outcome="missing")
+            return False
+        handle.record.unspill(spilled)
+        SESSIONS_REHYDRATED.inc(outcome="restored")
+        return True
+
+    def measure(self, handle, record, validator=None, widgets=None):
+        # Counts the session's answers, validation results and widget values against the budget.
+        # One pass, so answers the validator or a widget also refers to are counted once
+        seen = set()
+        size = _deep_size(record, seen) + _deep_size(validator, seen) + _deep_size(widgets, seen)
+        # What a spill leaves behind of them
+        widget_size = _deep_size(widgets)
+        with handle.lock:
+            handle.record = record
+            if validator is not None:
+                handle.validator = validator
+            handle.size = size
+            handle.widget_size = widget_size
+            spilled = handle.spilled
+        if not spilled:
+            self._set_resident(handle.spill_id, size)
+
+    # ---- Sweeping ----
+
+    def _sweep_loop(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Session sweep failed")
+
+    def sweep(self):
+        # Spills sessions idle for `idle` seconds, then the least recently active
+        # ones until the budget is met. Returns the number spilled.
+        with self._lock:
+            ended, self._ended = self._ended, []
+            for spill_id in ended:
+                self._handles.pop(spill_id, None)
+                self.resident_bytes -= self._sizes.pop(spill_id, 0)
+            handles = [handle for handle in (ref() for ref in self._handles.values()) if handle is not None]
+        if ended:
+            self.store.delete(ended)
+        now = time.monotonic()
+        spilled = 0
+        # Least recently active first
+        for handle in sorted(handles, key=lambda handle: handle.last_active):
+            idle = now - handle.last_active
+            if idle >= self.idle:
+                reason = "idle"
+            elif idle >= self.min_idle and self.resident_bytes > self.budget:
+                reason = "budget"
+            else:
+                # Every later session is more recently active
+                break
+            if self._spill(handle, reason):
+                spilled += 1
+        if self.resident_bytes > self.budget:
+            logger.warning(
+                "Form sessions hold %s bytes, over the %s byte budget, but none has been idle for %ss",
+                self.resident_bytes, self.budget, self.min_idle,
+            )
+        self.store.purge(time.time() - self.spill_ttl)
+        return spilled
+
+    def _spill(self, handle, reason):
+        with handle.lock:
+            # Re-checked under the lock: the session may have just come back
+            if handle.spilled or handle.record is None or time.monotonic() - handle.last_active < self.min_idle:
+                return False
+            spilled = handle.record.spill()
+            try:
+                self.store.put(handle.spill_id, spilled)
+            except Exception:
+                handle.record.unspill(spilled)
+                logger.exception("Failed to spill session %s", handle.spill_id)
+                return False
+            if handle.validator is not None:
+                handle.validator.reset()
+            handle.spilled = True
+            # What stays: the emptied record and validator, and the widget values
+            residual = _deep_size((handle.record, handle.validator)) - sys.getsizeof(()) + handle.widget_size
+        self._set_resident(handle.spill_id, residual)
+        SESSIONS_SPILLED.inc(reason=reason)
+        return True
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_session_manager():
+    # One manager (and sweeper thread) per process, shared by every Streamlit session
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = SessionManager()
+    return _manager
+
+
+# ---- Session glue ----
+
+def _handle():
+    import streamlit as st
+
+    handle = st.session_state.get("session_handle")
+    if handle is None:
+        handle = st.session_state.session_handle = get_session_manager().register()
+    return handle
+
+
+def track_session():
+    # At the start of every full and fragment run, before form_data is read: marks
+    # the session active and restores its answers if they were spilled meanwhile
+    import streamlit as st
+
+    return get_session_manager().touch(_handle(), st.session_state.form_data, st.session_state.get("validator"))
+
+
+def measure_session():
+    # At the end of a full run: counts the session's answers against the memory budget
+    import streamlit as st
+
+    state = st.session_state
+    widgets = [state[key] for key in state.keys() if key.endswith("_widget")]
+    get_session_manager().measure(_handle(), state.form_data, state.get("validator"), widgets)
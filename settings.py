@@ -0,0 +1,74 @@
+import os
+import threading
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from dotenv import load_dotenv
+
+# Loaded once per process, on first import. Entry points (app.py, the admin page
+# and the command line tools) import this module before anything that reads its
+# configuration from the environment at import time.
+load_dotenv()
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+
+_REQUIRED_SMTP = ("SMTP_SERVER", "SMTP_USERNAME", "SMTP_PASSWORD", "SMTP_RECEIVER")
+
+
+def _flag(name, default):
+    return os.getenv(name, default).lower() not in ("0", "false", "no")
+
+
+@dataclass(frozen=True)
+class Settings:
+    smtp_server: str
+    smtp_port: int
+    smtp_username: Optional[str]
+    smtp_password: Optional[str]
+    smtp_receiver: Optional[str]
+    # Local stand-in servers used for testing usually do not offer STARTTLS
+    smtp_starttls: bool
+    smtp_pool_size: int
+    smtp_pool_max_idle: float
+    # Socket timeouts: for opening the connection (up to the server's greeting), then per command
+    smtp_connect_timeout: float
+    smtp_timeout: float
+    # Names of required SMTP variables that are not set
+    smtp_missing: Tuple[str, ...]
+    # Only behind a reverse proxy that sets X-Forwarded-For: rate limits then key clients
+    # by the address it reports instead of the peer address (which is the proxy's)
+    trust_forwarded_for: bool
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            smtp_server=os.getenv("SMTP_SERVER", "smtp.office365.com"),
+            smtp_port=int(os.getenv("SMTP_PORT", 587)),
+            smtp_username=os.getenv("SMTP_USERNAME"),
+            smtp_password=os.getenv("SMTP_PASSWORD"),
+            smtp_receiver=os.getenv("SMTP_RECEIVER"),
+            smtp_starttls=_flag("SMTP_STARTTLS", "true"),
+            smtp_pool_size=int(os.getenv("SMTP_POOL_SIZE", 4)),
+            smtp_pool_max_idle=float(os.getenv("SMTP_POOL_MAX_IDLE", 120)),
+            smtp_connect_timeout=float(os.getenv("SMTP_CONNECT_TIMEOUT", 10)),
+            smtp_timeout=float(os.getenv("SMTP_TIMEOUT", 30)),
+            smtp_missing=tuple(name for name in _REQUIRED_SMTP if not os.getenv(name)),
+            trust_forwarded_for=_flag("TRUST_X_FORWARDED_FOR", "false"),
+        )
+
+    def check_smtp(self):
+        if self.smtp_missing:
+            raise ValueError(f"{self.smtp_missing[0]} environment variable is not set.")
+
+
+_settings = None
+_settings_lock = threading.Lock()
+
+
+def get_settings():
+    # Read and validated once per process; the result is immutable
+    global _settings
+    with _settings_lock:
+        if _settings is None:
+            _settings = Settings.from_env()
+    return _settings
@@ -0,0 +1,403 @@
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import unquote, urlparse
+
+from settings import DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+# State that must be shared by every server process behind the load balancer
+# (rate limits, idempotency claims, drafts). Unset: each process keeps its own,
+# which is only correct for a single process.
+#   sqlite:///data/shared_state.sqlite3   processes on one host sharing a file
+#   redis://[:password@]host:6379/0       any server speaking the Redis protocol
+SHARED_STATE_URL = os.getenv("SHARED_STATE_URL", "")
+SHARED_STATE_POOL_SIZE = int(os.getenv("SHARED_STATE_POOL_SIZE", 8))
+SHARED_STATE_TIMEOUT = float(os.getenv("SHARED_STATE_TIMEOUT", 5))
+
+
+class _ConnectionPool:
+    """At most `max_size` connections, reused most recently returned first.
+
+    A connection is only returned to the pool when the caller finished normally
+    or raised one of `reusable`; after any other error it may be mid-reply, so
+    it is closed and the next caller gets a fresh one.
+    """
+
+    def __init__(self, connect, close, max_size, reusable=()):
+        self._connect = connect
+        self._close = close
+        self._reusable = reusable
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._closed = False
+
+    def _checkin(self, conn):
+        with self._lock:
+            if not self._closed:
+                self._idle.append(conn)
+                return
+        self._discard(conn)
+
+    @contextmanager
+    def connection(self):
+        if self._closed:
+            raise RuntimeError("Shared state connection pool is closed")
+        self._slots.acquire()
+        try:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = self._connect()
+            try:
+                yield conn
+            except BaseException as e:
+                if isinstance(e, self._reusable):
+                    self._checkin(conn)
+                else:
+                    self._discard(conn)
+                raise
+            self._checkin(conn)
+        finally:
+            self._slots.release()
+
+    def _discard(self, conn):
+        try:
+            self._close(conn)
+        except Exception:
+            pass
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._discard(conn)
+
+
+# ---- SQLite ----
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    key TEXT PRIMARY KEY,
+    value,
+    expires_at REAL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS hashes (
+    key TEXT NOT NULL,
+    field TEXT NOT NULL,
+    value,
+    expires_at REAL,
+    PRIMARY KEY (key, field)
+) WITHOUT ROWID;
+"""
+
+# A row is live while expires_at is NULL or in the future
+_LIVE = "(expires_at IS NULL OR expires_at > ?)"
+
+
+def _expiry(ttl, now):
+    return now + ttl if ttl else None
+
+
+class SQLiteState:
+    """Shared state in one SQLite file, for several processes on the same host.
+
+    Every operation is a single statement or an IMMEDIATE transaction, so it is
+    atomic across processes. Expired rows are ignored when read and deleted
+    every `purge_interval` seconds.
+    """
+
+    def __init__(self, path, max_connections=SHARED_STATE_POOL_SIZE, timeout=SHARED_STATE_TIMEOUT,
+                 purge_interval=300):
+        self.path = path
+        self.timeout = timeout
+        self.purge_interval = purge_interval
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Statements are rolled back on error, so the connection stays usable
+        self._pool = _ConnectionPool(self._connect, lambda conn: conn.close(), max_connections, sqlite3.Error)
+        self._purged_at = 0.0
+        with self._pool.connection() as conn:
+            conn.executescript(_SQLITE_SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        with self._pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        if time.time() - self._purged_at > self.purge_interval:
+            self.purge()
+
+    def purge(self):
+        now = self._purged_at = time.time()
+        with self._pool.connection() as conn:
+            conn.execute("DELETE FROM kv WHERE expires_at <= ?", (now,))
+            conn.execute("DELETE FROM hashes WHERE expires_at <= ?", (now,))
+
+    def get(self, key):
+        with self._pool.connection() as conn:
+            row = conn.execute(f"SELECT value FROM kv WHERE key = ? AND {_LIVE}", (key, time.time())).fetchone()
+        return None if row is None else str(row[0])
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                         (key, value, _expiry(ttl, now)))
+
+    def add(self, key, value, ttl=None):
+        # Set only if absent (or expired); True if this call set it
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "INSERT INTO kv (key, value, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+                "WHERE kv.expires_at <= ?",
+                (key, value, _expiry(ttl, now), now),
+            )
+            return cursor.rowcount == 1
+
+    def incr(self, key, amount=1, ttl=None):
+        # Add to an integer (absent counts as 0) and return the result; `ttl`
+        # applies when the counter is created, as with SET NX EX + INCRBY
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO kv (key, value, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET "
+                "value = CASE WHEN kv.expires_at <= ? THEN excluded.value ELSE CAST(kv.value AS INTEGER) + ? END, "
+                "expires_at = CASE WHEN kv.expires_at <= ? THEN excluded.expires_at ELSE kv.expires_at END",
+                (key, amount, _expiry(ttl, now), now, amount, now),
+            )
+            return int(conn.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()[0])
+
+    def delete(self, *keys):
+        with self._transaction() as conn:
+            conn.executemany("DELETE FROM kv WHERE key = ?", [(key,) for key in keys])
+            conn.executemany("DELETE FROM hashes WHERE key = ?", [(key,) for key in keys])
+
+    def delete_if(self, key, value):
+        # Delete only while the key holds `value`; True if this call deleted it
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                f"DELETE FROM kv WHERE key = ? AND value = ? AND {_LIVE}", (key, value, time.time())
+            )
+            return cursor.rowcount == 1
+
+    def hset(self, key, mapping, ttl=None):
+        # Set fields of a hash and (re)start its expiry
+        now = time.time()
+        expires_at = _expiry(ttl, now)
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM hashes WHERE key = ? AND expires_at <= ?", (key, now))
+            conn.executemany(
+                "INSERT OR REPLACE INTO hashes (key, field, value, expires_at) VALUES (?, ?, ?, ?)",
+                [(key, field, value, expires_at) for field, value in mapping.items()],
+            )
+            conn.execute("UPDATE hashes SET expires_at = ? WHERE key = ?", (expires_at, key))
+
+    def hdel(self, key, *fields):
+        with self._transaction() as conn:
+            conn.executemany("DELETE FROM hashes WHERE key = ? AND field = ?", [(key, field) for field in fields])
+
+    def hgetall(self, key):
+        with self._pool.connection() as conn:
+            rows = conn.execute(
+                f"SELECT field, value FROM hashes WHERE key = ? AND {_LIVE}", (key, time.time())
+            ).fetchall()
+        return {field: str(value) for field, value in rows}
+
+    def close(self):
+        self._pool.close()
+
+
+# ---- Redis protocol ----
+
+class _RedisConnection:
+    """One RESP2 connection; `execute` pipelines several commands in one round trip."""
+
+    def __init__(self, host, port, password=None, db=0, timeout=SHARED_STATE_TIMEOUT):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile("rb")
+        try:
+            if password:
+                self.execute(("AUTH", password))
+            if db:
+                self.execute(("SELECT", db))
+        except Exception:
+            self.close()
+            raise
+
+    @staticmethod
+    def _encode(command):
+        parts = [b"*%d\r\n" % len(command)]
+        for arg in command:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    def _read(self):
+        line = self.reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Shared state server closed the connection")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode("utf-8")
+        if kind == b"-":
+            return RuntimeError(payload.decode("utf-8", "replace"))
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self.reader.read(length + 2)
+            if len(data) != length + 2:
+                raise ConnectionError("Shared state server closed the connection")
+            return data[:-2].decode("utf-8")
+        if kind == b"*":
+            length = int(payload)
+            return None if length < 0 else [self._read() for _ in range(length)]
+        raise ConnectionError(f"Unexpected reply from the shared state server: {line[:40]!r}")
+
+    def execute(self, *commands):
+        # Returns one reply per command; an error reply is raised after all replies are read
+        self.sock.sendall(b"".join(self._encode(command) for command in commands))
+        replies = [self._read() for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RuntimeError):
+                raise reply
+        return replies
+
+    def close(self):
+        try:
+            self.reader.close()
+        finally:
+            self.sock.close()
+
+
+# Compare-and-delete, atomic on the server (redis_stub.py recognizes this exact script)
+DELETE_IF_SCRIPT = (
+    "if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) else return 0 end"
+)
+
+
+class RedisState:
+    """Shared state on a server speaking the Redis protocol (Redis, Valkey, KeyDB...).
+
+    Every operation maps onto commands that are atomic on the server; the few
+    that need two commands send them pipelined on one pooled connection.
+    """
+
+    def __init__(self, host="localhost", port=6379, password=None, db=0,
+                 max_connections=SHARED_STATE_POOL_SIZE, timeout=SHARED_STATE_TIMEOUT):
+        self._pool = _ConnectionPool(
+            lambda: _RedisConnection(host, port, password, db, timeout),
+            lambda conn: conn.close(),
+            max_connections,
+            # Error replies are raised only once every reply has been read
+            reusable=RuntimeError,
+        )
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        parsed = urlparse(url)
+        return cls(
+            host=parsed.hostname or "localhost",
+            port=parsed.port or 6379,
+            password=unquote(parsed.password) if parsed.password else None,
+            db=int(parsed.path.lstrip("/") or 0),
+            **kwargs,
+        )
+
+    def _execute(self, *commands):
+        with self._pool.connection() as conn:
+            return conn.execute(*commands)
+
+    @staticmethod
+    def _with_ttl(command, ttl):
+        return command + ("PX", int(ttl * 1000)) if ttl else command
+
+    def get(self, key):
+        return self._execute(("GET", key))[0]
+
+    def set(self, key, value, ttl=None):
+        self._execute(self._with_ttl(("SET", key, value), ttl))
+
+    def add(self, key, value, ttl=None):
+        return self._execute(self._with_ttl(("SET", key, value), ttl) + ("NX",))[0] == "OK"
+
+    def incr(self, key, amount=1, ttl=None):
+        if not ttl:
+            return self._execute(("INCRBY", key, amount))[0]
+        return self._execute(("SET", key, 0, "PX", int(ttl * 1000), "NX"), ("INCRBY", key, amount))[1]
+
+    def delete(self, *keys):
+        self._execute(("DEL",) + keys)
+
+    def delete_if(self, key, value):
+        return self._execute(("EVAL", DELETE_IF_SCRIPT, 1, key, value))[0] == 1
+
+    def hset(self, key, mapping, ttl=None):
+        commands = [("HSET", key) + tuple(item for pair in mapping.items() for item in pair)] if mapping else []
+        if ttl:
+            commands.append(("PEXPIRE", key, int(ttl * 1000)))
+        if commands:
+            self._execute(*commands)
+
+    def hdel(self, key, *fields):
+        self._execute(("HDEL", key) + fields)
+
+    def hgetall(self, key):
+        flat = self._execute(("HGETALL", key))[0] or []
+        return dict(zip(flat[::2], flat[1::2]))
+
+    def close(self):
+        self._pool.close()
+
+
+def open_shared_state(url):
+    scheme = urlparse(url).scheme
+    if scheme == "redis":
+        return RedisState.from_url(url)
+    if scheme == "sqlite":
+        # sqlite:///relative/path or sqlite:////absolute/path
+        path = url[len("sqlite:///"):] or os.path.join(DATA_DIR, "shared_state.sqlite3")
+        return SQLiteState(path)
+    raise ValueError(f"Unsupported SHARED_STATE_URL: {url!r}")
+
+
+_state = None
+_state_lock = threading.Lock()
+
+
+def get_shared_state():
+    # The configured backend, or None when state is kept per process
+    global _state
+    if not SHARED_STATE_URL:
+        return None
+    with _state_lock:
+        if _state is None:
+            _state = open_shared_state(SHARED_STATE_URL)
+            logger.info("Shared state: %s", urlparse(SHARED_STATE_URL).scheme)
+    return _state
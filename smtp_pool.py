@@ -0,0 +1,238 @@
+import logging
+import smtplib
+import socket
+import ssl
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import SMTP_FAILURES, SMTP_PHASE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+def is_connection_error(exc):
+    # True when the session itself is unusable rather than the message being rejected.
+    # SMTPException derives from OSError, so protocol replies must be excluded explicitly.
+    if isinstance(exc, smtplib.SMTPServerDisconnected):
+        return True
+    return isinstance(exc, OSError) and not isinstance(exc, smtplib.SMTPException)
+
+
+def classify_failure(exc, phase=None):
+    # Coarse cause of a failed phase, for the smtp_failures counter and the log.
+    # smtplib reports a timed out reply as SMTPServerDisconnected, chained to the timeout.
+    cause = exc
+    while cause is not None:
+        if isinstance(cause, (socket.timeout, TimeoutError)):
+            return "timeout"
+        cause = cause.__cause__ or cause.__context__
+    if isinstance(exc, smtplib.SMTPAuthenticationError) or (phase == "auth" and isinstance(exc, smtplib.SMTPException)):
+        return "auth"
+    if isinstance(exc, ssl.SSLError) or (phase == "starttls" and isinstance(exc, smtplib.SMTPException)):
+        return "tls"
+    code = None
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in exc.recipients.values()]
+        code = min(codes) if codes else None
+    elif isinstance(exc, smtplib.SMTPResponseException):
+        code = exc.smtp_code
+    if code is not None and 400 <= code < 600:
+        return f"{code // 100}xx"
+    if isinstance(exc, socket.gaierror):
+        return "dns"
+    if is_connection_error(exc):
+        return "connection"
+    return "other"
+
+
+class DeliveryTrace:
+    """What each phase of one delivery took and, if it failed, where and why."""
+
+    __slots__ = ("phases", "failure")
+
+    def __init__(self):
+        # [(phase, seconds)] in order; a phase can repeat (EHLO after STARTTLS, a retry)
+        self.phases = []
+        # (phase, kind) of the phase that raised
+        self.failure = None
+
+    def __str__(self):
+        text = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in self.phases) or "no phases"
+        if self.failure:
+            text += "; failed in {} ({})".format(*self.failure)
+        return text
+
+
+@contextmanager
+def phase(name, trace=None):
+    # Times one protocol step into smtp_phase_seconds and classifies its failure
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        elapsed = time.perf_counter() - start
+        kind = classify_failure(e, name)
+        SMTP_PHASE_SECONDS.observe(elapsed, phase=name, outcome="failed")
+        SMTP_FAILURES.inc(phase=name, kind=kind)
+        if trace is not None:
+            trace.phases.append((name, elapsed))
+            trace.failure = (name, kind)
+        raise
+    elapsed = time.perf_counter() - start
+    SMTP_PHASE_SECONDS.observe(elapsed, phase=name, outcome="ok")
+    if trace is not None:
+        trace.phases.append((name, elapsed))
+
+
+class _PooledConnection:
+    __slots__ = ("smtp", "created_at", "last_used")
+
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.created_at = self.last_used = time.monotonic()
+
+
+class SMTPConnectionPool:
+    """Keeps authenticated SMTP sessions open and hands them out to senders.
+
+    At most `max_size` sessions exist at once; callers beyond that block in
+    `sendmail()` until one is returned. Idle sessions are checked with NOOP
+    before reuse and replaced when the server has dropped them.
+
+    Every protocol step is timed per phase (see `phase`); pass a DeliveryTrace
+    to `sendmail` to also get the steps of that one delivery.
+    """
+
+    def __init__(self, host, port, username=None, password=None, max_size=4,
+                 max_idle=120, health_check_after=5, starttls=True, timeout=30, connect_timeout=10, ssl_context=None):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.health_check_after = health_check_after
+        self.starttls = starttls
+        # Socket timeouts: connect_timeout until the greeting, then timeout per command
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        # Certificates are verified against the system's CAs unless a context is given
+        self._context = ssl_context or (ssl.create_default_context() if starttls else None)
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._closed = False
+
+    def _connect(self, trace=None):
+        # Connecting through the constructor also records the host name, which
+        # STARTTLS checks the server's certificate against
+        with phase("connect", trace):
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.connect_timeout)
+        try:
+            smtp.timeout = self.timeout
+            smtp.sock.settimeout(self.timeout)
+            with phase("ehlo", trace):
+                smtp.ehlo()
+            if self.starttls:
+                with phase("starttls", trace):
+                    smtp.starttls(context=self._context)
+                with phase("ehlo", trace):
+                    smtp.ehlo()
+            if self.username and self.password:
+                with phase("auth", trace):
+                    smtp.login(self.username, self.password)
+        except Exception:
+            self._discard(smtp)
+            raise
+        return _PooledConnection(smtp)
+
+    @staticmethod
+    def _discard(smtp):
+        if smtp.sock is None:
+            # Never connected, or already closed
+            return
+        try:
+            with phase("quit"):
+                smtp.quit()
+        except Exception:
+            try:
+                smtp.close()
+            except Exception:
+                pass
+
+    def _is_healthy(self, conn):
+        idle_for = time.monotonic() - conn.last_used
+        if idle_for > self.max_idle:
+            return False
+        if idle_for < self.health_check_after:
+            return True
+        try:
+            with phase("noop"):
+                code, _ = conn.smtp.noop()
+        except (smtplib.SMTPException, OSError):
+            return False
+        return code == 250
+
+    def _checkout(self, trace=None):
+        # Reuse the most recently returned session that is still alive
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                return self._connect(trace), False
+            if self._is_healthy(conn):
+                return conn, True
+            self._discard(conn.smtp)
+
+    def _checkin(self, conn):
+        conn.last_used = time.monotonic()
+        with self._lock:
+            if not self._closed:
+                self._idle.append(conn)
+                return
+        self._discard(conn.smtp)
+
+    def _release(self, conn, exc=None):
+        if exc is not None and is_connection_error(exc):
+            self._discard(conn.smtp)
+        else:
+            self._checkin(conn)
+
+    def sendmail(self, from_addr, to_addrs, msg, trace=None):
+        if self._closed:
+            raise RuntimeError("SMTP connection pool is closed")
+        # Time blocked because all max_size sessions are busy
+        with phase("pool_wait", trace):
+            self._slots.acquire()
+        try:
+            conn, reused = self._checkout(trace)
+            try:
+                with phase("data", trace):
+                    result = conn.smtp.sendmail(from_addr, to_addrs, msg)
+            except BaseException as e:
+                self._release(conn, e)
+                if not (reused and is_connection_error(e)):
+                    raise
+                # The server dropped a session that passed the health check; retry once on a fresh one
+                logger.info("Pooled SMTP session to %s was dropped, reconnecting", self.host)
+                if trace is not None:
+                    trace.failure = None
+                conn = self._connect(trace)
+                try:
+                    with phase("data", trace):
+                        result = conn.smtp.sendmail(from_addr, to_addrs, msg)
+                except BaseException as e:
+                    self._release(conn, e)
+                    raise
+            self._release(conn)
+            return result
+        finally:
+            self._slots.release()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._discard(conn.smtp)
@@ -0,0 +1,435 @@
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from datetime import date, datetime
+
+import aggregates
+import search
+from serializers import json_default
+from settings import DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+STORE_PATH = os.getenv("STORE_PATH", os.path.join(DATA_DIR, "submissions.sqlite3"))
+# Concurrent saves arriving within STORE_BATCH_WAIT seconds share one commit (and one fsync)
+STORE_BATCH_SIZE = int(os.getenv("STORE_BATCH_SIZE", 64))
+STORE_BATCH_WAIT = float(os.getenv("STORE_BATCH_WAIT", 0.005))
+STORE_WRITE_TIMEOUT = 30
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS submissions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    phys_country TEXT,
+    phys_name TEXT,
+    phys_email TEXT,
+    phys_hospital TEXT,
+    tcell_diagnosis TEXT,
+    subtype TEXT,
+    num_therapies TEXT,
+    prev_transplant TEXT,
+    sign_date TEXT,
+    payload TEXT NOT NULL,
+    idempotency_key TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_submissions_country ON submissions (phys_country);
+CREATE INDEX IF NOT EXISTS idx_submissions_diagnosis ON submissions (tcell_diagnosis, subtype);
+CREATE INDEX IF NOT EXISTS idx_submissions_subtype ON submissions (subtype);
+CREATE INDEX IF NOT EXISTS idx_submissions_sign_date ON submissions (sign_date);
+CREATE INDEX IF NOT EXISTS idx_submissions_email ON submissions (phys_email);
+CREATE INDEX IF NOT EXISTS idx_submissions_created_at ON submissions (created_at);
+"""
+
+# Columns added after the first release, created on existing databases at startup
+_ADDED_COLUMNS = {"idempotency_key": "TEXT"}
+_POST_MIGRATION = """
+CREATE UNIQUE INDEX IF NOT EXISTS idx_submissions_idempotency_key ON submissions (idempotency_key);
+"""
+
+# Columns extracted from form_data; everything else is only kept in `payload`
+_COLUMNS = (
+    "created_at", "phys_country", "phys_name", "phys_email", "phys_hospital",
+    "tcell_diagnosis", "subtype", "num_therapies", "prev_transplant", "sign_date", "payload",
+    "idempotency_key",
+)
+# Columns shown in listings, i.e. everything but the payload
+_SUMMARY_COLUMNS = ("id",) + _COLUMNS[:-2]
+# A repeated idempotency key inserts nothing; the writer then returns the existing id
+_INSERT = "INSERT INTO submissions ({}) VALUES ({}) ON CONFLICT (idempotency_key) DO NOTHING".format(
+    ", ".join(_COLUMNS), ", ".join("?" for _ in _COLUMNS)
+)
+
+
+def _subtype(form_data):
+    if form_data.get("tcell_diagnosis") == "CTCL":
+        return form_data.get("ctcl_subtype")
+    return form_data.get("ptcl_subtype")
+
+
+def _sign_date(form_data):
+    value = form_data.get("sign_date")
+    if isinstance(value, datetime):
+        value = value.date()
+    return value.isoformat() if isinstance(value, date) else value
+
+
+def to_row(form_data, created_at=None, idempotency_key=None):
+    return (
+        created_at or time.time(),
+        form_data.get("phys_country"),
+        form_data.get("phys_name"),
+        form_data.get("phys_email"),
+        form_data.get("phys_hospital"),
+        form_data.get("tcell_diagnosis"),
+        _subtype(form_data),
+        form_data.get("num_therapies"),
+        form_data.get("prev_transplant"),
+        _sign_date(form_data),
+        json.dumps(form_data, default=json_default, sort_keys=True),
+        idempotency_key,
+    )
+
+
+def _migrate(conn):
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(submissions)")}
+    for column, kind in _ADDED_COLUMNS.items():
+        if column not in existing:
+            conn.execute(f"ALTER TABLE submissions ADD COLUMN {column} {kind}")
+    conn.executescript(_POST_MIGRATION)
+
+
+class SubmissionStore:
+    """Embedded SQLite store for submitted forms.
+
+    Writes go through a single writer thread that groups concurrent saves into
+    one transaction; reads use per-thread connections and, thanks to WAL mode,
+    never wait for (or block) the writer.
+    """
+
+    def __init__(self, path=STORE_PATH, batch_size=STORE_BATCH_SIZE, batch_wait=STORE_BATCH_WAIT):
+        self.path = path
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._writer_conn = self._connect()
+        self._writer_conn.execute("PRAGMA journal_mode=WAL")
+        self._writer_conn.execute("PRAGMA synchronous=FULL")
+        self._writer_conn.executescript(_SCHEMA)
+        _migrate(self._writer_conn)
+        self._init_aggregates()
+        self._init_search()
+        self._local = threading.local()
+        self._pending = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="submission-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=STORE_WRITE_TIMEOUT)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _reader(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+            conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    # ---- Writes ----
+
+    def save(self, form_data, timeout=STORE_WRITE_TIMEOUT):
+        # Blocks until the record is committed and returns its id
+        return self.save_once(form_data, None, timeout)[0]
+
+    def save_once(self, form_data, idempotency_key, timeout=STORE_WRITE_TIMEOUT):
+        # Like save(), but a record with the same idempotency key is stored only once.
+        # Returns (id, created); `created` is False when the key was already present.
+        future = Future()
+        row = to_row(form_data, idempotency_key=idempotency_key)
+        self._pending.put((row, aggregates.increments(form_data), search.document(form_data), future))
+        return future.result(timeout)
+
+    def submit_many(self, items):
+        # save_once() for many records without waiting, e.g. a bulk intake chunk: all
+        # are queued at once, so the writer commits them STORE_BATCH_SIZE per transaction.
+        # items: (form_data, idempotency_key) pairs; returns futures of (id, created).
+        futures = []
+        for form_data, idempotency_key in items:
+            future = Future()
+            row = to_row(form_data, idempotency_key=idempotency_key)
+            self._pending.put((row, aggregates.increments(form_data), search.document(form_data), future))
+            futures.append(future)
+        return futures
+
+    def save_many(self, items, timeout=STORE_WRITE_TIMEOUT):
+        return [future.result(timeout) for future in self.submit_many(items)]
+
+    def _write_loop(self):
+        while True:
+            batch = [self._pending.get()]
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        batch.append(self._pending.get(timeout=remaining))
+                    else:
+                        batch.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            self._commit_batch(batch)
+
+    def _commit_batch(self, batch):
+        conn = self._writer_conn
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            results = []
+            counted = []
+            indexed = []
+            for row, pairs, document, _ in batch:
+                cur = conn.execute(_INSERT, row)
+                if cur.rowcount:
+                    results.append((cur.lastrowid, True))
+                    counted.extend(pairs)
+                    indexed.append((cur.lastrowid, document))
+                else:
+                    (existing_id,) = conn.execute(
+                        "SELECT id FROM submissions WHERE idempotency_key = ?", (row[-1],)
+                    ).fetchone()
+                    results.append((existing_id, False))
+            # Statistics change in the same transaction as the rows they count
+            aggregates.apply(conn, counted)
+            if self.searchable:
+                search.apply(conn, indexed)
+            conn.execute("COMMIT")
+        except Exception as e:
+            logger.exception("Failed to commit %s submission(s)", len(batch))
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for *_, future in batch:
+                future.set_exception(e)
+            return
+        for (*_, future), result in zip(batch, results):
+            future.set_result(result)
+
+    # ---- Aggregates ----
+
+    def _init_aggregates(self):
+        # Databases created before the aggregates existed are counted once, at startup
+        conn = self._writer_conn
+        conn.executescript(aggregates.SCHEMA)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM aggregates LIMIT 1").fetchone() is None:
+                pairs = [
+                    pair for (payload,) in conn.execute("SELECT payload FROM submissions")
+                    for pair in aggregates.increments(json.loads(payload))
+                ]
+                aggregates.apply(conn, pairs)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def aggregates(self):
+        # {dimension: {value: count}}, read from the precomputed table
+        return aggregates.read(self._reader())
+
+    def check_aggregates(self):
+        conn = self._reader()
+        # Both reads in one transaction, so they see the same snapshot
+        conn.execute("BEGIN")
+        try:
+            return aggregates.diff(aggregates.read(conn), aggregates.compute(conn))
+        finally:
+            conn.execute("COMMIT")
+
+    def rebuild_aggregates(self):
+        # Recompute under the write lock so no insert is counted twice or missed
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                computed = aggregates.compute(conn)
+                mismatches = aggregates.diff(aggregates.read(conn), computed)
+                aggregates.replace(conn, computed)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+        return mismatches
+
+    # ---- Full-text search ----
+
+    def _init_search(self):
+        # Submissions stored before the index existed (or by an SQLite without FTS5)
+        # are indexed at startup; without FTS5 the store works but can't search
+        conn = self._writer_conn
+        try:
+            conn.executescript(search.SCHEMA)
+        except sqlite3.OperationalError as e:
+            logger.warning("Full-text search is disabled: %s", e)
+            self.searchable = False
+            return
+        self.searchable = True
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT id, payload FROM submissions WHERE id > ?", (search.last_indexed(conn),)
+            ).fetchall()
+            search.apply(conn, [(row[0], search.document(json.loads(row[1]))) for row in rows])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if rows:
+            logger.info("Indexed %s submission(s) for full-text search", len(rows))
+
+    def rebuild_search(self):
+        # Reindex everything under the write lock; returns the number of submissions
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute("SELECT id, payload FROM submissions").fetchall()
+                search.replace(conn, [(row[0], search.document(json.loads(row[1]))) for row in rows])
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+        return len(rows)
+
+    def _text_match(self, text):
+        if not self.searchable:
+            raise RuntimeError("Full-text search needs an SQLite built with FTS5")
+        return search.compile_query(text)
+
+    # ---- Reads ----
+
+    def get(self, submission_id):
+        row = self._reader().execute(
+            "SELECT * FROM submissions WHERE id = ?", (submission_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def id_for_key(self, idempotency_key):
+        row = self._reader().execute(
+            "SELECT id FROM submissions WHERE idempotency_key = ?", (idempotency_key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def count(self):
+        return self._reader().execute("SELECT COUNT(*) FROM submissions").fetchone()[0]
+
+    def last_id(self):
+        # Grows with every insert from any process; used as a cheap cache generation
+        return self._reader().execute("SELECT MAX(id) FROM submissions").fetchone()[0] or 0
+
+    def iter_all(self, chunk_size=1000, after_id=0):
+        # Every submission in id order, fetched in chunks by keyset pagination so
+        # memory use stays flat however many rows there are
+        while True:
+            rows = self._reader().execute(
+                "SELECT id, created_at, payload FROM submissions WHERE id > ? ORDER BY id LIMIT ?",
+                (after_id, chunk_size),
+            ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield row["id"], row["created_at"], json.loads(row["payload"])
+            after_id = rows[-1]["id"]
+
+    @staticmethod
+    def _where(filters, created_from=None, created_to=None):
+        unknown = set(filters) - set(_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown submission columns: {', '.join(sorted(unknown))}")
+        clauses = [f"{column} = ?" for column in filters]
+        params = list(filters.values())
+        if created_from is not None:
+            clauses.append("created_at >= ?")
+            params.append(created_from)
+        if created_to is not None:
+            clauses.append("created_at < ?")
+            params.append(created_to)
+        return " AND ".join(clauses) or "1", params
+
+    def find(self, limit=100, **filters):
+        # Equality filters on indexed columns, newest first
+        where, params = self._where(filters)
+        rows = self._reader().execute(
+            f"SELECT * FROM submissions WHERE {where} ORDER BY id DESC LIMIT ?",
+            (*params, limit),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def list_page(self, limit=50, before_id=None, created_from=None, created_to=None, text=None, **filters):
+        # One page of summaries, newest first. Keyset pagination: pass the last id of
+        # a page as `before_id` to get the next one, which costs the same at any depth.
+        # With `text` (a search.py query) only submissions whose free-text answers
+        # match are listed, each with an `excerpt` around the match.
+        where, params = self._where(filters, created_from, created_to)
+        if text:
+            match = self._text_match(text)
+            if match is None:
+                return []
+            # CROSS JOIN keeps the index as the outer loop: it is walked newest first and stops
+            # after `limit` hits that pass the filters, instead of probing it once per filtered row
+            if before_id is not None:
+                where += " AND submission_text.rowid < ?"
+                params.append(before_id)
+            sql = (
+                f"SELECT {', '.join(_SUMMARY_COLUMNS)}, "
+                f"snippet(submission_text, -1, '[', ']', '…', 12) AS excerpt "
+                f"FROM submission_text CROSS JOIN submissions ON submissions.id = submission_text.rowid "
+                f"WHERE submission_text MATCH ? AND {where} ORDER BY submission_text.rowid DESC LIMIT ?"
+            )
+            params.insert(0, match)
+        else:
+            if before_id is not None:
+                where += " AND id < ?"
+                params.append(before_id)
+            sql = f"SELECT {', '.join(_SUMMARY_COLUMNS)} FROM submissions WHERE {where} ORDER BY id DESC LIMIT ?"
+        rows = self._reader().execute(sql, (*params, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    def count_matching(self, created_from=None, created_to=None, text=None, **filters):
+        where, params = self._where(filters, created_from, created_to)
+        if not text:
+            return self._reader().execute(f"SELECT COUNT(*) FROM submissions WHERE {where}", params).fetchone()[0]
+        match = self._text_match(text)
+        if match is None:
+            return 0
+        if where == "1":
+            # Only the index needs reading; otherwise each match is looked up, as in list_page()
+            sql = "SELECT COUNT(*) FROM submission_text WHERE submission_text MATCH ?"
+        else:
+            sql = (
+                f"SELECT COUNT(*) FROM submission_text CROSS JOIN submissions ON submissions.id = submission_text.rowid "
+                f"WHERE submission_text MATCH ? AND {where}"
+            )
+        return self._reader().execute(sql, (match, *params)).fetchone()[0]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    # One store (and writer thread) per process, shared by every Streamlit session
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SubmissionStore()
+    return _store
@@ -0,0 +1,270 @@
+from dataclasses import dataclass
+from datetime import date
+from typing import Callable, Optional, Tuple
+
+from form_schema import FIELDS, PAGES, SECTION_OF, is_field_active
+
+# Whole-form validation. Every check is built once at import from the schema in
+# form_schema.py; a Validator then re-runs only the checks whose inputs changed.
+
+PAGE_OF = {
+    field.name: page
+    for page, sections in PAGES.items() for top in sections for section in top.walk() for field in section.fields
+}
+
+
+@dataclass(frozen=True)
+class Problem:
+    field: str
+    message: str
+    # Missing answers are only reported at submit; anything else is shown as soon as it is entered
+    missing: bool = False
+
+    @property
+    def page(self):
+        return PAGE_OF[self.field]
+
+    @property
+    def label(self):
+        heading = SECTION_OF[self.field].heading
+        label = FIELDS[self.field].label.rstrip(" .:")
+        return f"{heading} – {label}" if heading else label
+
+
+@dataclass(frozen=True)
+class CrossRule:
+    # Fields the check reads: it is re-run whenever one of them changes
+    fields: Tuple[str, ...]
+    # Field the problem is reported against; nothing is reported while it is not shown
+    field: str
+    check: Callable[[dict], Optional[str]]
+    missing: bool = False
+
+
+# ---- Per-field checks ----
+# Each check takes the answer (never None) and returns an error message or None
+
+def _is_blank(field, value):
+    if field.options is not None and field.options.placeholder is not None:
+        return value == field.options.placeholder
+    if isinstance(value, list):
+        # Only a multiselect answer is a list; any other field fails its type check
+        return not value and field.widget == "multiselect"
+    return value in ("", False) or (isinstance(value, str) and not value.strip())
+
+
+def _is_option(options, value):
+    # Options are text or whole numbers; answers from bulk input can be anything,
+    # and a list or an object cannot even be looked up
+    return isinstance(value, (str, int)) and not isinstance(value, bool) and value in options
+
+
+def _type_check(field):
+    if field.widget == "multiselect":
+        options = field.options
+        return lambda value: None if isinstance(value, list) and all(_is_option(options, v) for v in value) \
+            else "Contains an option that is not available."
+    if field.options is not None:
+        options = field.options
+        return lambda value: None if _is_option(options, value) else "Not one of the available options."
+    if field.widget == "number":
+        return lambda value: None if isinstance(value, (int, float)) and not isinstance(value, bool) \
+            else "Must be a number."
+    expected, error = {
+        "text": (str, "Must be text."),
+        "checkbox": (bool, "Must be checked or unchecked."),
+        "date": (date, "Must be a date."),
+    }[field.widget]
+    return lambda value: None if isinstance(value, expected) else error
+
+
+def _compile_field(field):
+    checks = [_type_check(field)]
+    if field.pattern is not None:
+        pattern, error = field.pattern, field.pattern_error
+        checks.append(lambda value: error if value and not pattern.fullmatch(value) else None)
+    if field.min_value is not None:
+        minimum = field.min_value
+        checks.append(lambda value: f"Must be at least {minimum}." if value < minimum else None)
+    if field.widget == "date":
+        checks.append(lambda value: "Cannot be in the future." if value > date.today() else None)
+    return tuple(checks)
+
+
+FIELD_CHECKS = {name: _compile_field(field) for name, field in FIELDS.items()}
+
+
+def check_field(name, value):
+    # Problems of one answer on its own, ignoring whether the field is shown
+    field = FIELDS[name]
+    if value is None or _is_blank(field, value):
+        return (Problem(name, "This field is required.", missing=True),) if field.required else ()
+    for check in FIELD_CHECKS[name]:
+        message = check(value)
+        if message:
+            # Later checks may assume the type check passed
+            return (Problem(name, message),)
+    return ()
+
+
+# ---- Cross-field rules ----
+
+def _diagnosis_after_birth(form_data):
+    birth, diagnosis = form_data.get("birth_year"), form_data.get("diag_year")
+    if isinstance(birth, int) and isinstance(diagnosis, int) and diagnosis < birth:
+        return "The initial diagnosis cannot be before the birth year."
+    return None
+
+
+def _therapy_count(form_data):
+    value = form_data.get("num_therapies")
+    return int(value) if isinstance(value, str) and value.isdigit() else None
+
+
+def _therapy_line_rules(line):
+    prefix = f"therapy{line}"
+    fields = tuple(f"{prefix}_{part}" for part in ("type", "cycles", "outcome", "duration"))
+
+    def described(form_data):
+        # Lines up to num_therapies must say which therapy was given (an answer that is
+        # not text is reported by its type check)
+        count = _therapy_count(form_data)
+        value = form_data.get(fields[0])
+        if count is not None and line <= count and (value is None or isinstance(value, str) and not value.strip()):
+            return "Please describe this line of therapy."
+        return None
+
+    def beyond_count(form_data):
+        # ...and lines beyond it must be empty (the form prunes them; bulk input may not)
+        count = _therapy_count(form_data)
+        if count is not None and line > count and any(form_data.get(name) not in (None, "") for name in fields):
+            return f"Line {line} therapy is filled in, but only {count} prior therapies were given."
+        return None
+
+    return (
+        CrossRule(("num_therapies", fields[0]), fields[0], described, missing=True),
+        CrossRule(("num_therapies",) + fields, "num_therapies", beyond_count),
+    )
+
+
+CROSS_RULES = (
+    CrossRule(("birth_year", "diag_year"), "diag_year", _diagnosis_after_birth),
+) + tuple(rule for line in (1, 2, 3) for rule in _therapy_line_rules(line))
+
+_RULES_READING = {name: tuple(i for i, rule in enumerate(CROSS_RULES) if name in rule.fields) for name in FIELDS}
+_RULES_REPORTING = {name: tuple(i for i, rule in enumerate(CROSS_RULES) if rule.field == name) for name in FIELDS}
+_FIELD_INDEX = {name: i for i, name in enumerate(FIELDS)}
+_UNSEEN = object()
+
+
+def _fingerprint(form_data, name):
+    # Cheap comparable form of one answer: the stored code for a FormRecord
+    # (an int for choices and multiselects), the value itself for a plain dict
+    if isinstance(form_data, dict):
+        value = form_data.get(name)
+        return tuple(value) if isinstance(value, list) else value
+    return getattr(form_data, name, None)
+
+
+class Validator:
+    """Validation results for one form, kept up to date incrementally.
+
+    `refresh` compares each answer with the one last validated and re-runs only
+    the checks of answers that changed (and the cross-field rules reading them),
+    so calling it on every rerun costs a comparison per field.
+    """
+
+    __slots__ = ("_seen", "_field_problems", "_rule_problems")
+
+    def __init__(self):
+        # Last validated fingerprint per field, in schema order (a list is much
+        # smaller than a dict keyed by field name, and there is one per session)
+        self._seen = [_UNSEEN] * len(FIELDS)
+        self._field_problems = {}
+        self._rule_problems = {}
+
+    def reset(self):
+        # Forget every result, e.g. while the session's answers are spilled to disk;
+        # the next refresh re-checks everything
+        self._seen = None
+        self._field_problems = {}
+        self._rule_problems = {}
+
+    def refresh(self, form_data, names=None):
+        # Returns the names of the answers that changed since they were last validated
+        changed = []
+        if self._seen is None:
+            self._seen = [_UNSEEN] * len(FIELDS)
+        for name in FIELDS if names is None else names:
+            fingerprint = _fingerprint(form_data, name)
+            index = _FIELD_INDEX[name]
+            if self._seen[index] is _UNSEEN or self._seen[index] != fingerprint:
+                self._seen[index] = fingerprint
+                changed.append(name)
+                # Only problems are kept, so a valid form costs one entry per field
+                problems = check_field(name, form_data.get(name))
+                if problems:
+                    self._field_problems[name] = problems
+                else:
+                    self._field_problems.pop(name, None)
+        for i in {i for name in changed for i in _RULES_READING[name]}:
+            rule = CROSS_RULES[i]
+            message = rule.check(form_data)
+            if message:
+                self._rule_problems[i] = (Problem(rule.field, message, rule.missing),)
+            else:
+                self._rule_problems.pop(i, None)
+        return changed
+
+    def _problems_of(self, name):
+        yield from self._field_problems.get(name, ())
+        for i in _RULES_REPORTING[name]:
+            yield from self._rule_problems.get(i, ())
+
+    def field_problems(self, name, form_data):
+        # Problems to show next to one field as it is rendered (missing answers wait for submit)
+        self.refresh(form_data, {name}.union(*(CROSS_RULES[i].fields for i in _RULES_REPORTING[name])))
+        return [problem for problem in self._problems_of(name) if not problem.missing]
+
+    def problems(self, form_data):
+        # Every problem of the fields currently shown, in form order
+        self.refresh(form_data)
+        return _shown(form_data, self._field_problems.values(), self._rule_problems.values())
+
+
+def _shown(form_data, *groups):
+    # Problems of active fields only, in form order; visibility is only evaluated
+    # when there is something to report
+    problems = [problem for group in groups for problems in group for problem in problems]
+    if not problems:
+        return []
+    candidates = {problem.field for problem in problems}
+    inactive = {name for name in candidates if not is_field_active(name, form_data)}
+    # Stable sort: a field's own problems stay ahead of cross-field ones
+    return sorted((p for p in problems if p.field not in inactive), key=lambda p: _FIELD_INDEX[p.field])
+
+
+def validate(form_data):
+    # One-off validation of a complete set of answers, e.g. from bulk intake
+    field_problems = [check_field(name, form_data.get(name)) for name in FIELDS]
+    rule_problems = []
+    for rule in CROSS_RULES:
+        message = rule.check(form_data)
+        if message:
+            rule_problems.append((Problem(rule.field, message, rule.missing),))
+    return _shown(form_data, field_problems, rule_problems)
+
+
+def format_problems(problems):
+    # Markdown list of problems, in form order, for the consolidated message at submit
+    return "\n".join(f"- **Page {p.page}, {p.label}:** {p.message}" for p in problems)
+
+
+# ---- Session glue ----
+
+def session_validator():
+    import streamlit as st
+
+    if "validator" not in st.session_state:
+        st.session_state.validator = Validator()
+    return st.session_state.validator